@@ -1,113 +1,168 @@
-from ultralytics import YOLO
+import atexit
 import cv2 as cv
-import torch
+import numpy as np
 import os
+from association import associate
+from tiling import detect, detect_many
+from detections import Detections
+import metrics
+from image_sink import AsyncImageWriter
 
-def crop_boxes_from_image(yolo, image, license_plate_car_ioa=0.85, confidence=0.25,
-                          iou = 0.7, save_prediction = False):
-    result = yolo(image, conf=confidence, iou=iou, verbose=False)[0]
-    if save_prediction is True:
+# kolory (BGR) ramek aut, tablic przypisanych do aut i tablic nieprzypisanych
+CAR_COLOR = (255, 128, 0)
+PLATE_COLOR = (0, 200, 0)
+UNATTACHED_PLATE_COLOR = (0, 0, 255)
+
+# domyslny zapis obrazow z oznaczeniami, tworzony przy pierwszym uzyciu
+_prediction_writer = None
+
+def get_prediction_writer():
+    global _prediction_writer
+    if _prediction_writer is None:
         dir_path = os.path.dirname(os.path.realpath(__file__))
-        save_path = os.path.join(dir_path, "..", "results",
-                                 "prediction.jpg")
-        result.save(filename=save_path)
-    cars = []
-    license_plates = []
-    for cls, box in zip(map(int, map(torch.Tensor.tolist, result.boxes.cls)),
-                        [list(map(int, box)) for box in map(torch.Tensor.tolist, result.boxes.xyxy)]):
-        if cls == 0:
-            # [wyciete auto, bounding box]
-            cars.append([image[box[1]:box[3], box[0]:box[2]], box])
-        else:
-            # [wycieta tablica rejestracyjna, bounding box, pole powierzchni rejestracji,
-            # czy rejestracja zostala przypisana do jakiegos auta]
-            license_plates.append([image[box[1]:box[3], box[0]:box[2]], box,
-                                   (box[2] - box[0]) * (box[3] - box[1]), False])
+        _prediction_writer = AsyncImageWriter(os.path.join(dir_path, "..", "results"), prefix="prediction")
+        # zapisanie oczekujacych obrazow przed zakonczeniem programu
+        atexit.register(_prediction_writer.close)
+    return _prediction_writer
 
-    # usuwanie wykrytych dwukrotnie tablic rejestracyjnych, poprzez wybranie wiekszej
-    indices_to_remove = []
-    for i in range(len(license_plates)):
-        license_plate_i_left_top_x = license_plates[i][1][0]
-        license_plate_i_left_top_y = license_plates[i][1][1]
-        license_plate_i_bottom_right_x = license_plates[i][1][2]
-        license_plate_i_bottom_right_y = license_plates[i][1][3]
-        for j in range(i+1, len(license_plates)):
-            x = (min(license_plate_i_bottom_right_x, license_plates[j][1][2])
-                 - max(license_plate_i_left_top_x, license_plates[j][1][0]))
-            y = (min(license_plate_i_bottom_right_y, license_plates[j][1][3])
-                 - max(license_plate_i_left_top_y, license_plates[j][1][1]))
-            # jesli tablic sie pokrywaja, usuwamy mniejsza z nich
-            if x > 0 and y > 0:
-                if license_plates[i][2] > license_plates[j][2]:
-                    indices_to_remove.append(j)
-                else:
-                    indices_to_remove.append(i)
-    for index in indices_to_remove:
-        license_plates.pop(index)
+# narysowanie wykrytych aut i tablic na kopii obrazu, przy podanym max_size
+# (szerokosc, wysokosc) obraz jest najpierw zmniejszany do rozdzielczosci wyswietlania
+def draw_annotations(image, association, max_size=None):
+    scale = 1.
+    if max_size is not None:
+        scale = min(max_size[0] / image.shape[1], max_size[1] / image.shape[0], 1.)
+    if scale < 1.:
+        annotated = cv.resize(image, (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale))),
+                              interpolation=cv.INTER_AREA)
+    else:
+        annotated = image.copy()
+    thickness = max(1, round(max(annotated.shape[:2]) / 400))
+    boxes = [(association.car_boxes, CAR_COLOR, "auto")]
+    boxes.append((association.plate_boxes[~association.unattached], PLATE_COLOR, "tablica"))
+    boxes.append((association.plate_boxes[association.unattached], UNATTACHED_PLATE_COLOR, "tablica"))
+    for box_array, color, label in boxes:
+        for x1, y1, x2, y2 in np.round(box_array * scale).astype(int).tolist():
+            cv.rectangle(annotated, (x1, y1), (x2, y2), color, thickness)
+            cv.putText(annotated, label, (x1, max(y1 - 3, 10)), cv.FONT_HERSHEY_SIMPLEX,
+                       0.4 * thickness, color, thickness)
+    return annotated
 
+# detekcja aut i tablic rejestracyjnych. Przy return_annotated=True zwracana jest
+# para (pary, obraz z oznaczeniami w rozdzielczosci annotated_size), a przy
+# save_prediction=True obraz z oznaczeniami w pelnej rozdzielczosci zapisywany jest
+# w tle do pliku o unikalnej nazwie w folderze results. detection_mode wybiera
+# detekcje na calym obrazie, na kafelkach lub zgrubna, a nastepnie dokladna
+# (tiling.DETECTION_MODES) dla obrazow o duzej rozdzielczosci. Przy
+# return_detections=True zamiast par zwracany jest zwarty obiekt Detections.
+# W trybie "full" detekcje moga pochodzic z detection_cache.DetectionCache, wtedy
+# detektor uruchamiany jest tylko dla obrazow, ktorych nie ma w pamieci
+def crop_boxes_from_image(yolo, image, license_plate_car_ioa=0.85, confidence=0.25,
+                          iou = 0.7, save_prediction = False, return_boxes = False,
+                          association_method = "greedy", return_annotated = False,
+                          annotated_size = None, detection_mode = "full", tile_size = 640,
+                          tile_overlap = 0.2, return_detections = False, detection_cache = None):
+    with metrics.timer("detection"):
+        if detection_cache is not None and detection_mode == "full":
+            boxes, classes, scores = detection_cache.detect(image, confidence, iou)
+        else:
+            boxes, classes, scores = detect(yolo, image, detection_mode, confidence, iou, tile_size, tile_overlap)
+    return _associate_detections(image, boxes, classes, scores, license_plate_car_ioa, save_prediction,
+                                 return_boxes, association_method, return_annotated, annotated_size,
+                                 return_detections)
 
-    # lista indeksow aut do ktorych przypisano dokladnie jedna rejestracje
-    single_license_plate_car_indices = []
-    # lista indeksow aut do ktorych przypisano ponad jedna rejestracje
-    multiple_license_plate_car_indices = []
-    # lista list indeksow tablic rejestracyjnych przypisanych do danego auta
-    car_license_plate_indices_list = []
-    for i, car in enumerate(cars):
-        #lista indeksow tablic rejestracyjnych przypisanych do danego auta
-        license_plate_indices = []
-        for j, license_plate in enumerate(license_plates):
-            x = min(license_plate[1][2], car[1][2]) - max(license_plate[1][0], car[1][0])
-            y = min(license_plate[1][3], car[1][3]) - max(license_plate[1][1], car[1][1])
-            # sprawdzenie czy stosunek pola powierzchni iloczynu bounding boxa
-            # rejestracji oraz bounding boxa auta do pola powierzchni rejestracji
-            # przekracza zadany prog w celu przypisania danej rejestracji do
-            # danego auta
-            if x > 0 and y > 0 and ((x * y / license_plate[2]) >= license_plate_car_ioa):
-                license_plate_indices.append(j)
-                license_plate[3] = True
-        car_license_plate_indices_list.append(license_plate_indices)
-        if len(license_plate_indices) == 1:
-            single_license_plate_car_indices.append(i)
-        if len(license_plate_indices) > 1:
-            multiple_license_plate_car_indices.append(i)
+# detekcja aut i tablic na wielu obrazach (np. klatkach z kilku kamer) w jednym
+# wywolaniu detektora, wynik dla kazdego obrazu taki jak z crop_boxes_from_image
+def crop_boxes_from_images(yolo, images, license_plate_car_ioa=0.85, confidence=0.25,
+                           iou = 0.7, save_prediction = False, return_boxes = False,
+                           association_method = "greedy", return_annotated = False,
+                           annotated_size = None, detection_mode = "full", tile_size = 640,
+                           tile_overlap = 0.2, return_detections = False, detection_cache = None):
+    with metrics.timer("detection"):
+        if detection_cache is not None and detection_mode == "full":
+            detected = detection_cache.detect_many(images, confidence, iou)
+        else:
+            detected = detect_many(yolo, images, detection_mode, confidence, iou, tile_size, tile_overlap)
+    return [_associate_detections(image, boxes, classes, scores, license_plate_car_ioa, save_prediction,
+                                  return_boxes, association_method, return_annotated, annotated_size,
+                                  return_detections)
+            for image, (boxes, classes, scores) in zip(images, detected)]
 
-    # proba usuniecia nieprawidlowego przypisania rejestracji w sytuacji gdzie
-    # w bounding box'ie danego auta znajduje sie wiele rejestacji.
-    # Algorytm usuwa z aut o wielu przypisanych rejestracjach te, ktore
-    # rownoczesnie przypisane sa do innego auta jako jedyne
-    # Algorytm nie gwarantuje usuniecia wszystkich nieprawidlowo przypisanych
-    # rejestracji od auta
-    while len(multiple_license_plate_car_indices) >= 1 and len(single_license_plate_car_indices) >= 1:
-        single_license_plate_car_index = single_license_plate_car_indices.pop()
-        single_license_plate_index = car_license_plate_indices_list[single_license_plate_car_index][0]
-        for multiple_license_plate_car_index in multiple_license_plate_car_indices:
-            try:
-                car_license_plate_indices_list[multiple_license_plate_car_index].remove(single_license_plate_index)
-            except ValueError:
-                continue
-            if len(car_license_plate_indices_list[multiple_license_plate_car_index]) == 1:
-                single_license_plate_car_indices.append(multiple_license_plate_car_index)
-                multiple_license_plate_car_indices.remove(multiple_license_plate_car_index)
+def _associate_detections(image, boxes, classes, scores, license_plate_car_ioa, save_prediction,
+                          return_boxes, association_method, return_annotated, annotated_size,
+                          return_detections):
+    with metrics.timer("association"):
+        # przypisanie tablic rejestracyjnych do aut, z usunieciem wykrytych dwukrotnie tablic
+        association = associate(boxes, classes, license_plate_car_ioa, association_method)
+        if return_detections is True:
+            pairs = Detections.from_association(image, association, scores[classes == 0], scores[classes != 0])
+        else:
+            pairs = pairs_from_association(image, association, return_boxes)
+    metrics.increment("cars_detected", len(association.car_boxes))
+    metrics.increment("plates_detected", len(association.plate_boxes))
+    if save_prediction is True:
+        get_prediction_writer().submit(draw_annotations(image, association))
+    if return_annotated is True:
+        return pairs, draw_annotations(image, association, annotated_size)
+    return pairs
 
-    # [wyciete auto, lista wycietych tablic rejestracyjnych przypisanych do auta]
+# [wyciete auto, lista wycietych tablic rejestracyjnych przypisanych do auta]
+# lub, gdy return_boxes jest ustawione, [wyciete auto, lista wycietych tablic,
+# bounding box auta, lista bounding boxow tablic], ostatnia para zawiera
+# tablice nieprzypisane do zadnego auta
+def pairs_from_association(image, association, return_boxes=False):
+    car_boxes = association.car_boxes.tolist()
+    plate_boxes = association.plate_boxes.tolist()
+    plates = [image[box[1]:box[3], box[0]:box[2]] for box in plate_boxes]
     pairs = []
-    for i, car in enumerate(cars):
-        license_plate_list = [license_plates[j][0] for j in car_license_plate_indices_list[i]]
-        pairs.append([car[0], license_plate_list])
+    for car_box, assigned in zip(car_boxes, association.assignment):
+        plate_indices = np.flatnonzero(assigned)
+        car = image[car_box[1]:car_box[3], car_box[0]:car_box[2]]
+        license_plate_list = [plates[j] for j in plate_indices]
+        if return_boxes is True:
+            pairs.append([car, license_plate_list, car_box, [plate_boxes[j] for j in plate_indices]])
+        else:
+            pairs.append([car, license_plate_list])
 
-    not_attached_license_plates = []
-    for license_plate in license_plates:
-        if license_plate[3] is False:
-            not_attached_license_plates.append(license_plate[0])
-    pairs.append([None, not_attached_license_plates])
+    unattached_indices = np.flatnonzero(association.unattached)
+    not_attached_license_plates = [plates[j] for j in unattached_indices]
+    if return_boxes is True:
+        pairs.append([None, not_attached_license_plates, None,
+                      [plate_boxes[j] for j in unattached_indices]])
+    else:
+        pairs.append([None, not_attached_license_plates])
     return pairs
 
+# opis wynikow w postaci slownikow (np. do zapisu w formacie JSON), pary musza
+# zawierac bounding boxy (return_boxes=True), a texts to teksty kolejnych tablic
+# ze wszystkich par, opcjonalnie wraz z identyfikatorami sledzonych tablic
+def describe_pairs(pairs, texts, track_ids=None):
+    texts = iter(texts)
+    track_ids = iter(track_ids) if track_ids is not None else None
+    cars = []
+    unattached_plates = []
+    for _, _, car_box, plate_boxes in pairs:
+        plate_results = []
+        for plate_box in plate_boxes:
+            plate_result = {"box": plate_box, "text": next(texts)}
+            if track_ids is not None:
+                plate_result["track_id"] = next(track_ids)
+            plate_results.append(plate_result)
+        if car_box is None:
+            unattached_plates = plate_results
+        else:
+            cars.append({"box": car_box, "plates": plate_results})
+    return {"cars": cars, "unattached_plates": unattached_plates}
+
 # przyklad uzycia
 if __name__ == '__main__':
+    from ultralytics import YOLO
+    from image_loading import load_image
     dir_path = os.path.dirname(os.path.realpath(__file__))
     yolo = YOLO(os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt"))
-    image = cv.imread(os.path.join(dir_path, "..", "test_data", "test_image_14.jpg"))
-    pairs = crop_boxes_from_image(yolo, image, save_prediction=True)
+    # detekcja na obrazie zdekodowanym w zmniejszonej rozdzielczosci, wycinki w pelnej
+    loaded = load_image(os.path.join(dir_path, "..", "test_data", "test_image_14.jpg"), min_size=640)
+    detections = crop_boxes_from_image(yolo, loaded.image, save_prediction=True, return_detections=True)
+    pairs = loaded.full_resolution(detections).to_pairs()
     for i, pair in enumerate(pairs):
         car, license_plate_list = pair
         if car is not None:
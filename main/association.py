@@ -0,0 +1,176 @@
+from collections import namedtuple
+import numpy as np
+
+# wynik przypisania tablic rejestracyjnych do aut:
+# car_boxes - bounding boxy aut [liczba aut, 4]
+# plate_boxes - bounding boxy tablic pozostalych po usunieciu duplikatow [liczba tablic, 4]
+# plate_indices - indeksy tych tablic wsrod wszystkich wykrytych tablic
+# assignment - macierz przypisania [liczba aut, liczba tablic]
+# unattached - maska tablic nieprzypisanych do zadnego auta
+Association = namedtuple("Association", ["car_boxes", "plate_boxes", "plate_indices",
+                                         "assignment", "unattached"])
+
+def box_areas(boxes):
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+# macierz pol powierzchni iloczynow bounding boxow [x1, y1, x2, y2], boxy stykajace
+# sie jedynie krawedzia nie maja czesci wspolnej
+def intersection_areas(boxes_a, boxes_b):
+    x = (np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+         - np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0]))
+    y = (np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+         - np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1]))
+    return np.where((x > 0) & (y > 0), x * y, 0)
+
+# usuwanie wykrytych dwukrotnie tablic rejestracyjnych: z kazdej pary nachodzacych
+# na siebie tablic zostaje wieksza (przy rownych polach ta o wyzszym indeksie),
+# zwraca maske tablic, ktore zostaja
+def suppress_duplicate_plates(plate_boxes, plate_areas=None):
+    if plate_areas is None:
+        plate_areas = box_areas(plate_boxes)
+    overlaps = intersection_areas(plate_boxes, plate_boxes) > 0
+    np.fill_diagonal(overlaps, False)
+    indices = np.arange(len(plate_boxes))
+    bigger = ((plate_areas[None, :] > plate_areas[:, None])
+              | ((plate_areas[None, :] == plate_areas[:, None]) & (indices[None, :] > indices[:, None])))
+    return ~np.any(overlaps & bigger, axis=1)
+
+# macierz stosunkow pola iloczynu bounding boxow tablicy i auta do pola tablicy
+# (intersection over area) [liczba aut, liczba tablic]
+def plate_car_ioa(car_boxes, plate_boxes, plate_areas=None):
+    if plate_areas is None:
+        plate_areas = box_areas(plate_boxes)
+    intersections = intersection_areas(car_boxes, plate_boxes)
+    return np.divide(intersections, plate_areas[None, :], out=np.zeros(intersections.shape),
+                     where=plate_areas[None, :] > 0)
+
+# proba usuniecia nieprawidlowego przypisania rejestracji w sytuacji gdzie w
+# bounding box'ie danego auta znajduje sie wiele rejestracji. Z aut o wielu
+# przypisanych rejestracjach usuwane sa te, ktore rownoczesnie przypisane sa do
+# innego auta jako jedyne, auta ktorym zostala jedna rejestracja traktowane sa
+# dalej jak auta z jedna rejestracja. Algorytm nie gwarantuje usuniecia wszystkich
+# nieprawidlowo przypisanych rejestracji od auta
+def resolve_multiple_plates(assignment):
+    assignment = assignment.copy()
+    counts = assignment.sum(axis=1)
+    single = list(np.flatnonzero(counts == 1))
+    multiple = counts > 1
+    while single and multiple.any():
+        plate_index = np.flatnonzero(assignment[single.pop()])[0]
+        cars = np.flatnonzero(multiple & assignment[:, plate_index])
+        if len(cars) == 0:
+            continue
+        assignment[cars, plate_index] = False
+        counts[cars] -= 1
+        new_single = cars[counts[cars] == 1]
+        multiple[new_single] = False
+        single.extend(new_single)
+    return assignment
+
+# optymalne przypisanie jeden do jednego (metoda wegierska) maksymalizujace sume
+# wspolczynnikow IoA, z pominieciem par ponizej progu
+def hungarian_assignment(ioa, license_plate_car_ioa):
+    from scipy.optimize import linear_sum_assignment
+    assignment = np.zeros(ioa.shape, dtype=bool)
+    if ioa.size == 0:
+        return assignment
+    cars, plates = linear_sum_assignment(np.where(ioa >= license_plate_car_ioa, ioa, 0), maximize=True)
+    valid = ioa[cars, plates] >= license_plate_car_ioa
+    assignment[cars[valid], plates[valid]] = True
+    return assignment
+
+# przypisanie tablic rejestracyjnych do aut na podstawie bounding boxow i klas
+# zwroconych przez YOLO (klasa 0 - auto, pozostale - tablica rejestracyjna),
+# method="greedy" odtwarza pierwotny algorytm (auto moze miec kilka tablic),
+# method="hungarian" wyznacza przypisanie jeden do jednego
+def associate(boxes, classes, license_plate_car_ioa=0.85, method="greedy"):
+    boxes = np.asarray(boxes).reshape(-1, 4).astype(np.int64)
+    classes = np.asarray(classes).reshape(-1)
+    car_boxes = boxes[classes == 0]
+    all_plate_boxes = boxes[classes != 0]
+
+    all_plate_areas = box_areas(all_plate_boxes)
+    plate_indices = np.flatnonzero(suppress_duplicate_plates(all_plate_boxes, all_plate_areas))
+    plate_boxes = all_plate_boxes[plate_indices]
+    plate_areas = all_plate_areas[plate_indices]
+
+    ioa = plate_car_ioa(car_boxes, plate_boxes, plate_areas)
+    if method == "greedy":
+        candidates = ioa >= license_plate_car_ioa
+        assignment = resolve_multiple_plates(candidates)
+        # tablica jest nieprzypisana tylko wtedy, gdy nie pasuje do zadnego auta
+        unattached = ~candidates.any(axis=0)
+    elif method == "hungarian":
+        assignment = hungarian_assignment(ioa, license_plate_car_ioa)
+        unattached = ~assignment.any(axis=0)
+    else:
+        raise ValueError(f"Nieznana metoda przypisania: {method}")
+    return Association(car_boxes, plate_boxes, plate_indices, assignment, unattached)
+
+# porownanie czasu wykonania z pierwotna implementacja na petlach dla rosnacej
+# liczby bounding boxow
+if __name__ == '__main__':
+    import time
+
+    # pierwotna implementacja z crop_boxes_from_image (usuwanie duplikatow i przypisanie
+    # IoA), bez wycinania obrazow
+    def associate_reference(boxes, classes, license_plate_car_ioa=0.85):
+        cars = []
+        license_plates = []
+        for cls, box in zip(classes, boxes):
+            if cls == 0:
+                cars.append([None, box])
+            else:
+                license_plates.append([None, box, (box[2] - box[0]) * (box[3] - box[1]), False])
+        indices_to_remove = set()
+        for i in range(len(license_plates)):
+            for j in range(i + 1, len(license_plates)):
+                x = (min(license_plates[i][1][2], license_plates[j][1][2])
+                     - max(license_plates[i][1][0], license_plates[j][1][0]))
+                y = (min(license_plates[i][1][3], license_plates[j][1][3])
+                     - max(license_plates[i][1][1], license_plates[j][1][1]))
+                if x > 0 and y > 0:
+                    indices_to_remove.add(j if license_plates[i][2] > license_plates[j][2] else i)
+        license_plates = [plate for i, plate in enumerate(license_plates) if i not in indices_to_remove]
+        car_license_plate_indices_list = []
+        for car in cars:
+            license_plate_indices = []
+            for j, license_plate in enumerate(license_plates):
+                x = min(license_plate[1][2], car[1][2]) - max(license_plate[1][0], car[1][0])
+                y = min(license_plate[1][3], car[1][3]) - max(license_plate[1][1], car[1][1])
+                if x > 0 and y > 0 and ((x * y / license_plate[2]) >= license_plate_car_ioa):
+                    license_plate_indices.append(j)
+                    license_plate[3] = True
+            car_license_plate_indices_list.append(license_plate_indices)
+        return car_license_plate_indices_list
+
+    # losowa scena: auta oraz tablice umieszczone w dolnej czesci aut
+    def random_scene(rng, n_cars, size=4000):
+        x1 = rng.integers(0, size - 400, n_cars)
+        y1 = rng.integers(0, size - 300, n_cars)
+        w = rng.integers(150, 400, n_cars)
+        h = rng.integers(100, 300, n_cars)
+        car_boxes = np.stack([x1, y1, x1 + w, y1 + h], axis=1)
+        px = x1 + w // 3 + rng.integers(-10, 10, n_cars)
+        py = y1 + h - h // 4
+        plate_boxes = np.stack([px, py, px + w // 3, py + h // 8], axis=1)
+        boxes = np.concatenate([car_boxes, plate_boxes])
+        classes = np.concatenate([np.zeros(n_cars, dtype=int), np.ones(n_cars, dtype=int)])
+        return boxes, classes
+
+    rng = np.random.default_rng(0)
+    print(f"{'boxy':>6} {'petle [ms]':>12} {'greedy [ms]':>12} {'hungarian [ms]':>15}")
+    for n_boxes in (10, 30, 100, 300, 1000):
+        boxes, classes = random_scene(rng, n_boxes // 2)
+        timings = []
+        for function in (lambda: associate_reference(boxes.tolist(), classes.tolist()),
+                         lambda: associate(boxes, classes),
+                         lambda: associate(boxes, classes, method="hungarian")):
+            repeats = 3
+            # pierwsze wywolanie poza pomiarem (import scipy)
+            function()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                function()
+            timings.append(1000 * (time.perf_counter() - start) / repeats)
+        print(f"{n_boxes:>6} {timings[0]:>12.3f} {timings[1]:>12.3f} {timings[2]:>15.3f}")
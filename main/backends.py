@@ -0,0 +1,179 @@
+import copy
+import hashlib
+import os
+import torch
+
+# dostepne sposoby uruchamiania klasyfikatora znakow na CPU
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "int8-static")
+
+# liczba znakow uzywanych do kalibracji statycznej kwantyzacji INT8
+CALIBRATION_CHARS = 256
+
+# rozmiar obrazu znaku po przetworzeniu przez preprocess (EfficientNet-B1)
+INPUT_SIZE = 240
+
+def example_input(batch_size=1):
+    return torch.zeros(batch_size, 3, INPUT_SIZE, INPUT_SIZE)
+
+# model ONNX uruchamiany przez ONNX Runtime, wywolywany tak jak model pytorch
+class OnnxRuntimeModel:
+    def __init__(self, onnx_path, threads=0):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        batch = batch.detach().float().contiguous().numpy()
+        return torch.from_numpy(self.session.run(None, {self.input_name: batch})[0])
+
+    def eval(self):
+        return self
+
+# sciezka modelu ONNX obok wag, nazwa zawiera skrot sygnatury wag, wiec zmiana wag
+# powoduje ponowny eksport
+def get_onnx_path(model_path, signature):
+    digest = hashlib.sha1(signature.encode()).hexdigest()[:12]
+    return f"{os.path.splitext(model_path)[0]}.{digest}.onnx"
+
+def export_onnx(model, onnx_path):
+    # plik tymczasowy unikalny dla procesu, modele moga byc eksportowane rownolegle
+    tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+    torch.onnx.export(model, example_input(), tmp_path, input_names=["input"], output_names=["logits"],
+                      dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}}, dynamo=False)
+    os.replace(tmp_path, onnx_path)
+
+def torchscript_model(model):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_input())
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+# statyczna kwantyzacja INT8 (FX graph mode), wymaga przykladowych obrazow znakow
+# [N, 3, H, W] do kalibracji zakresow aktywacji
+def static_int8_model(model, calibration):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    if calibration is None or len(calibration) == 0:
+        raise ValueError("Static INT8 quantization requires calibration images")
+    prepared = prepare_fx(copy.deepcopy(model), get_default_qconfig_mapping("x86"), (calibration[:1],))
+    with torch.no_grad():
+        for start in range(0, len(calibration), 32):
+            prepared(calibration[start:start + 32])
+    return convert_fx(prepared)
+
+# utworzenie wybranego backendu z modelu w trybie eager, zwracany obiekt wywolywany
+# jest tak jak model pytorch (tensor [N, 3, H, W] -> wyniki [N, liczba klas])
+def create_backend(name, model, model_path=None, signature="", calibration=None, threads=0):
+    if name == "eager":
+        return model
+    if name == "torchscript":
+        return torchscript_model(model)
+    if name == "compile":
+        return torch.compile(model)
+    if name == "onnx":
+        if model_path is None:
+            raise ValueError("The ONNX backend requires the model path")
+        onnx_path = get_onnx_path(model_path, signature)
+        if not os.path.exists(onnx_path):
+            export_onnx(model, onnx_path)
+        return OnnxRuntimeModel(onnx_path, threads)
+    if name == "int8-static":
+        return static_int8_model(model, calibration)
+    raise ValueError(f"Unknown backend: {name}")
+
+# znaki do kalibracji int8-static wysegmentowane z wycinkow tablic rejestracyjnych
+# w folderze directory, co najwyzej limit znakow
+def load_calibration_chars(directory, limit=CALIBRATION_CHARS):
+    import glob
+    import cv2
+    import numpy as np
+    from recognition import segment_plates
+    paths = sorted(path for path in glob.glob(os.path.join(directory, "**", "*.*"), recursive=True)
+                   if path.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+    chars = []
+    for path in paths:
+        plate = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if plate is None:
+            continue
+        segmented = segment_plates([plate])[0]
+        if segmented is not None:
+            chars.extend(segmented[0])
+        if len(chars) >= limit:
+            break
+    if not chars:
+        raise ValueError(f"Nie wysegmentowano żadnych znaków z obrazów w {directory}")
+    return chars[:limit]
+
+def add_backend_arguments(parser):
+    parser.add_argument("--backend", default="eager", choices=BACKENDS,
+                        help="sposób uruchamiania klasyfikatora znaków (int8-static wymaga --calibration-images)")
+    parser.add_argument("--calibration-images",
+                        help="folder z wycinkami tablic rejestracyjnych, których znaki służą do kalibracji int8-static")
+
+# argumenty recognition.load_model, znaki kalibracyjne wczytywane tylko dla int8-static
+def backend_kwargs(args):
+    calibration_chars = None
+    if args.backend == "int8-static":
+        if not args.calibration_images:
+            raise ValueError("Backend int8-static wymaga --calibration-images")
+        calibration_chars = load_calibration_chars(args.calibration_images)
+    return {"backend": args.backend, "calibration_chars": calibration_chars}
+
+# porownanie backendow na znakach wysegmentowanych z tablic wykrytych w test_data:
+# opoznienie pojedynczego znaku, przepustowosc dla paczek oraz zgodnosc predykcji
+# z modelem eager (brak etykiet dla test_data)
+if __name__ == '__main__':
+    import glob
+    import statistics
+    import sys
+    import time
+    import cv2
+    from ultralytics import YOLO
+    from YOLO_utils import crop_boxes_from_image
+    from recognition import load_model, prepare_character, segment_plates, classify_characters
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    yolo = YOLO(os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt"))
+    eager_model, preprocess = load_model()
+    chars = []
+    for image_path in sorted(glob.glob(os.path.join(dir_path, "..", "test_data", "*", "*.*g"))):
+        image = cv2.imread(image_path)
+        if image is None:
+            continue
+        plates = [plate for _, plate_list in crop_boxes_from_image(yolo, image) for plate in plate_list]
+        for segmented in segment_plates(plates):
+            if segmented is not None:
+                chars.extend(segmented[0])
+    if not chars:
+        sys.exit("Nie wysegmentowano żadnych znaków z test_data")
+    batch = torch.stack([prepare_character(preprocess, char) for char in chars])
+    reference = classify_characters(eager_model, list(batch)).argmax(1)
+    print(f"znaków: {len(chars)}")
+
+    print(f"{'backend':>13} {'przygotowanie [s]':>18} {'1 znak p50 [ms]':>16} "
+          f"{'przepustowość [znaki/s]':>24} {'zgodność z eager':>17}")
+    for name in BACKENDS:
+        try:
+            start = time.perf_counter()
+            model, _ = load_model(backend=name, calibration_chars=chars[::2])
+            setup_time = time.perf_counter() - start
+            with torch.no_grad():
+                # rozgrzanie (kompilacja, optymalizacja grafu)
+                model(batch[:1])
+                model(batch[:min(len(batch), 64)])
+                latencies = []
+                for char_tensor in batch[:50]:
+                    start = time.perf_counter()
+                    model(char_tensor.unsqueeze(0))
+                    latencies.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                predictions = classify_characters(model, list(batch)).argmax(1)
+                throughput = len(batch) / (time.perf_counter() - start)
+            agreement = (predictions == reference).float().mean().item()
+            print(f"{name:>13} {setup_time:>18.2f} {1000 * statistics.median(latencies):>16.2f} "
+                  f"{throughput:>24.1f} {100 * agreement:>16.1f}%")
+        except Exception as e:
+            print(f"{name:>13} niedostępny: {e}")
@@ -0,0 +1,261 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import cv2
+import torch
+from YOLO_utils import crop_boxes_from_images
+from detector import add_detector_arguments, detector_kwargs, export_detector, load_detector
+from detection_cache import DetectionCache
+from image_loading import load_image, prefetch_images
+from backends import add_backend_arguments, backend_kwargs
+from tiling import add_detection_arguments, detection_kwargs
+from recognition import load_model, recognize_plates_decoded
+from result_store import ResultStore, thumbnail_entry
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_WEIGHTS = os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt")
+
+# modele ladowane raz w kazdym procesie roboczym
+_yolo = None
+_model = None
+_preprocess = None
+_detection_kwargs = {}
+_store_thumbnails = False
+_detection_cache = None
+_decode_min_size = None
+
+# znalezienie obrazow do przetworzenia, argumentem moze byc folder lub wzorzec glob
+def find_images(source, recursive=False):
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "**", "*") if recursive else os.path.join(source, "*")
+        paths = glob.glob(pattern, recursive=recursive)
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(path for path in paths
+                  if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+
+def init_worker(weights_path, torch_threads, detection_kwargs, backend="eager", store_thumbnails=False,
+                detector_kwargs=None, detection_cache_dir=None, decode_min_size=None, calibration_chars=None):
+    global _yolo, _model, _preprocess, _detection_kwargs, _store_thumbnails, _detection_cache, _decode_min_size
+    if torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+        cv2.setNumThreads(torch_threads)
+    _yolo = load_detector(weights_path, **(detector_kwargs or {}))
+    _model, _preprocess = load_model(backend=backend, calibration_chars=calibration_chars)
+    _detection_kwargs = detection_kwargs
+    _store_thumbnails = store_thumbnails
+    _decode_min_size = decode_min_size
+    # surowe wyniki detektora zapisywane w folderze wspolnym dla procesow roboczych,
+    # ponowne przetworzenie tych samych obrazow z innymi progami nie uruchamia detektora
+    _detection_cache = None
+    if detection_cache_dir is not None:
+        min_confidence = min(0.001, detection_kwargs.get("confidence", 0.25))
+        _detection_cache = DetectionCache(_yolo, weights_path, detection_cache_dir, min_confidence)
+
+# przetworzenie pojedynczego obrazu: detekcja aut i tablic, a nastepnie rozpoznanie
+# wszystkich wykrytych tablic w jednym przebiegu klasyfikatora
+def process_file(path):
+    return process_files([path])[0]
+
+def process_files(paths):
+    return process_loaded([(path, load_image(path, _decode_min_size)) for path in paths])
+
+# przetworzenie kilku wczytanych obrazow (pary sciezka, LoadedImage lub None) z detekcja
+# w jednym wywolaniu detektora, czas detekcji paczki rozdzielany jest rowno miedzy jej
+# obrazy. Obrazy zdekodowane w zmniejszonej rozdzielczosci dekodowane sa w pelnej
+# tylko wtedy, gdy wykryto na nich tablice
+def process_loaded(items):
+    paths = [path for path, _ in items]
+    results = [None] * len(items)
+    images = []
+    timings = []
+    for index, (path, loaded) in enumerate(items):
+        if loaded is None:
+            results[index] = {"path": path, "error": "Nie można odczytać obrazu"}
+        else:
+            images.append((index, loaded))
+            timings.append({"decode": loaded.decode_time})
+    if not images:
+        return results
+    try:
+        start = time.perf_counter()
+        detected = crop_boxes_from_images(_yolo, [loaded.image for _, loaded in images], return_detections=True,
+                                          detection_cache=_detection_cache, **_detection_kwargs)
+        elapsed = (time.perf_counter() - start) / len(images)
+    except Exception as e:
+        for index, _ in images:
+            results[index] = {"path": paths[index], "error": str(e)}
+        return results
+    for (index, loaded), detections, image_timings in zip(images, detected, timings):
+        image_timings["detection"] = elapsed
+        try:
+            detections = loaded.full_resolution(detections)
+        except Exception as e:
+            results[index] = {"path": paths[index], "error": str(e)}
+            continue
+        results[index] = recognize_file(paths[index], detections, image_timings)
+        loaded.release()
+    return results
+
+# kolejne paczki po size elementow
+def _groups(items, size):
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+def recognize_file(path, detections, timings):
+    try:
+        start = time.perf_counter()
+        decoded = recognize_plates_decoded(detections.plate_crops(), _model, _preprocess)
+        timings["recognition"] = time.perf_counter() - start
+        thumbnails = None
+        if _store_thumbnails:
+            thumbnails = [thumbnail_entry(plate) for plate in detections.plate_crops()]
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
+    texts = ["[PROCESSING ERROR]" if plate is None else plate.text for plate in decoded]
+    confidences = [None if plate is None else plate.confidences for plate in decoded]
+    result = {"path": path}
+    result.update(detections.to_dict(texts, confidences=confidences))
+    result["timings_ms"] = {stage: round(1000 * elapsed, 3) for stage, elapsed in timings.items()}
+    if thumbnails is not None:
+        # miniatury przekazywane sa do procesu glownego, ale nie trafiaja do pliku JSONL
+        result["_thumbnails"] = thumbnails
+    return result
+
+# odczytanie sciezek juz przetworzonych obrazow z pliku wynikowego, niepelna
+# ostatnia linia (np. po przerwaniu programu) jest usuwana z pliku
+def read_checkpoint(output_path):
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    valid_lines = []
+    truncated = False
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["path"])
+                valid_lines.append(line)
+            except (ValueError, KeyError):
+                truncated = True
+                break
+    if truncated:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.writelines(valid_lines)
+    return done
+
+def run(paths, output_path, weights_path=DEFAULT_WEIGHTS, workers=1, torch_threads=1,
+        resume=False, chunksize=4, detection_kwargs=None, backend="eager", store=None,
+        detection_batch=1, detector_kwargs=None, detection_cache_dir=None, decode_min_size=None,
+        prefetch=2, calibration_chars=None):
+    detection_kwargs = detection_kwargs or {}
+    if resume:
+        done = read_checkpoint(output_path)
+        paths = [path for path in paths if path not in done]
+        mode = "a"
+    else:
+        mode = "w"
+
+    detector_kwargs = detector_kwargs or {}
+    if detector_kwargs.get("format", "pt") != "pt":
+        # eksport raz w procesie glownym, procesy robocze wczytuja gotowy model
+        export_detector(weights_path, **detector_kwargs)
+    init_args = (weights_path, torch_threads, detection_kwargs, backend, store is not None and store.thumbnails,
+                 detector_kwargs, detection_cache_dir, decode_min_size, calibration_chars)
+    # paczki obrazow wykrywane w jednym wywolaniu detektora
+    groups = [paths[start:start + detection_batch] for start in range(0, len(paths), max(1, detection_batch))]
+    with open(output_path, mode, encoding="utf-8") as output:
+        if workers <= 0:
+            # przetwarzanie w biezacym procesie
+            init_worker(*init_args)
+            if prefetch > 0:
+                # obrazy wczytywane w watkach z wyprzedzeniem, w trakcie detekcji i rozpoznawania
+                # poprzednich obrazow
+                loaded = prefetch_images(paths, decode_min_size, prefetch, lookahead=max(8, 2 * detection_batch))
+                results = map(process_loaded, _groups(loaded, max(1, detection_batch)))
+            else:
+                results = map(process_files, groups)
+            pool = None
+        else:
+            pool = multiprocessing.get_context("spawn").Pool(
+                workers, initializer=init_worker, initargs=init_args)
+            # imap zachowuje kolejnosc wejsciowa, wiec plik wynikowy zawsze zawiera
+            # ciagly poczatek listy obrazow, co pozwala wznowic przetwarzanie
+            results = pool.imap(process_files, groups, chunksize=max(1, chunksize // max(1, detection_batch)))
+        results = (result for group in results for result in group)
+        try:
+            for i, result in enumerate(results, 1):
+                thumbnails = result.pop("_thumbnails", None)
+                if store is not None and "error" not in result:
+                    store.add_result(result, source=result["path"], timestamp=os.path.getmtime(result["path"]),
+                                     thumbnails=thumbnails)
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                if i % 100 == 0:
+                    print(f"Przetworzono {i}/{len(paths)}", file=sys.stderr)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if store is not None:
+                store.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Detekcja aut i odczytywanie rejestracji dla wielu obrazów bez GUI")
+    parser.add_argument("source", help="folder z obrazami lub wzorzec glob")
+    parser.add_argument("-o", "--output", required=True, help="plik wynikowy JSONL")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="liczba procesów roboczych (0 - bez procesów roboczych)")
+    parser.add_argument("--torch-threads", type=int, default=1,
+                        help="liczba wątków torch/opencv w każdym procesie")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help="wagi modelu YOLO")
+    parser.add_argument("--recursive", action="store_true", help="przeszukuj podfoldery")
+    parser.add_argument("--resume", action="store_true",
+                        help="pomiń obrazy już zapisane w pliku wynikowym")
+    parser.add_argument("--chunksize", type=int, default=4)
+    add_backend_arguments(parser)
+    parser.add_argument("--detection-batch", type=int, default=1,
+                        help="liczba obrazów wykrywanych w jednym wywołaniu detektora")
+    add_detector_arguments(parser)
+    parser.add_argument("--decode-min-size", type=int, default=0,
+                        help="dekoduj pliki JPEG w zmniejszonej rozdzielczości, przy której dłuższy bok ma co "
+                             "najmniej tyle pikseli (np. 640), pełna rozdzielczość tylko dla obrazów z tablicami")
+    parser.add_argument("--prefetch", type=int, default=2,
+                        help="wątki wczytujące obrazy z wyprzedzeniem przy --workers 0 (0 - bez wyprzedzenia)")
+    parser.add_argument("--store", help="baza SQLite, do której dopisywane są odczyty tablic")
+    parser.add_argument("--thumbnails", action="store_true", help="zapisuj w bazie miniatury wycinków tablic")
+    add_detection_arguments(parser)
+    parser.add_argument("--detection-cache",
+                        help="folder na surowe wyniki detektora, ponowne uruchomienie z innymi progami "
+                             "nie wykrywa obrazów od nowa (tylko tryb full)")
+    args = parser.parse_args(argv)
+
+    paths = find_images(args.source, args.recursive)
+    if not paths:
+        parser.error(f"Nie znaleziono obrazów: {args.source}")
+    model_kwargs = backend_kwargs(args)
+    store = ResultStore(args.store, thumbnails=args.thumbnails) if args.store else None
+    try:
+        run(paths, args.output, args.weights, args.workers, args.torch_threads,
+            args.resume, args.chunksize, detection_kwargs(args), model_kwargs["backend"], store, args.detection_batch,
+            detector_kwargs(args), args.detection_cache, args.decode_min_size or None, args.prefetch,
+            model_kwargs["calibration_chars"])
+    finally:
+        if store is not None:
+            store.close()
+
+if __name__ == "__main__":
+    main()
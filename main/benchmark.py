@@ -0,0 +1,233 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import cv2
+import numpy as np
+import torch
+from YOLO_utils import crop_boxes_from_image
+from detector import add_detector_arguments, detector_kwargs, load_detector
+from backends import add_backend_arguments, backend_kwargs
+from recognition import load_model, segment_plates, classify_segmented_plates, decode_plates
+from tiling import add_detection_arguments, detection_kwargs
+import metrics
+
+# etapy mierzone dla kazdego obrazu (decode, detection, association, total) i dla
+# wszystkich tablic obrazu naraz (segmentation, recognition, plate_decoding) oraz
+# mierzone w potoku dla kazdej tablicy (process_image, get_characters_images) i paczki
+# znakow (classification, sam model). reshape_character mierzony jest tylko, gdy
+# klasyfikator nie korzysta z bufora paczki (char_preprocessing)
+STAGES = ("decode", "detection", "association", "segmentation", "process_image", "get_characters_images",
+          "recognition", "reshape_character", "classification", "plate_decoding", "total")
+
+# metryki porownywane z wynikiem bazowym, wzrost o wiecej niz prog to regresja
+COMPARED_METRICS = ("p50_ms", "p95_ms")
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_WEIGHTS = os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt")
+TEST_DATA = os.path.join(dir_path, "..", "test_data")
+
+def read_encoded(path):
+    with open(path, "rb") as f:
+        return np.frombuffer(f.read(), dtype=np.uint8)
+
+# zakodowanie obrazu syntetycznego do JPEG w pamieci, dzieki czemu etap decode
+# mierzony jest tak samo jak dla plikow z dysku
+def encode(image):
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise ValueError("Nie można zakodować obrazu")
+    return encoded
+
+# kompozycje wielu aut: obrazy testowe ulozone w siatce grid x grid, kazdy
+# przeskalowany do tile_size (szerokosc, wysokosc)
+def composite_images(images, grid=3, tile_size=(640, 480)):
+    tiles = [cv2.resize(image, tile_size, interpolation=cv2.INTER_AREA) for image in images]
+    per_image = grid * grid
+    composites = []
+    for start in range(0, len(tiles), per_image):
+        chunk = tiles[start:start + per_image]
+        chunk += [np.zeros_like(tiles[0])] * (per_image - len(chunk))
+        rows = [np.hstack(chunk[row * grid:(row + 1) * grid]) for row in range(grid)]
+        composites.append(np.vstack(rows))
+    return composites
+
+def upscaled_images(images, factor=3.):
+    return [cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC) for image in images]
+
+# zestawy danych: {nazwa: [(nazwa obrazu, zakodowany obraz)]}
+def build_datasets(names, composite_grid=3, upscale_factor=3., limit=0):
+    real = {}
+    for name in ("poprawne", "błędne"):
+        paths = sorted(path for path in glob.glob(os.path.join(TEST_DATA, name, "*"))
+                       if path.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")))
+        real[name] = [(os.path.basename(path), read_encoded(path)) for path in paths]
+    datasets = {name: real[name] for name in names if name in real}
+    if "composite" in names or "upscaled" in names:
+        decoded = [cv2.imdecode(encoded, cv2.IMREAD_COLOR) for name in real for _, encoded in real[name]]
+        decoded = [image for image in decoded if image is not None]
+        if "composite" in names:
+            datasets["composite"] = [(f"composite_{i}", encode(image))
+                                     for i, image in enumerate(composite_images(decoded, composite_grid))]
+        if "upscaled" in names:
+            datasets["upscaled"] = [(f"upscaled_{i}", encode(image))
+                                    for i, image in enumerate(upscaled_images(decoded, upscale_factor))]
+    if limit > 0:
+        datasets = {name: images[:limit] for name, images in datasets.items()}
+    return datasets
+
+# przetworzenie jednego obrazu funkcjami uzywanymi w potoku, czasy etapow zbierane
+# sa przez timery metrics (w tym mierzone wewnatrz detekcji, segmentacji i klasyfikacji)
+def run_image(encoded, yolo, model, preprocess, detection_kwargs):
+    start = time.perf_counter()
+    with metrics.timer("decode"):
+        image = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Nie można odczytać obrazu")
+
+    detections = crop_boxes_from_image(yolo, image, return_detections=True, **detection_kwargs)
+    plate_images = detections.plate_crops()
+    with metrics.timer("segmentation"):
+        segmented = segment_plates(plate_images)
+    with metrics.timer("recognition"):
+        classified = classify_segmented_plates(segmented, model, preprocess)
+    with metrics.timer("plate_decoding"):
+        decode_plates(classified)
+    metrics.registry.observe("total", time.perf_counter() - start)
+    return len(plate_images), sum(len(plate[0]) for plate in segmented if plate is not None)
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    samples_ms = 1000 * np.asarray(samples)
+    total = float(np.sum(samples))
+    return {
+        "count": len(samples),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 3),
+        "mean_ms": round(float(np.mean(samples_ms)), 3),
+        "throughput_per_s": round(len(samples) / total, 2) if total > 0 else None,
+    }
+
+def benchmark(datasets, yolo, model, preprocess, repeat=3, warm_up=1, detection_kwargs=None):
+    detection_kwargs = detection_kwargs or {"confidence": 0.25, "iou": 0.7, "license_plate_car_ioa": 0.85}
+    metrics.enable()
+    metrics.collect_samples()
+    report = {}
+    for dataset, images in datasets.items():
+        counts = {"images": 0, "plates": 0, "characters": 0, "errors": 0}
+        for iteration in range(warm_up + repeat):
+            # przebiegi rozgrzewajace nie sa wliczane do wynikow
+            measured = iteration >= warm_up
+            if iteration == warm_up:
+                metrics.reset()
+            for _, encoded in images:
+                try:
+                    plates, chars = run_image(encoded, yolo, model, preprocess, detection_kwargs)
+                except Exception as e:
+                    print(f"Error processing image: {e}", file=sys.stderr)
+                    counts["errors"] += measured
+                    continue
+                if measured:
+                    counts["images"] += 1
+                    counts["plates"] += plates
+                    counts["characters"] += chars
+        timings = metrics.stage_samples()
+        report[dataset] = {"counts": counts, "stages": {stage: summarize(timings.get(stage, [])) for stage in STAGES}}
+    metrics.collect_samples(False)
+    return report
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "torch_threads": torch.get_num_threads(),
+    }
+
+# porownanie z wynikiem bazowym, zwraca liste regresji: (zestaw, etap, metryka,
+# wartosc bazowa, wartosc biezaca, zmiana wzgledna). Etapy krotsze niz min_ms
+# w obu pomiarach sa pomijane, bo ich zmiany wynikaja glownie z szumu
+def compare(report, baseline, threshold=0.1, min_ms=0.05):
+    regressions = []
+    for dataset, result in report["datasets"].items():
+        base_result = baseline["datasets"].get(dataset)
+        if base_result is None:
+            continue
+        for stage, stats in result["stages"].items():
+            base_stats = base_result["stages"].get(stage, {})
+            for metric in COMPARED_METRICS:
+                current, base = stats.get(metric), base_stats.get(metric)
+                if current is None or base is None or max(current, base) < min_ms:
+                    continue
+                change = (current - base) / base if base > 0 else float("inf")
+                if change > threshold:
+                    regressions.append((dataset, stage, metric, base, current, change))
+    return regressions
+
+def print_report(report):
+    for dataset, result in report["datasets"].items():
+        counts = result["counts"]
+        print(f"\n{dataset}: obrazów {counts['images']}, tablic {counts['plates']}, "
+              f"znaków {counts['characters']}, błędów {counts['errors']}")
+        print(f"{'etap':>22} {'liczba':>7} {'p50 [ms]':>9} {'p95 [ms]':>9} {'średnia [ms]':>13} {'na sekundę':>11}")
+        for stage, stats in result["stages"].items():
+            if stats["count"] == 0:
+                continue
+            print(f"{stage:>22} {stats['count']:>7} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} "
+                  f"{stats['mean_ms']:>13.2f} {stats['throughput_per_s']:>11.1f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Pomiar czasu poszczególnych etapów detekcji i rozpoznawania tablic rejestracyjnych")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="plik wynikowy JSON")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="porównaj z zapisanym wynikiem bazowym i zgłoś regresje")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="względny wzrost p50/p95 uznawany za regresję")
+    parser.add_argument("--datasets", nargs="+", default=["poprawne", "błędne", "composite", "upscaled"],
+                        choices=["poprawne", "błędne", "composite", "upscaled"])
+    parser.add_argument("--repeat", type=int, default=3, help="liczba mierzonych przebiegów")
+    parser.add_argument("--warm-up", type=int, default=1, help="liczba przebiegów rozgrzewających")
+    parser.add_argument("--limit", type=int, default=0, help="maksymalna liczba obrazów w zestawie (0 - wszystkie)")
+    parser.add_argument("--composite-grid", type=int, default=3, help="liczba obrazów w wierszu kompozycji")
+    parser.add_argument("--upscale", type=float, default=3., help="współczynnik powiększenia obrazów")
+    parser.add_argument("--torch-threads", type=int, default=0, help="liczba wątków torch (0 - domyślna)")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help="wagi modelu YOLO")
+    add_detector_arguments(parser)
+    add_backend_arguments(parser)
+    add_detection_arguments(parser)
+    args = parser.parse_args()
+
+    if args.torch_threads > 0:
+        torch.set_num_threads(args.torch_threads)
+    yolo = load_detector(args.weights, **detector_kwargs(args))
+    model, preprocess = load_model(**backend_kwargs(args))
+    datasets = build_datasets(args.datasets, args.composite_grid, args.upscale, args.limit)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "datasets": benchmark(datasets, yolo, model, preprocess, args.repeat, args.warm_up, detection_kwargs(args)),
+    }
+    print_report(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nWyniki zapisane w {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for dataset, stage, metric, base, current, change in regressions:
+            print(f"REGRESJA {dataset}/{stage} {metric}: {base:.2f} ms -> {current:.2f} ms (+{100 * change:.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print("Brak regresji względem wyniku bazowego")
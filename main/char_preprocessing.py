@@ -0,0 +1,203 @@
+import contextlib
+import threading
+import cv2
+import numpy as np
+import torch
+import metrics
+
+# przygotowanie obrazow znakow do klasyfikatora w jednym kroku: zamiast
+# reshape_character (skalowanie do 216 i ramka do 256x256), kopii do tensora,
+# powielenia kanalu i transformacji EfficientNet (ponowne skalowanie do 255, wyciecie
+# srodka 240x240 i normalizacja) znak skalowany jest raz, od razu do rozmiaru po obu
+# skalowaniach, i wpisywany w odpowiednie miejsce wiersza wczesniej przydzielonego
+# tensora [N, 3, H, W]. Tlo wiersza to znormalizowane zero, a normalizacja
+# (x - mean) / std = x * scale + bias liczona jest jednym addcmul z rozgloszeniem
+# jednego kanalu na trzy. Wynik rozni sie od dotychczasowej sciezki tylko
+# interpolacja na krawedziach znaku (jedno skalowanie zamiast dwoch)
+class CharacterBatchPreprocessor:
+    def __init__(self, crop_size=240, resize_size=255, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225),
+                 target_resized=216, target_padded=256, max_batch_size=64):
+        self.crop_size = crop_size
+        self.target_resized = target_resized
+        self.target_padded = target_padded
+        # skala ramki 256x256 do obrazu 255x255 i przesuniecie wyciecia srodka jak w
+        # torchvision.transforms.functional.center_crop
+        self.scale = resize_size / target_padded
+        self.crop_offset = int(round((resize_size - crop_size) / 2.0))
+        std = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+        mean = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1)
+        self.channel_scale = 1. / std
+        self.channel_bias = -mean / std
+        # pamiec przypieta tylko gdy paczki moga trafic na GPU
+        self.pin_memory = torch.cuda.is_available()
+        self.max_batch_size = max_batch_size
+        # bufor przydzielany przy pierwszej paczce i powiekszany tylko, gdy paczka sie nie miesci
+        self.batch = None
+        self.glyph = np.empty((crop_size, crop_size), dtype=np.float32)
+
+    # preprocess z EfficientNet_B1_Weights.DEFAULT.transforms(), None dla innych
+    # transformacji (wtedy uzywane jest recognition.prepare_character)
+    @classmethod
+    def from_transforms(cls, preprocess, max_batch_size=64):
+        try:
+            crop_size, = preprocess.crop_size
+            resize_size, = preprocess.resize_size
+            mean, std = preprocess.mean, preprocess.std
+        except (AttributeError, TypeError, ValueError):
+            return None
+        return cls(crop_size, resize_size, mean, std, max_batch_size=max_batch_size)
+
+    def _allocate(self, size):
+        if self.batch is None or len(self.batch) < size:
+            self.batch = torch.empty((size, 3, self.crop_size, self.crop_size), dtype=torch.float32,
+                                     pin_memory=self.pin_memory)
+
+    # polozenie i rozmiar znaku w wierszu (y, x, wysokosc, szerokosc) oraz interpolacja
+    def _placement(self, height, width):
+        ratio = self.target_resized / max(height, width)
+        interpolation = cv2.INTER_CUBIC if ratio > 1 else cv2.INTER_AREA
+        # rozmiar i polozenie w ramce 256x256 jak w reshape_character
+        padded_height, padded_width = round(height * ratio), round(width * ratio)
+        top = (self.target_padded - padded_height) // 2
+        left = (self.target_padded - padded_width) // 2
+        out_height = max(1, round(padded_height * self.scale))
+        out_width = max(1, round(padded_width * self.scale))
+        y = round(top * self.scale) - self.crop_offset
+        x = round(left * self.scale) - self.crop_offset
+        return y, x, out_height, out_width, interpolation
+
+    # wpisanie jednego znaku do wiersza index tensora paczki
+    def write(self, index, char_image):
+        height, width = char_image.shape[:2]
+        y, x, out_height, out_width, interpolation = self._placement(height, width)
+        resized = cv2.resize(char_image, (out_width, out_height), interpolation=interpolation)
+        if resized.ndim == 3:
+            resized = resized[:, :, 0]
+        # znak przyciety do wiersza (wyciecie srodka moze obciac brzegi ramki)
+        y1, x1 = max(y, 0), max(x, 0)
+        y2, x2 = min(y + out_height, self.crop_size), min(x + out_width, self.crop_size)
+        glyph = self.glyph[:y2 - y1, :x2 - x1]
+        np.copyto(glyph, resized[y1 - y:y2 - y, x1 - x:x2 - x], casting="unsafe")
+        row = self.batch[index]
+        row.copy_(self.channel_bias.expand_as(row))
+        torch.addcmul(self.channel_bias, torch.from_numpy(glyph).unsqueeze(0), self.channel_scale,
+                      out=row[:, y1:y2, x1:x2])
+
+    # paczki znakow jako pary (tensor [n, 3, H, W], indeksy znakow na liscie wejsciowej).
+    # Tensor jest widokiem wspolnego bufora, nadpisywanym przy kolejnej paczce, wiec
+    # musi zostac zuzyty przed pobraniem nastepnej. Bufor ma rozmiar najwiekszej paczki,
+    # a nie max_batch_size, wiec dla jednej tablicy zajmuje kilka, a nie kilkadziesiat MB
+    def batches(self, char_images, max_batch_size=64):
+        char_images = list(char_images)
+        self._allocate(min(max_batch_size, len(char_images)))
+        count = 0
+        indices = []
+        for char_idx, char_image in enumerate(char_images):
+            try:
+                self.write(count, char_image)
+            except Exception as e:
+                print(f"Error processing character: {e}")
+                metrics.increment("character_errors")
+                continue
+            indices.append(char_idx)
+            count += 1
+            if count == max_batch_size:
+                yield self.batch[:count], indices
+                count = 0
+                indices = []
+        if count:
+            yield self.batch[:count], indices
+
+# pula preprocesorow z buforami paczek: watek wypozycza preprocesor na czas
+# klasyfikacji i oddaje go po zuzyciu paczek. Serwer HTTP tworzy nowy watek dla
+# kazdego zadania, wiec bufory przypisane do watkow bylyby przydzielane przy kazdym
+# zadaniu; w puli zostaje co najwyzej MAX_IDLE_PREPROCESSORS nieuzywanych preprocesorow
+MAX_IDLE_PREPROCESSORS = 4
+_pool_lock = threading.Lock()
+_idle_preprocessors = {}
+
+# preprocesor dla transformacji preprocess (None, gdy nie jest to transformacja
+# EfficientNet), uzywany jako: with character_preprocessor(preprocess) as fused: ...
+@contextlib.contextmanager
+def character_preprocessor(preprocess, max_batch_size=64):
+    # klucz z parametrow transformacji, a nie id obiektu, ktore moze zostac uzyte ponownie
+    key = tuple(str(getattr(preprocess, name, None)) for name in ("crop_size", "resize_size", "mean", "std"))
+    with _pool_lock:
+        idle = _idle_preprocessors.setdefault(key, [])
+        preprocessor = idle.pop() if idle else None
+    if preprocessor is None:
+        preprocessor = CharacterBatchPreprocessor.from_transforms(preprocess, max_batch_size)
+    try:
+        yield preprocessor
+    finally:
+        if preprocessor is not None:
+            with _pool_lock:
+                if len(idle) < MAX_IDLE_PREPROCESSORS:
+                    idle.append(preprocessor)
+
+# porownanie czasu przygotowania paczki znakow dotychczasowa sciezka
+# (recognition.prepare_character i torch.stack) i wpisywaniem do bufora paczki oraz
+# zgodnosci klasyfikacji obu sciezek na znakach wysegmentowanych z syntetycznych tablic
+if __name__ == '__main__':
+    import argparse
+    import time
+    from recognition import load_model, prepare_character, classify_characters, segment_plates
+
+    parser = argparse.ArgumentParser(description="Przygotowanie paczek znaków do klasyfikatora")
+    parser.add_argument("--plates", type=int, default=24, help="liczba syntetycznych tablic")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--torch-threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.torch_threads > 0:
+        torch.set_num_threads(args.torch_threads)
+    rng = np.random.default_rng(0)
+    letters = "ABCDEFGHKLNOPRSTUWXYZ"
+    plates = []
+    for _ in range(args.plates):
+        width, height = int(rng.integers(200, 521)), int(rng.integers(45, 115))
+        plate = np.full((height, width, 3), 235, dtype=np.uint8)
+        text = "".join(rng.choice(list(letters), 2)) + " " + "".join(rng.choice(list("0123456789"), 5))
+        cv2.putText(plate, text, (int(0.08 * width), int(0.78 * height)), cv2.FONT_HERSHEY_SIMPLEX,
+                    height / 40, (20, 20, 20), max(2, height // 12))
+        plate[:, :int(0.06 * width)] = (200, 60, 20)
+        plates.append(plate + rng.integers(0, 12, plate.shape, dtype=np.uint8))
+    chars = [char for segmented in segment_plates(plates) if segmented is not None for char in segmented[0]]
+    if not chars:
+        raise SystemExit("Nie wysegmentowano żadnych znaków")
+
+    model, preprocess = load_model()
+    fused = CharacterBatchPreprocessor.from_transforms(preprocess, args.batch_size)
+    batches = [chars[start:start + args.batch_size] for start in range(0, len(chars), args.batch_size)]
+
+    def measure(function):
+        function()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            function()
+        return (time.perf_counter() - start) / args.repeat / len(chars)
+
+    def reference_batches():
+        for batch in batches:
+            torch.stack([prepare_character(preprocess, char) for char in batch])
+
+    def fused_batches():
+        for batch, _ in fused.batches(chars, args.batch_size):
+            pass
+
+    reference_time = measure(reference_batches)
+    fused_time = measure(fused_batches)
+    reference = torch.stack([prepare_character(preprocess, char) for char in chars])
+    reference_logits = classify_characters(model, list(reference), args.batch_size)
+    with torch.no_grad():
+        fused_logits = torch.cat([model(batch) for batch, _ in fused.batches(chars, args.batch_size)])
+    agreement = (reference_logits.argmax(1) == fused_logits.argmax(1)).float().mean().item()
+    fused_input = torch.cat([batch.clone() for batch, _ in fused.batches(chars, args.batch_size)])
+    print(f"znaków: {len(chars)}, paczka: {args.batch_size}")
+    print(f"{'ścieżka':>14} {'µs/znak':>9} {'przyspieszenie':>15}")
+    print(f"{'prepare':>14} {1e6 * reference_time:>9.1f} {1.:>15.2f}")
+    print(f"{'bufor paczki':>14} {1e6 * fused_time:>9.1f} {reference_time / fused_time:>15.2f}")
+    print(f"zgodność klasyfikacji: {agreement:.1%}, średnia różnica wejścia: "
+          f"{(fused_input - reference).abs().mean().item():.3f} "
+          f"(zakres {reference.min().item():.0f}..{reference.max().item():.0f})")
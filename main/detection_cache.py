@@ -0,0 +1,254 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+import torchvision
+import metrics
+from tiling import detect_boxes
+
+# surowe wyniki detektora jednego obrazu: box w pikselach obrazu, pewnosc i klasa
+RAW_DTYPE = np.dtype([("box", np.float32, (4,)), ("score", np.float32), ("cls", np.int16)])
+
+# skrot wag detektora (zawartosci pliku), zmiana wag uniewaznia zapisane wyniki
+_weights_versions = {}
+
+def weights_version(weights_path):
+    key = (os.path.abspath(weights_path), os.path.getmtime(weights_path))
+    version = _weights_versions.get(key)
+    if version is None:
+        digest = hashlib.sha1()
+        with open(weights_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        version = _weights_versions[key] = digest.hexdigest()[:16]
+    return version
+
+# wersja detektora: skrot wag, nazwa faktycznie uruchamianego modelu (eksport ma w
+# nazwie format, rozmiar wejscia i precyzje) oraz rozmiar wejscia przy wywolaniu,
+# bo rozne warianty tych samych wag daja rozne boxy
+def detector_version(yolo, weights_path):
+    model_name = os.path.basename(str(getattr(yolo, "model_name", None) or weights_path).rstrip(os.sep))
+    imgsz = getattr(yolo, "overrides", {}).get("imgsz", 640)
+    return f"{weights_version(weights_path)}-{model_name}-{imgsz}"
+
+def image_key(image):
+    digest = hashlib.sha1(np.ascontiguousarray(image).data)
+    digest.update(str(image.shape).encode())
+    return digest.hexdigest()
+
+# NMS osobno dla kazdej klasy, tak jak w ultralytics (boxy roznych klas nie
+# wygaszaja sie nawzajem), zwraca indeksy zachowanych boxow od najpewniejszego
+def class_nms(boxes, classes, scores, iou=0.7, max_det=300):
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    keep = torchvision.ops.batched_nms(torch.from_numpy(np.ascontiguousarray(boxes, dtype=np.float32)),
+                                       torch.from_numpy(np.ascontiguousarray(scores, dtype=np.float32)),
+                                       torch.from_numpy(np.ascontiguousarray(classes, dtype=np.int64)), iou)
+    return keep[:max_det].numpy()
+
+# pamiec surowych wynikow detektora: obraz przetwarzany jest raz z minimalna
+# pewnoscia min_confidence i progiem NMS cache_iou bliskim 1 (prawie bez wygaszania),
+# a filtrowanie pewnoscia i NMS dla dowolnych confidence >= min_confidence
+# i iou <= cache_iou wykonywane sa na zapisanych boxach. W zachlannym NMS box
+# wygaszony nie wygasza innych, wiec wynik jest taki sam jak przy ponownej detekcji
+# (z dokladnoscia do przyciecia boxow do krawedzi obrazu i kolejnosci boxow o rownej
+# pewnosci), o ile liczba zapisanych boxow nie osiagnie max_det. Wyniki trzymane sa w
+# pamieci (LRU) i opcjonalnie w folderze, kluczem jest skrot obrazu i wersja detektora
+class DetectionCache:
+    def __init__(self, yolo, weights_path, directory=None, min_confidence=0.001, cache_iou=0.99,
+                 max_det=30000, max_entries=10000):
+        self.yolo = yolo
+        self.version = detector_version(yolo, weights_path)
+        self.directory = directory
+        self.min_confidence = min_confidence
+        self.cache_iou = cache_iou
+        self.max_det = max_det
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, image):
+        return f"{self.version}-{self.min_confidence:g}-{self.cache_iou:g}-{image_key(image)}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def _get(self, key):
+        with self.lock:
+            records = self.entries.get(key)
+            if records is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return records
+        if self.directory is not None and os.path.exists(self._path(key)):
+            records = np.load(self._path(key))
+            self._put(key, records, save=False)
+            with self.lock:
+                self.stats["disk_hits"] += 1
+            return records
+        return None
+
+    def _put(self, key, records, save=True):
+        with self.lock:
+            self.entries[key] = records
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        if save and self.directory is not None:
+            # zapis do pliku tymczasowego i zamiana, aby rownolegle procesy nie
+            # odczytaly niepelnego pliku
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, records)
+            os.replace(tmp_path, self._path(key))
+
+    def _records(self, boxes, classes, scores):
+        records = np.zeros(len(boxes), dtype=RAW_DTYPE)
+        records["box"] = boxes
+        records["score"] = scores
+        records["cls"] = classes
+        return records
+
+    # surowe wyniki detektora dla wielu obrazow, obrazy spoza pamieci wykrywane sa
+    # jedna paczka
+    def raw_many(self, images):
+        keys = [self.key(image) for image in images]
+        found = [self._get(key) for key in keys]
+        missing = [index for index, records in enumerate(found) if records is None]
+        if missing:
+            with self.lock:
+                self.stats["misses"] += len(missing)
+            metrics.increment("detection_cache_misses", len(missing))
+            results = self.yolo([images[index] for index in missing], conf=self.min_confidence,
+                                iou=self.cache_iou, max_det=self.max_det, verbose=False)
+            for index, result in zip(missing, results):
+                found[index] = self._records(result.boxes.xyxy.cpu().numpy(), result.boxes.cls.cpu().numpy(),
+                                             result.boxes.conf.cpu().numpy())
+                self._put(keys[index], found[index])
+        metrics.increment("detection_cache_hits", len(images) - len(missing))
+        return found
+
+    def raw(self, image):
+        return self.raw_many([image])[0]
+
+    # ponowne zastosowanie progu pewnosci i NMS do zapisanych wynikow, format taki
+    # jak z tiling.detect_boxes
+    def filter(self, records, confidence=0.25, iou=0.7, max_det=300):
+        if confidence < self.min_confidence or iou > self.cache_iou:
+            raise ValueError(f"Zapisane wyniki obejmują confidence >= {self.min_confidence} "
+                             f"i iou <= {self.cache_iou}")
+        records = records[records["score"] >= confidence]
+        keep = class_nms(records["box"], records["cls"], records["score"], iou, max_det)
+        records = records[keep]
+        return records["box"].astype(np.float64), records["cls"].astype(np.float32), records["score"]
+
+    def detect(self, image, confidence=0.25, iou=0.7):
+        return self.filter(self.raw(image), confidence, iou)
+
+    def detect_many(self, images, confidence=0.25, iou=0.7):
+        return [self.filter(records, confidence, iou) for records in self.raw_many(images)]
+
+# przeglad siatki parametrow detekcji i przypisania tablic do aut na zbiorze obrazow:
+# detektor uruchamiany jest raz na obraz, a kazda kombinacja parametrow liczona jest
+# z zapisanych wynikow. Opcjonalnie tablice sa rozpoznawane, a teksty zapamietywane
+# dla (obraz, box), wiec kombinacje o tych samych boxach nie powtarzaja rozpoznawania
+if __name__ == '__main__':
+    import argparse
+    import itertools
+    import json
+    import time
+    import cv2
+    from association import associate
+    from detector import add_detector_arguments, detector_kwargs, load_detector
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Przegląd parametrów detekcji na podstawie zapisanych wyników detektora")
+    parser.add_argument("source", nargs="?", default=os.path.join(dir_path, "..", "test_data"),
+                        help="folder z obrazami lub wzorzec glob")
+    parser.add_argument("--weights", default=os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt"))
+    add_detector_arguments(parser)
+    parser.add_argument("--cache-dir", help="folder na surowe wyniki detektora (zachowywane między uruchomieniami)")
+    parser.add_argument("--min-confidence", type=float, default=0.001,
+                        help="najmniejsza pewność zapisywanych wyników detektora")
+    parser.add_argument("--confidence", type=float, nargs="+", default=[0.1, 0.25, 0.4, 0.55])
+    parser.add_argument("--iou", type=float, nargs="+", default=[0.5, 0.7, 0.9])
+    parser.add_argument("--license-plate-car-ioa", type=float, nargs="+", default=[0.7, 0.85, 0.95])
+    parser.add_argument("--recognize", action="store_true",
+                        help="rozpoznawaj tablice i licz odczyty zgodne z formatem polskich tablic")
+    parser.add_argument("--check", type=int, default=0,
+                        help="porównaj wyniki z pamięci z ponowną detekcją dla podanej liczby obrazów")
+    parser.add_argument("-o", "--output", help="plik wynikowy JSON")
+    args = parser.parse_args()
+
+    from batch import find_images
+    paths = find_images(args.source, recursive=True)
+    images = [image for image in map(cv2.imread, paths) if image is not None]
+    yolo = load_detector(args.weights, **detector_kwargs(args))
+    cache = DetectionCache(yolo, args.weights, args.cache_dir, args.min_confidence)
+
+    start = time.perf_counter()
+    raw = [cache.raw(image) for image in images]
+    inference_time = time.perf_counter() - start
+    print(f"obrazów: {len(images)}, detekcja: {inference_time:.2f} s ({cache.stats})")
+
+    if args.check:
+        # zgodnosc z detekcja wykonana bezposrednio przy tych samych parametrach
+        matched = total = 0
+        for image, records in zip(images[:args.check], raw):
+            for confidence, iou in itertools.product(args.confidence, args.iou):
+                boxes, classes, _ = cache.filter(records, confidence, iou)
+                direct_boxes, direct_classes, _ = detect_boxes(yolo, [image], confidence, iou)[0]
+                total += len(direct_boxes)
+                for box, cls in zip(direct_boxes, direct_classes):
+                    same = (classes == cls) & (np.abs(boxes - box).max(axis=1, initial=0) <= 1.)
+                    matched += bool(same.any())
+        print(f"zgodność z ponowną detekcją: {matched}/{total}")
+
+    if args.recognize:
+        from recognition import load_model, recognize_plates_decoded
+        model, preprocess = load_model()
+    texts = {}
+
+    grid = []
+    start = time.perf_counter()
+    for confidence, iou, ioa in itertools.product(args.confidence, args.iou, args.license_plate_car_ioa):
+        point_start = time.perf_counter()
+        summary = {"confidence": confidence, "iou": iou, "license_plate_car_ioa": ioa,
+                   "cars": 0, "plates": 0, "attached_plates": 0, "unattached_plates": 0}
+        if args.recognize:
+            summary.update({"read_plates": 0, "pattern_plates": 0})
+        for image_index, (image, records) in enumerate(zip(images, raw)):
+            boxes, classes, _ = cache.filter(records, confidence, iou)
+            association = associate(boxes, classes, ioa)
+            summary["cars"] += len(association.car_boxes)
+            summary["plates"] += len(association.plate_boxes)
+            summary["unattached_plates"] += int(association.unattached.sum())
+            summary["attached_plates"] += int(association.assignment.any(axis=0).sum())
+            if args.recognize:
+                plate_boxes = [tuple(box) for box in association.plate_boxes.tolist()]
+                new = [box for box in plate_boxes if (image_index, box) not in texts]
+                crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in new]
+                for box, plate in zip(new, recognize_plates_decoded(crops, model, preprocess)):
+                    texts[(image_index, box)] = plate
+                for box in plate_boxes:
+                    plate = texts[(image_index, box)]
+                    summary["read_plates"] += plate is not None and len(plate.text.strip()) > 0
+                    summary["pattern_plates"] += plate is not None and plate.pattern is not None
+        summary["time_ms"] = round(1000 * (time.perf_counter() - point_start), 2)
+        grid.append(summary)
+    sweep_time = time.perf_counter() - start
+
+    columns = [column for column in grid[0] if column != "time_ms"] + ["time_ms"]
+    print(" ".join(f"{column:>18}" for column in columns))
+    for summary in grid:
+        print(" ".join(f"{summary[column]:>18}" for column in columns))
+    print(f"kombinacji: {len(grid)}, przegląd: {sweep_time:.2f} s "
+          f"(detekcja każdej kombinacji od nowa zajęłaby ok. {len(grid) * inference_time:.0f} s)")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"images": len(images), "inference_s": inference_time, "sweep_s": sweep_time, "grid": grid},
+                      f, ensure_ascii=False, indent=2)
@@ -0,0 +1,207 @@
+import numpy as np
+
+# rekord wykrytego obiektu: bounding box, pewnosc, klasa YOLO oraz dla tablic indeks
+# rekordu auta, do ktorego tablica jest przypisana (NO_CAR dla aut i tablic
+# nieprzypisanych). Tablica przypisana do kilku aut ma osobny rekord dla kazdego z nich
+DETECTION_DTYPE = np.dtype([("box", np.int32, (4,)), ("score", np.float32), ("cls", np.int16),
+                            ("car", np.int32)])
+NO_CAR = -1
+
+# zwarty wynik detekcji jednego obrazu: rekordy w tablicy strukturalnej NumPy, a
+# wycinki aut i tablic tworzone dopiero na zadanie. Dopoki obiekt trzyma referencje do
+# obrazu, wycinki sa widokami (bez kopiowania), detach() zamienia potrzebne wycinki na
+# male kopie i zwalnia caly obraz
+class Detections:
+    __slots__ = ("records", "image", "crops")
+
+    def __init__(self, records, image=None, crops=None):
+        self.records = records
+        self.image = image
+        # wlasne kopie wycinkow po detach(), None dla wycinkow niezachowanych
+        self.crops = crops
+
+    # rekordy w kolejnosci: auta, tablice kolejnych aut, tablice nieprzypisane, czyli
+    # w tej samej kolejnosci, w jakiej tablice wystepuja w parach z pairs_from_association.
+    # plate_scores to pewnosci wszystkich wykrytych tablic (przed usunieciem duplikatow,
+    # jak association.plate_indices)
+    @classmethod
+    def from_association(cls, image, association, car_scores=None, plate_scores=None):
+        n_cars = len(association.car_boxes)
+        car_indices, plate_indices = np.nonzero(association.assignment)
+        unattached = np.flatnonzero(association.unattached)
+        plate_indices = np.concatenate([plate_indices, unattached]).astype(np.int64)
+        records = np.zeros(n_cars + len(plate_indices), dtype=DETECTION_DTYPE)
+        records["box"][:n_cars] = association.car_boxes
+        records["box"][n_cars:] = association.plate_boxes[plate_indices]
+        records["cls"][n_cars:] = 1
+        records["car"] = NO_CAR
+        records["car"][n_cars:n_cars + len(car_indices)] = car_indices
+        if car_scores is not None:
+            records["score"][:n_cars] = car_scores
+        if plate_scores is not None:
+            records["score"][n_cars:] = np.asarray(plate_scores)[association.plate_indices[plate_indices]]
+        return cls(records, image)
+
+    def __len__(self):
+        return len(self.records)
+
+    def car_indices(self):
+        return np.flatnonzero(self.records["cls"] == 0)
+
+    # indeksy rekordow tablic, wszystkich lub przypisanych do rekordu auta car (NO_CAR -
+    # tablice nieprzypisane)
+    def plate_indices(self, car=None):
+        plates = self.records["cls"] != 0
+        if car is not None:
+            plates &= self.records["car"] == car
+        return np.flatnonzero(plates)
+
+    def boxes(self, indices=None):
+        boxes = self.records["box"] if indices is None else self.records["box"][indices]
+        return boxes.tolist()
+
+    # wycinek obiektu: widok obrazu (copy=False) lub wlasna kopia (copy=True)
+    def crop(self, index, copy=False):
+        if self.crops is not None and self.crops[index] is not None:
+            return self.crops[index].copy() if copy else self.crops[index]
+        if self.image is None:
+            raise ValueError("Wycinek nie został zachowany, a obraz został zwolniony")
+        x1, y1, x2, y2 = self.records["box"][index].tolist()
+        crop = self.image[y1:y2, x1:x2]
+        return crop.copy() if copy else crop
+
+    def plate_crops(self, copy=False):
+        return [self.crop(index, copy) for index in self.plate_indices()]
+
+    # zachowanie kopii wycinkow (keep="plates", "all" lub None) i zwolnienie obrazu
+    def detach(self, keep="plates"):
+        if self.image is None:
+            return self
+        if keep == "all":
+            indices = range(len(self.records))
+        elif keep == "plates":
+            indices = self.plate_indices()
+        elif keep is None:
+            indices = []
+        else:
+            raise ValueError(f"Nieznany zakres wycinków: {keep}")
+        crops = list(self.crops) if self.crops is not None else [None] * len(self.records)
+        for index in indices:
+            if crops[index] is None:
+                crops[index] = self.crop(index, copy=True)
+        self.crops = crops
+        self.image = None
+        return self
+
+    # liczba bajtow zajmowanych przez rekordy i wlasne kopie wycinkow (bez obrazu)
+    @property
+    def nbytes(self):
+        crops = sum(crop.nbytes for crop in self.crops if crop is not None) if self.crops is not None else 0
+        return self.records.nbytes + crops
+
+    # pary w formacie pairs_from_association
+    def to_pairs(self, return_boxes=False, copy=False):
+        pairs = []
+        for car in list(self.car_indices()) + [NO_CAR]:
+            plates = self.plate_indices(car)
+            car_crop = self.crop(car, copy) if car != NO_CAR else None
+            plate_crops = [self.crop(plate, copy) for plate in plates]
+            if return_boxes is True:
+                car_box = self.records["box"][car].tolist() if car != NO_CAR else None
+                pairs.append([car_crop, plate_crops, car_box, self.boxes(plates)])
+            else:
+                pairs.append([car_crop, plate_crops])
+        return pairs
+
+    # opis w formacie describe_pairs (wraz z pewnosciami), texts to teksty kolejnych
+    # tablic w kolejnosci plate_indices(), opcjonalne confidences to pewnosci znakow
+    # kolejnych tablic (None dla tablic nieprzetworzonych)
+    def to_dict(self, texts, track_ids=None, confidences=None):
+        plate_results = {}
+        for position, index in enumerate(self.plate_indices()):
+            record = self.records[index]
+            plate_result = {"box": record["box"].tolist(), "score": round(float(record["score"]), 4),
+                            "text": texts[position]}
+            if track_ids is not None:
+                plate_result["track_id"] = track_ids[position]
+            if confidences is not None:
+                plate_result["confidences"] = confidences[position]
+            plate_results.setdefault(int(record["car"]), []).append(plate_result)
+        cars = [{"box": self.records["box"][car].tolist(), "score": round(float(self.records["score"][car]), 4),
+                 "plates": plate_results.get(int(car), [])} for car in self.car_indices()]
+        return {"cars": cars, "unattached_plates": plate_results.get(NO_CAR, [])}
+
+    # serializacja samych rekordow (bez wycinkow), 28 bajtow na obiekt
+    def to_bytes(self):
+        return self.records.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, image=None):
+        return cls(np.frombuffer(data, dtype=DETECTION_DTYPE).copy(), image)
+
+# pamiec zajmowana przez wyniki detekcji zachowane dla wielu obrazow (np. w GUI lub
+# przy przetwarzaniu strumienia): pary z widokami wycinkow trzymaja cale klatki, a
+# odlaczone obiekty Detections tylko kopie wycinkow tablic lub same rekordy
+if __name__ == '__main__':
+    import argparse
+    import gc
+    import time
+    import tracemalloc
+    from association import associate
+
+    parser = argparse.ArgumentParser(description="Pamięć wyników detekcji zachowanych dla wielu obrazów")
+    parser.add_argument("--images", type=int, default=10000)
+    parser.add_argument("--frame-size", type=int, nargs=2, default=[1280, 720], help="szerokość i wysokość klatki")
+    parser.add_argument("--cars", type=int, default=4, help="liczba aut na klatce")
+    parser.add_argument("--memory-limit-mb", type=float, default=1024.,
+                        help="przerwij pomiar trybu po przekroczeniu limitu i oszacuj wynik dla wszystkich obrazów")
+    args = parser.parse_args()
+
+    from YOLO_utils import pairs_from_association
+    width, height = args.frame_size
+    rng = np.random.default_rng(0)
+
+    def random_detections():
+        x1 = rng.integers(0, width - 300, args.cars)
+        y1 = rng.integers(0, height - 200, args.cars)
+        car_boxes = np.stack([x1, y1, x1 + 300, y1 + 200], axis=1)
+        plate_boxes = np.stack([x1 + 100, y1 + 150, x1 + 200, y1 + 175], axis=1)
+        boxes = np.concatenate([car_boxes, plate_boxes])
+        classes = np.concatenate([np.zeros(args.cars), np.ones(args.cars)])
+        return boxes, classes, rng.random(2 * args.cars)
+
+    modes = {
+        "pairs (views)": lambda frame, association, scores: pairs_from_association(frame, association),
+        "Detections (views)": lambda frame, association, scores: Detections.from_association(
+            frame, association, scores[:args.cars], scores[args.cars:]),
+        "Detections.detach('plates')": lambda frame, association, scores: Detections.from_association(
+            frame, association, scores[:args.cars], scores[args.cars:]).detach("plates"),
+        "Detections.detach(None)": lambda frame, association, scores: Detections.from_association(
+            frame, association, scores[:args.cars], scores[args.cars:]).detach(None),
+        "Detections.to_bytes()": lambda frame, association, scores: Detections.from_association(
+            frame, association, scores[:args.cars], scores[args.cars:]).to_bytes(),
+    }
+    print(f"obrazów: {args.images}, klatka {width}x{height}, aut na klatce: {args.cars}")
+    print(f"{'tryb':>28} {'obrazów':>8} {'pamięć [MB]':>12} {'na obraz [kB]':>14} "
+          f"{'szac. dla wszystkich [MB]':>26} {'czas [µs/obraz]':>16}")
+    for name, make in modes.items():
+        gc.collect()
+        tracemalloc.start()
+        retained = []
+        elapsed = 0.
+        for i in range(args.images):
+            frame = np.full((height, width, 3), i % 255, dtype=np.uint8)
+            boxes, classes, scores = random_detections()
+            association = associate(boxes, classes)
+            start = time.perf_counter()
+            retained.append(make(frame, association, scores))
+            elapsed += time.perf_counter() - start
+            del frame
+            if tracemalloc.get_traced_memory()[0] > args.memory_limit_mb * 2 ** 20:
+                break
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        per_image = current / len(retained)
+        print(f"{name:>28} {len(retained):>8} {current / 2 ** 20:>12.1f} {per_image / 1024:>14.2f} "
+              f"{per_image * args.images / 2 ** 20:>26.1f} {1e6 * elapsed / len(retained):>16.1f}")
+        del retained
@@ -0,0 +1,135 @@
+import os
+import shutil
+
+# formaty detektora: wagi pytorch (.pt) lub model wyeksportowany przez ultralytics
+# do uruchamiania na CPU
+DETECTOR_FORMATS = ("pt", "onnx", "openvino", "torchscript")
+# precyzja eksportu, int8 wymaga danych kalibracyjnych (plik YAML zbioru danych YOLO)
+DETECTOR_PRECISIONS = ("fp32", "fp16", "int8")
+_QUANTIZE = {"fp32": None, "fp16": 16, "int8": 8}
+
+# sciezka wyeksportowanego modelu obok wag, nazwa zawiera rozmiar wejscia i precyzje,
+# wiec rozne warianty nie nadpisuja sie nawzajem
+def get_export_path(weights_path, format, imgsz=640, precision="fp32"):
+    stem = os.path.splitext(weights_path)[0]
+    name = f"{stem}.{imgsz}.{precision}"
+    if format == "onnx":
+        return name + ".onnx"
+    if format == "torchscript":
+        return name + ".torchscript"
+    if format == "openvino":
+        return name + "_openvino_model"
+    raise ValueError(f"Nieznany format detektora: {format}")
+
+# eksport detektora (tylko gdy brak aktualnego eksportu nowszego od wag). Modele
+# eksportowane sa z dynamicznym rozmiarem paczki, aby wiele klatek moglo byc
+# przetwarzanych w jednym wywolaniu
+def export_detector(weights_path, format="onnx", imgsz=640, precision="fp32", calibration_data=None):
+    from ultralytics import YOLO
+    export_path = get_export_path(weights_path, format, imgsz, precision)
+    if os.path.exists(export_path) and os.path.getmtime(export_path) >= os.path.getmtime(weights_path):
+        return export_path
+    if precision == "int8" and calibration_data is None:
+        raise ValueError("Eksport INT8 wymaga danych kalibracyjnych (calibration_data)")
+    kwargs = {"format": format, "imgsz": imgsz, "dynamic": format != "torchscript", "device": "cpu"}
+    if _QUANTIZE[precision] is not None:
+        kwargs["quantize"] = _QUANTIZE[precision]
+    if calibration_data is not None:
+        kwargs["data"] = calibration_data
+    exported = YOLO(weights_path).export(**kwargs)
+    exported = str(exported).rstrip(os.sep)
+    # ultralytics zapisuje eksport pod stala nazwa obok wag, przeniesienie pod nazwe wariantu
+    if os.path.isdir(export_path):
+        shutil.rmtree(export_path)
+    os.replace(exported, export_path)
+    return export_path
+
+# detektor YOLO w wybranym formacie, wywolywany tak jak YOLO(weights_path); dla
+# formatow innych niz pt model jest eksportowany przy pierwszym uzyciu. Rozmiar wejscia
+# zapisywany jest w domyslnych argumentach modelu, wiec obowiazuje przy kazdym
+# wywolaniu (modele z dynamicznym rozmiarem wejscia uzylyby inaczej domyslnego 640)
+def load_detector(weights_path, format="pt", imgsz=640, precision="fp32", calibration_data=None):
+    from ultralytics import YOLO
+    if format == "pt":
+        detector = YOLO(weights_path)
+    else:
+        detector = YOLO(export_detector(weights_path, format, imgsz, precision, calibration_data), task="detect")
+    detector.overrides["imgsz"] = imgsz
+    return detector
+
+def add_detector_arguments(parser):
+    parser.add_argument("--detector-format", default="pt", choices=DETECTOR_FORMATS,
+                        help="wagi pytorch lub model detektora wyeksportowany do uruchamiania na CPU")
+    parser.add_argument("--detector-precision", default="fp32", choices=DETECTOR_PRECISIONS,
+                        help="precyzja wyeksportowanego detektora")
+    parser.add_argument("--detector-imgsz", type=int, default=640,
+                        help="rozmiar wejścia detektora (również nazwa wariantu eksportu)")
+    parser.add_argument("--calibration-data", help="plik YAML zbioru danych YOLO do kalibracji INT8")
+
+def detector_kwargs(args):
+    return {"format": args.detector_format, "imgsz": args.detector_imgsz, "precision": args.detector_precision,
+            "calibration_data": args.calibration_data}
+
+# przepustowosc detekcji obraz po obrazie (dotychczasowa sciezka) i w paczkach dla
+# wag pytorch i wyeksportowanych modeli, wraz ze zgodnoscia detekcji z wagami pytorch
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import time
+    import cv2
+    from association import box_areas, intersection_areas
+    from tiling import detect_boxes
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Przepustowość detekcji pojedynczych obrazów i paczek")
+    parser.add_argument("--weights", default=os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt"))
+    parser.add_argument("--formats", nargs="+", default=["pt", "onnx"], choices=DETECTOR_FORMATS)
+    parser.add_argument("--precision", default="fp32", choices=DETECTOR_PRECISIONS)
+    parser.add_argument("--calibration-data", help="plik YAML zbioru danych YOLO do kalibracji INT8")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--images", type=int, default=16, help="liczba obrazów z test_data")
+    parser.add_argument("--frame-size", type=int, nargs=2, default=[1280, 720],
+                        help="obrazy skalowane są do wspólnego rozmiaru klatki, jak z kamer (0 0 - bez skalowania)")
+    parser.add_argument("--confidence", type=float, default=0.25)
+    parser.add_argument("--torch-threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.torch_threads > 0:
+        import torch
+        torch.set_num_threads(args.torch_threads)
+    paths = sorted(glob.glob(os.path.join(dir_path, "..", "test_data", "**", "*.*"), recursive=True))
+    images = [image for image in map(cv2.imread, paths) if image is not None]
+    images = (images * (args.images // max(len(images), 1) + 1))[:args.images]
+    # obrazy roznych rozmiarow w jednej paczce sa uzupelniane do kwadratu imgsz x imgsz,
+    # a pojedyncze obrazy tylko do wielokrotnosci kroku sieci
+    if all(args.frame_size):
+        images = [cv2.resize(image, tuple(args.frame_size), interpolation=cv2.INTER_AREA) for image in images]
+    print(f"obrazów: {len(images)}, rozmiar wejścia: {args.imgsz}")
+    print(f"{'format':>12} {'paczka':>7} {'obrazy/s':>9} {'ms/obraz':>9} {'zgodność':>9}")
+
+    reference = None
+    for format in args.formats:
+        precision = args.precision if format != "pt" else "fp32"
+        detector = load_detector(args.weights, format, args.imgsz, precision, args.calibration_data)
+        for batch_size in args.batch_sizes:
+            batches = [images[start:start + batch_size] for start in range(0, len(images), batch_size)]
+            detect_boxes(detector, batches[0], args.confidence)
+            start = time.perf_counter()
+            detected = [result for batch in batches for result in detect_boxes(detector, batch, args.confidence)]
+            elapsed = time.perf_counter() - start
+            if reference is None:
+                reference = detected
+            # odsetek detekcji wzorca (pierwszy format, pierwsza paczka) odnalezionych z IoU >= 0.5
+            matched = total = 0
+            for (ref_boxes, ref_classes, _), (boxes, classes, _) in zip(reference, detected):
+                total += len(ref_boxes)
+                if len(ref_boxes) and len(boxes):
+                    intersections = intersection_areas(ref_boxes, boxes)
+                    ious = intersections / (box_areas(ref_boxes)[:, None] + box_areas(boxes)[None, :] - intersections)
+                    ious = ious * (ref_classes[:, None] == classes[None, :])
+                    matched += int((ious.max(axis=1) >= 0.5).sum())
+            agreement = matched / total if total else 1.
+            name = format if format == "pt" else f"{format}-{precision}"
+            print(f"{name:>12} {batch_size:>7} {len(images) / elapsed:>9.2f} {1000 * elapsed / len(images):>9.1f} "
+                  f"{agreement:>9.1%}")
@@ -1,18 +1,48 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 import cv2
 from PIL import Image, ImageTk
-from ultralytics import YOLO
 from YOLO_utils import crop_boxes_from_image
-from recognition import load_model, process_license_plate
-
+from startup import ModelLoader
+from result_store import ResultStore
+from image_loading import load_image
+
+# Liczba tablic rozpoznawanych w jednym kroku zadania, pomiędzy krokami
+# aktualizowany jest postęp i sprawdzane jest anulowanie
+RECOGNITION_CHUNK_SIZE = 8
+
+# Kolejne obrazy w kolejce wczytywane są z wyprzedzeniem
+PREFETCH_JOBS = 2
+# Rozmiar miniatur wyświetlanych obrazów
+THUMBNAIL_SIZE = (400, 300)
+
+# Zadanie przetwarzania pojedynczego obrazu
+class Job:
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self.status = "oczekuje"
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.result = None
+        # Future z obrazem wczytanym raz dla miniatury i detekcji (image_loading.LoadedImage)
+        self.loaded = None
+        self.thumbnail = None
+
+# decode_min_size - obrazy JPEG dekodowane są w zmniejszonej rozdzielczości (dłuższy
+# bok co najmniej tyle pikseli) do detekcji i miniatury, pełna rozdzielczość tylko dla
+# obrazów z tablicami; None - detekcja w pełnej rozdzielczości
 class App:
-    def __init__(self, root):
+    def __init__(self, root, decode_min_size=None):
         self.root = root
+        self.decode_min_size = decode_min_size
         self.root.title("Detekcja aut i odczytywanie rejestracji")
-        self.root.geometry("1200x600")
+        self.root.geometry("1200x700")
         self.root.configure(bg="#f0f0f0")
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
         button_style = {
             "font": ("Arial", 12),
@@ -22,27 +52,42 @@ class App:
             "activebackground": "#4cae4c",
         }
 
-        # Inicjalizacja YOLO
+        # Ładowanie YOLO i modelu rozpoznawania tablic rejestracyjnych w tle,
+        # okno jest dostępne zanim modele zostaną załadowane
         dir_path = os.path.dirname(os.path.realpath(__file__))
-        weights_path = os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt")
-        self.yolo = YOLO(weights_path)
-
-        # Inicjalizacja modelu rozpoznawania tablic rejestracyjnych
-        self.recognition_model, self.preprocess = load_model()
+        self.models = ModelLoader().start()
+        self.yolo = None
+        self.recognition_model = None
+        self.preprocess = None
+
+        # Detekcja i rozpoznawanie wykonywane są w wątku roboczym, wyniki trafiają
+        # do kolejki zdarzeń odczytywanej w wątku GUI przez root.after
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.events = queue.Queue()
+        # Wczytywanie obrazów w tle, dekodowanie kolejnych obrazów trwa w trakcie detekcji
+        self.loader = ThreadPoolExecutor(max_workers=PREFETCH_JOBS)
+        self.load_lock = threading.Lock()
 
         # Ścieżki
         self.results_dir = os.path.join(dir_path, "..", "results")
         os.makedirs(self.results_dir, exist_ok=True)
+        # Wszystkie odczyty tablic (z miniaturami) dopisywane są do bazy wyników
+        self.result_store = ResultStore(os.path.join(self.results_dir, "results.db"), thumbnails=True)
 
-        # Przechowywanie ścieżki do obrazu użytkownika i wyników detekcji
-        self.image_path = None
-        self.detections = []
+        # Kolejka obrazów użytkownika i wyniki ich przetwarzania
+        self.jobs = []
+        self.current_job = None
         self.current_car_index = 0
 
         # Elementy GUI
         self.frame_images = tk.Frame(self.root, bg="#f0f0f0")
         self.frame_images.pack(pady=10, fill=tk.BOTH, expand=True)
 
+        # Lista obrazów w kolejce
+        self.jobs_listbox = tk.Listbox(self.frame_images, width=40, height=15, font=("Arial", 10))
+        self.jobs_listbox.pack(side="left", padx=10, pady=10, fill=tk.Y)
+        self.jobs_listbox.bind("<<ListboxSelect>>", self.select_job)
+
         # Etykiety dla obrazów
         self.original_label = tk.Label(self.frame_images, bg="#f0f0f0", text="Oryginalny obraz")
         self.original_label.pack(side="left", padx=10, pady=10, expand=True)
@@ -54,25 +99,33 @@ class App:
         self.cropped_label.pack(side="left", padx=10, pady=10, expand=True)
 
         # Przyciski
+        self.buttons_frame = tk.Frame(self.root, bg="#f0f0f0")
+        self.buttons_frame.pack(pady=5)
+
         self.select_button = tk.Button(
-            self.root, text="Zaimportuj Zdjęcie", command=self.select_image, **button_style
+            self.buttons_frame, text="Zaimportuj Zdjęcia", command=self.select_images, **button_style
         )
-        self.select_button.pack(pady=5)
+        self.select_button.pack(side="left", padx=5)
 
         self.detect_button = tk.Button(
-            self.root, text="Wykryj auta i tablice", command=self.detect_objects, state=tk.DISABLED, **button_style
+            self.buttons_frame, text="Wykryj i rozpoznaj tablice", command=self.detect_objects,
+            state=tk.DISABLED, **button_style
         )
-        self.detect_button.pack(pady=5)
+        self.detect_button.pack(side="left", padx=5)
 
-        self.process_button = tk.Button(
-            self.root, text="Rozpoznaj tablicę", command=self.process_plate, state=tk.DISABLED, **button_style
+        self.cancel_button = tk.Button(
+            self.buttons_frame, text="Anuluj", command=self.cancel_jobs, state=tk.DISABLED, **button_style
         )
-        self.process_button.pack(pady=5)
+        self.cancel_button.pack(side="left", padx=5)
 
         self.save_button = tk.Button(
-            self.root, text="Zapisz Wyniki", command=self.save_results, state=tk.DISABLED, **button_style
+            self.buttons_frame, text="Zapisz Wyniki", command=self.save_results, state=tk.DISABLED, **button_style
         )
-        self.save_button.pack(pady=5)
+        self.save_button.pack(side="left", padx=5)
+
+        # Postęp przetwarzania
+        self.progress = ttk.Progressbar(self.root, length=400, mode="determinate", maximum=1.0)
+        self.progress.pack(pady=5)
 
         # Przyciski nawigacji dla wykrytych aut
         self.nav_frame = tk.Frame(self.root, bg="#f0f0f0")
@@ -88,101 +141,287 @@ class App:
         )
         self.next_button.pack(side="left", padx=5)
 
-        # Pole tekstowe do wyświetlania rozpoznanego tekstu tablicy
+        # Pole tekstowe do wyświetlania rozpoznanego tekstu tablic
         self.plate_text_label = tk.Label(self.root, text="Rozpoznany tekst tablicy:", font=("Arial", 12), bg="#f0f0f0")
         self.plate_text_label.pack(pady=5)
 
         self.plate_text_box = tk.Text(self.root, height=2, width=50, font=("Arial", 12), state=tk.DISABLED)
         self.plate_text_box.pack(pady=5)
 
-    def select_image(self):
-        """Pozwól użytkownikowi wybrać plik obrazu i zresetuj GUI."""
-        file_path = filedialog.askopenfilename(
-            title="Wybierz obraz", filetypes=[("Pliki graficzne", "*.png *.jpg *.jpeg *.bmp *.gif")]
-        )
-        if file_path:
-            self.image_path = file_path
-            self.detections = []
-            self.current_car_index = 0
-
-            # Zresetuj GUI
-            self.reset_display()
-
-            # Wyświetl wybrany obraz
-            pil_img = Image.open(file_path)
-            pil_img.thumbnail((400, 300))
-            self.original_photo = ImageTk.PhotoImage(pil_img)
-            self.original_label.config(image=self.original_photo, text="")
-            self.original_label.image = self.original_photo
+        # Informacja o stanie ładowania modeli i przetwarzania
+        self.status_label = tk.Label(self.root, text="Ładowanie modeli...", font=("Arial", 10), bg="#f0f0f0")
+        self.status_label.pack(pady=5)
+        self.root.after(100, self.check_models)
+        self.root.after(50, self.poll_events)
 
-            # Włącz przycisk detekcji
-            self.detect_button.config(state=tk.NORMAL)
+    def check_models(self):
+        """Sprawdź, czy modele zostały załadowane w tle."""
+        if not self.models.ready.is_set():
+            self.root.after(100, self.check_models)
+            return
+        try:
+            self.models.wait()
+        except RuntimeError as e:
+            self.status_label.config(text="Nie udało się załadować modeli")
+            messagebox.showerror("Błąd", str(e))
+            return
+        self.yolo = self.models.yolo
+        self.recognition_model = self.models.model
+        self.preprocess = self.models.preprocess
+        self.status_label.config(text=f"Modele załadowane ({self.models.timings['total']:.1f} s)")
+        self.update_buttons()
+
+    def select_images(self):
+        """Pozwól użytkownikowi wybrać pliki obrazów i dodaj je do kolejki."""
+        file_paths = filedialog.askopenfilenames(
+            title="Wybierz obrazy", filetypes=[("Pliki graficzne", "*.png *.jpg *.jpeg *.bmp *.gif")]
+        )
+        for file_path in file_paths:
+            self.jobs.append(Job(file_path))
+            self.jobs_listbox.insert(tk.END, self.job_description(self.jobs[-1]))
+        if file_paths and self.current_job is None:
+            self.show_job(len(self.jobs) - len(file_paths))
+        self.update_buttons()
+
+    def job_description(self, job):
+        return f"{os.path.basename(job.image_path)} - {job.status}"
+
+    def update_job_status(self, job, status):
+        job.status = status
+        index = self.jobs.index(job)
+        self.jobs_listbox.delete(index)
+        self.jobs_listbox.insert(index, self.job_description(job))
+
+    def update_buttons(self):
+        """Włącz lub wyłącz przyciski zależnie od stanu kolejki."""
+        pending = any(job.status == "oczekuje" for job in self.jobs)
+        running = any(job.status in ("w kolejce", "przetwarzanie") for job in self.jobs)
+        ready = self.yolo is not None
+        self.detect_button.config(state=tk.NORMAL if pending and ready else tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL if running else tk.DISABLED)
+
+    def select_job(self, event=None):
+        """Wyświetl obraz wybrany na liście."""
+        selection = self.jobs_listbox.curselection()
+        if selection:
+            self.show_job(selection[0])
 
     def reset_display(self):
         """Zresetuj wszystkie wyświetlane obrazy i tekst."""
+        self.original_label.config(image="", text="Oryginalny obraz")
         self.annotated_label.config(image="", text="Obraz z oznaczeniami")
         self.cropped_label.config(image="", text="Wycinek auta z tablicą")
-        self.plate_text_box.config(state=tk.NORMAL)
-        self.plate_text_box.delete("1.0", tk.END)
-        self.plate_text_box.config(state=tk.DISABLED)
-        self.process_button.config(state=tk.DISABLED)
+        self.set_plate_text("")
         self.save_button.config(state=tk.DISABLED)
         self.prev_button.config(state=tk.DISABLED)
         self.next_button.config(state=tk.DISABLED)
 
-    def detect_objects(self):
-        """Wykryj auta i tablice rejestracyjne na wybranym obrazie."""
-        if not self.image_path:
-            messagebox.showwarning("Ostrzeżenie", "Najpierw wybierz obraz.")
-            return
+    def set_plate_text(self, text):
+        self.plate_text_box.config(state=tk.NORMAL)
+        self.plate_text_box.delete("1.0", tk.END)
+        self.plate_text_box.insert(tk.END, text)
+        self.plate_text_box.config(state=tk.DISABLED)
 
-        cv_img = cv2.imread(self.image_path)
-        if cv_img is None:
-            messagebox.showerror("Błąd", "Nie można odczytać obrazu.")
+    def show_job(self, index):
+        """Wyświetl wybrany obraz oraz, jeśli jest już przetworzony, jego wyniki."""
+        self.current_job = self.jobs[index]
+        self.current_car_index = 0
+        self.reset_display()
+
+        # Wyświetl wybrany obraz, miniatura tworzona jest w tle i przekazywana przez kolejkę zdarzeń
+        if self.current_job.thumbnail is None:
+            self.original_label.config(text="Wczytywanie obrazu...")
+            job = self.current_job
+            self.load_job_image(job).add_done_callback(
+                lambda future, job=job: self.loader.submit(self.make_thumbnail, job, future))
+        else:
+            self.show_thumbnail()
+
+        result = self.current_job.result
+        if result is None:
             return
 
-        # Wykrywanie obiektów za pomocą YOLO
-        try:
-            self.detections = crop_boxes_from_image(self.yolo, cv_img, save_prediction=True)
-            self.detections = [d for d in self.detections if d[1]]  # Filtruj auta bez tablic
-
-            if not self.detections:
-                messagebox.showinfo("Informacja", "Nie wykryto aut z tablicami rejestracyjnymi.")
-                return
-
-            # Wyświetl obraz z oznaczeniami
-            annotated_path = os.path.join(self.results_dir, "prediction.jpg")
-            if os.path.exists(annotated_path):
-                pil_annotated = Image.open(annotated_path)
-                pil_annotated.thumbnail((400, 300))
-                self.annotated_photo = ImageTk.PhotoImage(pil_annotated)
-                self.annotated_label.config(image=self.annotated_photo, text="")
-                self.annotated_label.image = self.annotated_photo
+        # Wyświetl obraz z oznaczeniami
+        if result["annotated"] is not None:
+            self.annotated_photo = ImageTk.PhotoImage(result["annotated"])
+            self.annotated_label.config(image=self.annotated_photo, text="")
+            self.annotated_label.image = self.annotated_photo
 
+        if result["detections"]:
             # Pokaż pierwsze auto
-            self.current_car_index = 0
             self.show_current_car()
-
-            # Włącz przyciski nawigacji i przetwarzania
             self.prev_button.config(state=tk.NORMAL)
             self.next_button.config(state=tk.NORMAL)
-            self.process_button.config(state=tk.NORMAL)
+            self.save_button.config(state=tk.NORMAL)
 
+    def detect_objects(self):
+        """Dodaj oczekujące obrazy do kolejki zadań wykonywanych w tle."""
+        if self.yolo is None:
+            messagebox.showwarning("Ostrzeżenie", "Modele nie zostały jeszcze załadowane.")
+            return
+        for job in self.jobs:
+            if job.status != "oczekuje":
+                continue
+            self.update_job_status(job, "w kolejce")
+            job.future = self.executor.submit(self.run_job, job)
+            job.future.add_done_callback(lambda future, job=job: self.events.put(("done", job, None)))
+        self.update_buttons()
+
+    def show_thumbnail(self):
+        """Wyświetl miniaturę wybranego obrazu."""
+        self.original_photo = ImageTk.PhotoImage(self.current_job.thumbnail)
+        self.original_label.config(image=self.original_photo, text="")
+        self.original_label.image = self.original_photo
+
+    def load_job_image(self, job):
+        """Zwróć Future z obrazem zadania, wczytywanie rozpoczyna się przy pierwszym wywołaniu."""
+        with self.load_lock:
+            if job.loaded is None:
+                job.loaded = self.loader.submit(load_image, job.image_path, self.decode_min_size)
+            return job.loaded
+
+    def make_thumbnail(self, job, loaded_future):
+        """Utwórz miniaturę wczytanego obrazu i przekaż ją do wątku GUI (wątek wczytujący)."""
+        try:
+            loaded = loaded_future.result()
+            if loaded is not None:
+                thumbnail = loaded.thumbnail(THUMBNAIL_SIZE)
+            else:
+                # Formaty, których nie dekoduje OpenCV (np. GIF)
+                thumbnail = Image.open(job.image_path)
+                thumbnail.thumbnail(THUMBNAIL_SIZE)
+        except (OSError, CancelledError):
+            return
+        self.events.put(("thumbnail", job, thumbnail))
+
+    def run_job(self, job):
+        """Wykryj auta i rozpoznaj wszystkie tablice na obrazie (wątek roboczy)."""
+        self.events.put(("started", job, None))
+        self.events.put(("progress", job, (0., "Wczytywanie obrazu")))
+        loaded = self.load_job_image(job).result()
+        # Wczytywanie kolejnych obrazów w kolejce w trakcie przetwarzania bieżącego
+        waiting = [other for other in self.jobs if other.status == "w kolejce" and other is not job]
+        for other in waiting[:PREFETCH_JOBS]:
+            self.load_job_image(other)
+        if loaded is None:
+            raise ValueError("Nie można odczytać obrazu.")
+        if job.cancel_event.is_set():
+            return None
+
+        # Wykrywanie obiektów za pomocą YOLO na obrazie w zmniejszonej rozdzielczości,
+        # wycinki aut i tablic z obrazu w pełnej rozdzielczości
+        self.events.put(("progress", job, (0.1, "Detekcja aut i tablic")))
+        records, annotated = crop_boxes_from_image(self.yolo, loaded.image, return_annotated=True,
+                                                   annotated_size=THUMBNAIL_SIZE, return_detections=True)
+        records = loaded.full_resolution(records)
+        if job.thumbnail is None:
+            job.thumbnail = loaded.thumbnail(THUMBNAIL_SIZE)
+        # Filtruj auta bez tablic, kopie wycinków sprawiają, że wynik zadania nie trzyma całego obrazu
+        detections = [[car, plates] for car, plates in records.to_pairs(copy=True) if plates]
+        annotated = Image.fromarray(cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB))
+        if job.cancel_event.is_set():
+            return None
+
+        # Rozpoznawanie wszystkich tablic wszystkich aut
+        from recognition import recognize_plates_decoded
+        plates = [plate for _, car_plates in detections for plate in car_plates]
+        decoded = []
+        for start in range(0, len(plates), RECOGNITION_CHUNK_SIZE):
+            self.events.put(("progress", job, (0.5 + 0.5 * start / len(plates),
+                                               f"Rozpoznawanie tablic ({start}/{len(plates)})")))
+            decoded.extend(recognize_plates_decoded(plates[start:start + RECOGNITION_CHUNK_SIZE],
+                                                    self.recognition_model, self.preprocess))
+            if job.cancel_event.is_set():
+                return None
+        texts = ["[PROCESSING ERROR]" if plate is None else plate.text for plate in decoded]
+
+        # Zapis odczytów do bazy wyników, tablice są w tej samej kolejności co w records
+        confidences = [None if plate is None else plate.confidences for plate in decoded]
+        self.result_store.add_result(records.to_dict(texts, confidences=confidences), source=job.image_path,
+                                     plate_images=plates)
+        self.result_store.flush()
+
+        # Obraz nie jest już potrzebny, wynik trzyma tylko kopie wycinków i miniaturę
+        with self.load_lock:
+            job.loaded = None
+
+        # Podział rozpoznanych tekstów na auta
+        plate_texts = []
+        for _, car_plates in detections:
+            plate_texts.append(texts[:len(car_plates)])
+            texts = texts[len(car_plates):]
+        return {"detections": detections, "texts": plate_texts, "annotated": annotated}
+
+    def poll_events(self):
+        """Obsłuż zdarzenia z wątku roboczego w wątku GUI."""
+        try:
+            while True:
+                kind, job, data = self.events.get_nowait()
+                if kind == "started":
+                    self.update_job_status(job, "przetwarzanie")
+                elif kind == "progress":
+                    fraction, message = data
+                    self.progress["value"] = fraction
+                    self.status_label.config(text=f"{os.path.basename(job.image_path)}: {message}")
+                elif kind == "thumbnail":
+                    if job.thumbnail is None:
+                        job.thumbnail = data
+                    if job is self.current_job:
+                        self.show_thumbnail()
+                elif kind == "done":
+                    self.finish_job(job)
+        except queue.Empty:
+            pass
+        self.root.after(50, self.poll_events)
+
+    def finish_job(self, job):
+        """Zapisz wynik zakończonego zadania i wyświetl go, jeśli obraz jest wybrany."""
+        try:
+            job.result = job.future.result()
+            if job.result is None:
+                self.update_job_status(job, "anulowano")
+            elif not job.result["detections"]:
+                self.update_job_status(job, "brak tablic")
+            else:
+                self.update_job_status(job, "gotowe")
+        except CancelledError:
+            self.update_job_status(job, "anulowano")
         except Exception as e:
+            self.update_job_status(job, "błąd")
             messagebox.showerror("Błąd", f"Detekcja nie powiodła się: {e}")
+        if not any(job.status in ("w kolejce", "przetwarzanie") for job in self.jobs):
+            self.progress["value"] = 0
+            self.status_label.config(text="Przetwarzanie zakończone")
+        if job is self.current_job:
+            self.show_job(self.jobs.index(job))
+        self.update_buttons()
+
+    def cancel_jobs(self):
+        """Anuluj bieżące i oczekujące w kolejce zadania."""
+        for job in self.jobs:
+            if job.status in ("w kolejce", "przetwarzanie"):
+                job.cancel_event.set()
+                job.future.cancel()
+        self.status_label.config(text="Anulowanie...")
 
     def show_current_car(self):
-        """Wyświetl aktualnie wybrane auto i jego tablicę."""
-        if not self.detections or self.current_car_index >= len(self.detections):
+        """Wyświetl aktualnie wybrane auto i rozpoznany tekst jego tablic."""
+        if self.current_job is None or self.current_job.result is None:
+            return
+        detections = self.current_job.result["detections"]
+        if self.current_car_index >= len(detections):
             return
 
-        car, plates = self.detections[self.current_car_index]
+        car, plates = detections[self.current_car_index]
         if car is not None:
             car_img = Image.fromarray(cv2.cvtColor(car, cv2.COLOR_BGR2RGB))
-            car_img.thumbnail((400, 300))
+            car_img.thumbnail(THUMBNAIL_SIZE)
             self.cropped_photo = ImageTk.PhotoImage(car_img)
             self.cropped_label.config(image=self.cropped_photo, text="")
             self.cropped_label.image = self.cropped_photo
+        else:
+            self.cropped_label.config(image="", text="Tablice nieprzypisane do auta")
+        self.set_plate_text("\n".join(self.current_job.result["texts"][self.current_car_index]))
 
     def prev_car(self):
         """Pokaż poprzednie auto na liście detekcji."""
@@ -192,42 +431,24 @@ class App:
 
     def next_car(self):
         """Pokaż następne auto na liście detekcji."""
-        if self.current_car_index < len(self.detections) - 1:
+        if self.current_job is None or self.current_job.result is None:
+            return
+        if self.current_car_index < len(self.current_job.result["detections"]) - 1:
             self.current_car_index += 1
             self.show_current_car()
 
-    def process_plate(self):
-        """Przetwarzaj tablicę rejestracyjną aktualnie wybranego auta."""
-        if not self.detections or self.current_car_index >= len(self.detections):
-            return
-
-        car, plates = self.detections[self.current_car_index]
-        if plates:
-            plate = plates[0]  # Przetwarzaj pierwszą wykrytą tablicę
-            try:
-                text = process_license_plate(
-                    image=plate, model=self.recognition_model, preprocess=self.preprocess
-                )
-                self.plate_text_box.config(state=tk.NORMAL)
-                self.plate_text_box.delete("1.0", tk.END)
-                self.plate_text_box.insert(tk.END, text)
-                self.plate_text_box.config(state=tk.DISABLED)
-
-                # Włącz przycisk zapisu
-                self.save_button.config(state=tk.NORMAL)
-
-            except Exception as e:
-                messagebox.showerror("Błąd", f"Przetwarzanie tablicy rejestracyjnej nie powiodło się: {e}")
-
     def save_results(self):
-        """Zapisz aktualnie wyświetlane auto i tekst tablicy do katalogu wyników."""
-        if not self.detections or self.current_car_index >= len(self.detections):
+        """Zapisz aktualnie wyświetlane auto i tekst tablic do katalogu wyników."""
+        if self.current_job is None or self.current_job.result is None:
+            return
+        detections = self.current_job.result["detections"]
+        if self.current_car_index >= len(detections):
             return
 
-        car, plates = self.detections[self.current_car_index]
+        car, plates = detections[self.current_car_index]
         if car is not None:
             car_path = os.path.join(self.results_dir, f"car_{self.current_car_index}.jpg")
-            cv2.imwrite(car_path, cv2.cvtColor(car, cv2.COLOR_RGB2BGR))
+            cv2.imwrite(car_path, car)
 
         plate_text = self.plate_text_box.get("1.0", tk.END).strip()
         if plate_text:
@@ -237,7 +458,24 @@ class App:
 
         messagebox.showinfo("Zapisano", "Wyniki zostały zapisane!")
 
+    def close(self):
+        """Anuluj zadania i zamknij okno."""
+        for job in self.jobs:
+            job.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.loader.shutdown(wait=False, cancel_futures=True)
+        self.result_store.close()
+        self.root.destroy()
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Detekcja aut i odczytywanie rejestracji")
+    parser.add_argument("--decode-min-size", type=int, default=0,
+                        help="dekoduj pliki JPEG w zmniejszonej rozdzielczości, przy której dłuższy bok ma co "
+                             "najmniej tyle pikseli (np. 640), pełna rozdzielczość tylko dla obrazów z tablicami")
+    args = parser.parse_args()
+
     root = tk.Tk()
-    app = App(root)
+    app = App(root, args.decode_min_size or None)
     root.mainloop()
@@ -0,0 +1,213 @@
+import io
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+import metrics
+from detections import Detections
+
+# zmniejszenia dostepne przy dekodowaniu JPEG (skalowanie w dziedzinie DCT, dekoder
+# nie liczy pelnej rozdzielczosci)
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def is_jpeg(data):
+    return len(data) > 2 and bytes(data[:2]) == b"\xff\xd8"
+
+# orientacje EXIF, przy ktorych obraz jest obracany o 90 stopni
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+_ORIENTATION_TAG = 0x0112
+
+# rozmiar obrazu (szerokosc, wysokosc) odczytany z naglowka, bez dekodowania. Rozmiar
+# jest po obrocie zgodnie z orientacja EXIF, ktora cv2.imdecode stosuje przy dekodowaniu
+def image_size(data):
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        if image.getexif().get(_ORIENTATION_TAG) in _TRANSPOSED_ORIENTATIONS:
+            return height, width
+        return width, height
+
+# najwieksze zmniejszenie, przy ktorym dluzszy bok obrazu ma nadal co najmniej
+# min_size pikseli (YOLO i tak skaluje obraz do rozmiaru wejscia)
+def choose_reduction(width, height, min_size):
+    for reduction in sorted(_REDUCED_FLAGS, reverse=True):
+        if max(width, height) / reduction >= min_size:
+            return reduction
+    return 1
+
+# obraz wczytany raz z pliku: zakodowane dane, obraz do detekcji i wyswietlania
+# (przy reduction > 1 zdekodowany w zmniejszonej rozdzielczosci) oraz obraz w pelnej
+# rozdzielczosci, dekodowany z tych samych danych dopiero, gdy potrzebne sa wycinki
+class LoadedImage:
+    def __init__(self, path, data, image, reduction=1, full_size=None, decode_time=0.):
+        self.path = path
+        self.data = data
+        self.image = image
+        self.reduction = reduction
+        self.full_size = full_size or (image.shape[1], image.shape[0])
+        self._full = image if reduction == 1 else None
+        # czas wczytania i dekodowania (rowniez gdy odbylo sie w watku wczytujacym z wyprzedzeniem)
+        self.decode_time = decode_time
+        self.lock = threading.Lock()
+
+    # skala wspolrzednych (x, y) obrazu do detekcji wzgledem pelnej rozdzielczosci
+    @property
+    def scale(self):
+        return self.full_size[0] / self.image.shape[1], self.full_size[1] / self.image.shape[0]
+
+    def full(self):
+        with self.lock:
+            if self._full is None:
+                if self.data is None:
+                    raise ValueError("Dane obrazu zostały zwolnione")
+                with metrics.timer("decode_full"):
+                    self._full = cv2.imdecode(self.data, cv2.IMREAD_COLOR)
+                metrics.increment("full_decodes")
+            return self._full
+
+    # przeniesienie detekcji z obrazu zmniejszonego do pelnej rozdzielczosci. Obraz w
+    # pelnej rozdzielczosci dekodowany jest tylko, gdy wykryto tablice; bez tablic
+    # wycinki aut pochodza z obrazu zmniejszonego
+    def full_resolution(self, detections):
+        if self.reduction == 1:
+            return detections
+        records = detections.records.copy()
+        scale_x, scale_y = self.scale
+        width, height = self.full_size
+        boxes = np.round(records["box"] * np.array([scale_x, scale_y, scale_x, scale_y]))
+        records["box"] = np.clip(boxes, 0, [width, height, width, height])
+        if len(detections.plate_indices()):
+            return Detections(records, self.full())
+        return Detections(records, None, [detections.crop(index, copy=True) for index in range(len(detections))])
+
+    # miniatura RGB do wyswietlenia (PIL), tworzona z obrazu do detekcji
+    def thumbnail(self, size):
+        image = Image.fromarray(cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB))
+        image.thumbnail(size)
+        return image
+
+    # zwolnienie danych i obrazu w pelnej rozdzielczosci, obraz do detekcji zostaje
+    def release(self):
+        with self.lock:
+            self.data = None
+            self._full = self.image if self.reduction == 1 else None
+
+# wczytanie obrazu z pliku, None gdy nie mozna go zdekodowac (jak cv2.imread). Przy
+# min_size pliki JPEG dekodowane sa od razu w zmniejszonej rozdzielczosci, przy ktorej
+# dluzszy bok ma co najmniej min_size pikseli
+def load_image(path, min_size=None):
+    start = time.perf_counter()
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        return None
+    with metrics.timer("decode"):
+        reduction = 1
+        full_size = None
+        if min_size and is_jpeg(data):
+            try:
+                full_size = image_size(data)
+                reduction = choose_reduction(*full_size, min_size)
+            except OSError:
+                full_size = None
+        image = cv2.imdecode(data, _REDUCED_FLAGS.get(reduction, cv2.IMREAD_COLOR))
+    if image is None:
+        return None
+    metrics.increment("reduced_decodes" if reduction > 1 else "full_decodes")
+    return LoadedImage(path, data, image, reduction, full_size, time.perf_counter() - start)
+
+# wczytywanie kolejnych plikow w puli watkow z wyprzedzeniem lookahead obrazow, aby
+# dekodowanie nastepnych obrazow odbywalo sie w trakcie detekcji biezacego (OpenCV
+# zwalnia GIL przy dekodowaniu). Zwraca pary (sciezka, LoadedImage lub None) w
+# kolejnosci wejsciowej
+def prefetch_images(paths, min_size=None, workers=2, lookahead=8):
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = deque()
+        paths = iter(paths)
+        try:
+            for path in paths:
+                pending.append((path, executor.submit(load_image, path, min_size)))
+                if len(pending) >= lookahead:
+                    path, future = pending.popleft()
+                    yield path, future.result()
+            while pending:
+                path, future = pending.popleft()
+                yield path, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+# czas wczytywania obrazow z test_data w pelnej i zmniejszonej rozdzielczosci, czas
+# detekcji przy wczytywaniu w petli i z wyprzedzeniem oraz zgodnosc detekcji na
+# obrazach zmniejszonych z detekcja na pelnych obrazach
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import os
+    from YOLO_utils import crop_boxes_from_image
+    from association import box_areas, intersection_areas
+    from detector import add_detector_arguments, detector_kwargs, load_detector
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Wczytywanie obrazów w zmniejszonej rozdzielczości i z wyprzedzeniem")
+    parser.add_argument("source", nargs="?", default=os.path.join(dir_path, "..", "test_data"))
+    parser.add_argument("--weights", default=os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt"))
+    add_detector_arguments(parser)
+    parser.add_argument("--min-size", type=int, default=640,
+                        help="najmniejszy dłuższy bok obrazu zdekodowanego do detekcji")
+    parser.add_argument("--workers", type=int, default=2, help="wątki wczytujące obrazy")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--confidence", type=float, default=0.25)
+    args = parser.parse_args()
+
+    paths = sorted(path for path in glob.glob(os.path.join(args.source, "**", "*.*"), recursive=True)
+                   if path.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+
+    def measure_decode(min_size):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            loaded = [load_image(path, min_size) for path in paths]
+        return loaded, (time.perf_counter() - start) / args.repeat / len(paths)
+
+    full, full_time = measure_decode(None)
+    reduced, reduced_time = measure_decode(args.min_size)
+    pixels = sum(image.image.size for image in full) / sum(image.image.size for image in reduced)
+    print(f"obrazów: {len(paths)}, zmniejszonych: {sum(image.reduction > 1 for image in reduced)}")
+    print(f"dekodowanie pełne: {1000 * full_time:.1f} ms/obraz, zmniejszone: {1000 * reduced_time:.1f} ms/obraz "
+          f"({pixels:.1f}x mniej pikseli)")
+
+    yolo = load_detector(args.weights, **detector_kwargs(args))
+    crop_boxes_from_image(yolo, full[0].image, confidence=args.confidence)
+
+    # zgodnosc detekcji (IoU >= 0.5, ta sama klasa) po przeniesieniu do pelnej rozdzielczosci
+    matched = total = 0
+    for full_image, reduced_image in zip(full, reduced):
+        reference = crop_boxes_from_image(yolo, full_image.image, confidence=args.confidence, return_detections=True)
+        detected = reduced_image.full_resolution(
+            crop_boxes_from_image(yolo, reduced_image.image, confidence=args.confidence, return_detections=True))
+        total += len(reference)
+        if len(reference) and len(detected):
+            ref_boxes = reference.records["box"].astype(np.float64)
+            boxes = detected.records["box"].astype(np.float64)
+            intersections = intersection_areas(ref_boxes, boxes)
+            ious = intersections / (box_areas(ref_boxes)[:, None] + box_areas(boxes)[None, :] - intersections)
+            ious *= (reference.records["cls"] != 0)[:, None] == (detected.records["cls"] != 0)[None, :]
+            matched += int((ious.max(axis=1) >= 0.5).sum())
+    print(f"zgodność detekcji na obrazach zmniejszonych: {matched}/{total}")
+
+    def run(loader, min_size):
+        start = time.perf_counter()
+        for _, loaded in loader:
+            detections = crop_boxes_from_image(yolo, loaded.image, confidence=args.confidence,
+                                               return_detections=True)
+            loaded.full_resolution(detections).plate_crops()
+        return (time.perf_counter() - start) / len(paths)
+
+    print(f"{'wczytywanie':>28} {'ms/obraz':>9}")
+    for name, min_size in (("pełne", None), ("zmniejszone", args.min_size)):
+        serial = run(((path, load_image(path, min_size)) for path in paths), min_size)
+        prefetched = run(prefetch_images(paths, min_size, args.workers), min_size)
+        print(f"{name + ', w pętli':>28} {1000 * serial:>9.1f}")
+        print(f"{name + ', z wyprzedzeniem':>28} {1000 * prefetched:>9.1f}")
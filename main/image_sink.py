@@ -0,0 +1,188 @@
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import zipfile
+import cv2
+import numpy as np
+import metrics
+
+# zapis obrazow na dysk w watku w tle, pliki otrzymuja unikalne nazwy, wiec
+# rownolegle uruchomienia nie nadpisuja swoich wynikow
+class AsyncImageWriter:
+    def __init__(self, directory, prefix="prediction", extension=".jpg", max_queue_size=32):
+        self.directory = directory
+        self.prefix = prefix
+        self.extension = extension
+        self.queue = queue.Queue(max_queue_size)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.stats = {"written": 0, "dropped": 0, "errors": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def unique_path(self, name=None):
+        if name is None:
+            name = f"{self.prefix}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{next(self.counter)}"
+        return os.path.join(self.directory, name + self.extension)
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    # dodanie obrazu do zapisu, zwraca sciezke pliku lub None, gdy kolejka byla
+    # pelna i block=False. Obraz nie moze byc modyfikowany po przekazaniu
+    def submit(self, image, name=None, block=True):
+        path = self.unique_path(name)
+        try:
+            self.queue.put((path, image), block=block)
+        except queue.Full:
+            self._count("dropped")
+            return None
+        return path
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, image = item
+            try:
+                if not cv2.imwrite(path, image):
+                    raise OSError(f"Nie można zapisać obrazu: {path}")
+                self._count("written")
+            except Exception as e:
+                print(f"Error writing image: {e}")
+                self._count("errors")
+                metrics.increment("image_write_errors")
+
+    # zapisanie obrazow pozostalych w kolejce i zakonczenie watku
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+# obrazy etapow przetwarzania jednej tablicy zbierane w pamieci; kopie, bo
+# przetwarzanie korzysta z buforow wielokrotnego uzytku
+class PlateDebugRecord:
+    __slots__ = ("name", "stages", "nbytes")
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.nbytes = 0
+
+    def add(self, stage, image):
+        image = np.array(image, copy=True)
+        self.stages.append((stage, image))
+        self.nbytes += image.nbytes
+
+# zapis obrazow diagnostycznych segmentacji (debug_folder) w watku w tle z
+# probkowaniem: every_n - co n-ta tablica, max_confidence - tylko tablice, ktorych
+# najmniejsza pewnosc znaku jest ponizej progu (decyzja po rozpoznaniu, wiec wybrane
+# co n-te tablice sa zbierane w pamieci w calosci). Kolejka ograniczona jest laczna
+# liczba bajtow obrazow, nadmiarowe tablice sa pomijane. archive=True zapisuje
+# wszystkie etapy tablicy do jednego pliku ZIP z obrazami PNG zamiast osobnego folderu
+class DebugSink:
+    def __init__(self, directory, every_n=1, max_confidence=None, max_queue_bytes=64 * 2 ** 20,
+                 archive=False, png_compression=3):
+        self.directory = directory
+        self.every_n = max(1, every_n)
+        self.max_confidence = max_confidence
+        self.max_queue_bytes = max_queue_bytes
+        self.archive = archive
+        self.png_params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        self.queue = queue.Queue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.queued_bytes = 0
+        self.stats = {"plates": 0, "sampled": 0, "written": 0, "skipped": 0, "dropped": 0, "errors": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # rekord dla kolejnej tablicy (przekazywany jako debug_folder) lub None, gdy
+    # tablica nie zostala wybrana
+    def start_plate(self, name=None):
+        index = next(self.counter)
+        with self.lock:
+            self.stats["plates"] += 1
+        if index % self.every_n:
+            return None
+        with self.lock:
+            self.stats["sampled"] += 1
+        if name is None:
+            name = f"plate_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{index}"
+        return PlateDebugRecord(name)
+
+    # przekazanie rekordu do zapisu po rozpoznaniu tablicy, zwraca True, gdy rekord
+    # trafil do kolejki
+    def finish(self, record, text=None, confidence=None):
+        if record is None:
+            return False
+        if self.max_confidence is not None and confidence is not None and confidence >= self.max_confidence:
+            with self.lock:
+                self.stats["skipped"] += 1
+            return False
+        with self.lock:
+            if self.queued_bytes + record.nbytes > self.max_queue_bytes:
+                self.stats["dropped"] += 1
+                metrics.increment("debug_plates_dropped")
+                return False
+            self.queued_bytes += record.nbytes
+        self.queue.put((record, {"text": text, "confidence": confidence}))
+        return True
+
+    def _write(self, record, info):
+        encoded = []
+        for stage, image in record.stages:
+            ok, data = cv2.imencode(".png", image, self.png_params)
+            if not ok:
+                raise OSError(f"Nie można zakodować obrazu: {stage}")
+            encoded.append((stage, data.tobytes()))
+        info = json.dumps({"name": record.name, **info, "stages": [stage for stage, _ in record.stages]},
+                          ensure_ascii=False)
+        if self.archive:
+            # obrazy PNG sa juz skompresowane, kompresowany jest tylko opis
+            with zipfile.ZipFile(os.path.join(self.directory, record.name + ".zip"), "w") as archive:
+                for stage, data in encoded:
+                    archive.writestr(stage, data, compress_type=zipfile.ZIP_STORED)
+                archive.writestr("info.json", info, compress_type=zipfile.ZIP_DEFLATED)
+        else:
+            folder = os.path.join(self.directory, record.name)
+            os.makedirs(folder, exist_ok=True)
+            for stage, data in encoded:
+                with open(os.path.join(folder, stage), "wb") as file:
+                    file.write(data)
+            with open(os.path.join(folder, "info.json"), "w", encoding="utf-8") as file:
+                file.write(info)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            record, info = item
+            try:
+                self._write(record, info)
+                name = "written"
+            except Exception as e:
+                print(f"Error writing debug images: {e}")
+                name = "errors"
+                metrics.increment("image_write_errors")
+            with self.lock:
+                self.queued_bytes -= record.nbytes
+                self.stats[name] += 1
+
+    def report(self):
+        with self.lock:
+            return {**self.stats, "queued_bytes": self.queued_bytes}
+
+    # zapisanie tablic pozostalych w kolejce i zakonczenie watku
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
@@ -0,0 +1,123 @@
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from server import RecognitionServer, make_http_server, add_server_arguments, server_kwargs
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+TEST_DATA = os.path.join(dir_path, "..", "test_data")
+
+def load_images(limit=0):
+    paths = sorted(path for path in glob.glob(os.path.join(TEST_DATA, "*", "*"))
+                   if path.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")))
+    if limit > 0:
+        paths = paths[:limit]
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images
+
+def send(url, image, deadline_ms=None):
+    query = f"?deadline_ms={deadline_ms}" if deadline_ms else ""
+    request = urllib.request.Request(f"{url}/recognize{query}", data=image, method="POST",
+                                     headers={"Content-Type": "application/octet-stream"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+# wyslanie requests zadan przez concurrency rownoleglych klientow
+def run_load(url, images, requests, concurrency, deadline_ms=None):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(lambda i: send(url, images[i % len(images)], deadline_ms), range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = 1000 * np.asarray([latency for status, latency in responses if status == 200])
+    statuses = {}
+    for status, _ in responses:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "throughput_per_s": round(requests / elapsed, 2),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "latency_p95_ms": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+    }
+
+def get_stats(url):
+    with urllib.request.urlopen(f"{url}/stats") as response:
+        return json.loads(response.read())
+
+# porownanie przepustowosci serwera uruchomionego w tym procesie bez laczenia zadan
+# (paczki o rozmiarze 1) i z laczeniem zadan w paczki, albo test zewnetrznego serwera
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Test obciążeniowy serwera rozpoznawania tablic")
+    parser.add_argument("--url", help="adres działającego serwera, bez niego serwer uruchamiany jest "
+                                      "w tym procesie dla każdego rozmiaru paczki z --batch-sizes")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=0, help="liczba obrazów z test_data (0 - wszystkie)")
+    parser.add_argument("--request-deadline-ms", type=float, help="termin przekazywany w każdym zadaniu")
+    parser.add_argument("-o", "--output", help="plik wynikowy JSON")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    images = load_images(args.limit)
+    results = []
+    if args.url:
+        run_load(args.url, images, min(args.concurrency, args.requests), args.concurrency)
+        result = run_load(args.url, images, args.requests, args.concurrency, args.request_deadline_ms)
+        result["server"] = get_stats(args.url)
+        results.append(result)
+    else:
+        from recognition import load_model
+        from detector import detector_kwargs, load_detector
+        from backends import backend_kwargs
+        yolo = load_detector(args.weights, **detector_kwargs(args))
+        model, preprocess = load_model(**backend_kwargs(args))
+        for batch_size in args.batch_sizes:
+            kwargs = server_kwargs(args)
+            kwargs["max_batch_size"] = batch_size
+            # bez laczenia zadan nie ma sensu czekac na zapelnienie paczki
+            if batch_size == 1:
+                kwargs["max_wait_ms"] = kwargs["char_max_wait_ms"] = 0.
+                kwargs["char_max_batch_size"] = 1
+            recognition_server = RecognitionServer(yolo, model, preprocess, **kwargs)
+            http_server = make_http_server(recognition_server, port=0)
+            threading.Thread(target=http_server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{http_server.server_address[1]}"
+            # rozgrzanie modeli
+            run_load(url, images, min(args.concurrency, args.requests), args.concurrency)
+            result = run_load(url, images, args.requests, args.concurrency, args.request_deadline_ms)
+            result["max_batch_size"] = batch_size
+            result["server"] = recognition_server.report()
+            results.append(result)
+            http_server.shutdown()
+            http_server.server_close()
+            recognition_server.close()
+
+    print(f"{'paczka':>7} {'zadania/s':>10} {'p50 [ms]':>9} {'p95 [ms]':>9} {'śr. paczka YOLO':>16} "
+          f"{'śr. paczka znaków':>18} {'statusy':>12}")
+    for result in results:
+        server = result["server"]
+        print(f"{result.get('max_batch_size', server['detection']['max_batch_size']):>7} "
+              f"{result['throughput_per_s']:>10.2f} {result['latency_p50_ms'] or 0:>9.1f} "
+              f"{result['latency_p95_ms'] or 0:>9.1f} {server['detection']['mean_batch_size']:>16.2f} "
+              f"{server['classification']['mean_batch_size']:>18.2f} {json.dumps(result['statuses']):>12}")
+    if len(results) > 1 and results[0]["throughput_per_s"] > 0:
+        print(f"przyspieszenie: {results[-1]['throughput_per_s'] / results[0]['throughput_per_s']:.2f}x")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,251 @@
+import bisect
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# pomiary sa wylaczone, dopoki nie zostanie wywolane enable() lub ustawiona zmienna
+# srodowiskowa PLATES_METRICS=1, wylaczony pomiar kosztuje jedno sprawdzenie flagi
+_enabled = os.environ.get("PLATES_METRICS", "0") not in ("", "0")
+
+# prefiks nazw metryk w formacie Prometheus
+PREFIX = "anpr"
+
+# gorne granice przedzialow histogramow czasu etapow w sekundach
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1., 2.5, 5., 10.)
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+def is_enabled():
+    return _enabled
+
+# histogram czasow jednego etapu, liczba pomiarow w kazdym przedziale (nieskumulowana)
+class Histogram:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # przyblizenie kwantyla gorna granica przedzialu, w ktorym sie znajduje
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        # pojedyncze pomiary etapow (None - niezbierane), do dokladnych kwantyli w benchmarku
+        self.samples = None
+        self.started = time.time()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+            if self.samples is not None:
+                self.samples.setdefault(stage, []).append(seconds)
+
+    def collect_samples(self, enabled=True):
+        with self.lock:
+            self.samples = {} if enabled else None
+
+    # zebrane pomiary {etap: [czasy w sekundach]}
+    def stage_samples(self):
+        with self.lock:
+            return {stage: list(values) for stage, values in (self.samples or {}).items()}
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            if self.samples is not None:
+                self.samples = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                stages[stage] = {
+                    "count": histogram.count,
+                    "sum_ms": round(1000 * histogram.sum, 3),
+                    "mean_ms": round(1000 * histogram.sum / histogram.count, 3) if histogram.count else 0.,
+                    "p50_ms": round(1000 * histogram.quantile(0.5), 3),
+                    "p95_ms": round(1000 * histogram.quantile(0.95), 3),
+                    "max_ms": round(1000 * histogram.max, 3),
+                    "buckets": {str(bound): count for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts)},
+                }
+            return {
+                "uptime_s": round(time.time() - self.started, 3),
+                "counters": dict(self.counters),
+                "stages": stages,
+            }
+
+    # metryki w formacie tekstowym Prometheus (text exposition format 0.0.4)
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            if self.histograms:
+                metric = f"{PREFIX}_stage_duration_seconds"
+                lines.append(f"# HELP {metric} Czas wykonania etapu przetwarzania")
+                lines.append(f"# TYPE {metric} histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+_null_timer = contextlib.nullcontext()
+
+# pomiar czasu bloku kodu: with timer("detection"): ...
+def timer(stage):
+    if not _enabled:
+        return _null_timer
+    return _Timer(stage)
+
+# dekorator mierzacy czas wykonania funkcji
+def timed(stage):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                registry.observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def increment(name, value=1):
+    if _enabled:
+        registry.increment(name, value)
+
+def snapshot():
+    return registry.snapshot()
+
+def collect_samples(enabled=True):
+    registry.collect_samples(enabled)
+
+def stage_samples():
+    return registry.stage_samples()
+
+def reset():
+    registry.reset()
+
+def prometheus_text():
+    return registry.prometheus_text()
+
+def save_snapshot(path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=2)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = prometheus_text().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(snapshot(), ensure_ascii=False).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# lokalny serwer HTTP udostepniajacy metryki pod /metrics (Prometheus) oraz
+# /metrics.json, dziala w watku w tle i wlacza zbieranie metryk
+def start_http_server(port=9100, host="127.0.0.1"):
+    enable()
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# narzut pomiaru czasu przy wylaczonych i wlaczonych metrykach
+if __name__ == '__main__':
+    iterations = 1_000_000
+
+    @timed("noop")
+    def noop():
+        pass
+
+    def measure(label):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with timer("noop"):
+                pass
+        context_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(iterations):
+            noop()
+        decorator_time = time.perf_counter() - start
+        print(f"{label}: with timer {1e9 * context_time / iterations:.0f} ns, "
+              f"@timed {1e9 * decorator_time / iterations:.0f} ns")
+
+    enable(False)
+    measure("wyłączone")
+    enable()
+    measure("włączone")
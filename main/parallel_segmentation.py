@@ -0,0 +1,185 @@
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+import metrics
+from segmentation import process_image, find_characters
+
+# przylaczone segmenty pamieci wspoldzielonej w procesie roboczym: rola -> (nazwa, segment)
+_attached = {}
+
+def init_worker(cv_threads=1):
+    # kazdy proces przetwarza jedna tablice naraz, wiec wewnetrzne watki OpenCV tylko
+    # konkurowalyby o rdzenie z pozostalymi procesami
+    os.environ["OMP_NUM_THREADS"] = str(cv_threads)
+    cv2.setNumThreads(cv_threads)
+    try:
+        import torch
+        torch.set_num_threads(cv_threads)
+    except ImportError:
+        pass
+
+def _attach(role, name):
+    attached = _attached.get(role)
+    if attached is not None and attached[0] == name:
+        return attached[1]
+    if attached is not None:
+        attached[1].close()
+    # procesy potomne puli spawn korzystaja z resource_tracker procesu glownego, wiec
+    # ponowna rejestracja segmentu nie powoduje jego usuniecia przy zamykaniu procesu
+    segment = shared_memory.SharedMemory(name=name)
+    _attached[role] = (name, segment)
+    return segment
+
+# segmentacja jednej tablicy w procesie roboczym: wycinek czytany jest z bufora
+# wejsciowego, obraz znakow zapisywany do bufora wyjsciowego, a zwracane sa tylko
+# bounding boxy znakow i indeks spacji (None, gdy segmentacja sie nie powiodla)
+def _segment_task(task):
+    input_name, input_offset, output_name, output_offset, h, w = task
+    try:
+        input_segment = _attach("input", input_name)
+        output_segment = _attach("output", output_name)
+        plate_image = np.ndarray((h, w, 3), dtype=np.uint8, buffer=input_segment.buf, offset=input_offset)
+        chars_image, char_boxes, max_gap_index = find_characters(process_image(img=plate_image))
+        np.ndarray((h, w), dtype=np.uint8, buffer=output_segment.buf, offset=output_offset)[...] = chars_image
+        return char_boxes, max_gap_index
+    except Exception as e:
+        print(f"Error processing license plate: {e}")
+        return None
+
+# segmentacja wielu tablic rownolegle w procesach roboczych (pula spawn). Wycinki
+# tablic kopiowane sa do wspoldzielonego bufora wejsciowego, a procesy zapisuja obrazy
+# znakow do bufora wyjsciowego, wiec przez potoki przesylane sa tylko przesuniecia w
+# buforach i bounding boxy znakow. Bufory powiekszane sa tylko w razie potrzeby.
+# Wynik ma format segment_plates i zachowuje kolejnosc tablic. Paczki mniejsze niz
+# min_parallel przetwarzane sa w procesie glownym, gdzie narzut komunikacji przewyzszalby zysk
+class SegmentationExecutor:
+    def __init__(self, workers=None, min_parallel=2, cv_threads=1):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel = min_parallel
+        self.pool = multiprocessing.get_context("spawn").Pool(
+            self.workers, initializer=init_worker, initargs=(cv_threads,))
+        self.buffers = {"input": None, "output": None}
+        # bufory wspoldzielone sa przez wszystkie wywolania, wiec paczki przetwarzane sa po kolei
+        self.lock = threading.Lock()
+
+    def _buffer(self, role, size):
+        segment = self.buffers[role]
+        if segment is None or segment.size < size:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            # zapas, aby bufor nie byl powiekszany przy kazdej wiekszej paczce
+            segment = self.buffers[role] = shared_memory.SharedMemory(create=True, size=max(size * 3 // 2, 1 << 16))
+        return segment
+
+    def segment(self, plate_images):
+        if len(plate_images) < self.min_parallel:
+            from recognition import segment_plates
+            return segment_plates(plate_images)
+        with self.lock, metrics.timer("parallel_segmentation"):
+            return self._segment(plate_images)
+
+    def _segment(self, plate_images):
+        shapes = [plate_image.shape[:2] if plate_image.ndim == 3 and plate_image.shape[2] == 3 and plate_image.size
+                  else None for plate_image in plate_images]
+        sizes = [shape[0] * shape[1] if shape is not None else 0 for shape in shapes]
+        output_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        input_buffer = self._buffer("input", 3 * int(output_offsets[-1]))
+        output_buffer = self._buffer("output", int(output_offsets[-1]))
+
+        tasks = []
+        task_indices = []
+        for plate_idx, (plate_image, shape) in enumerate(zip(plate_images, shapes)):
+            if shape is None:
+                continue
+            h, w = shape
+            offset = int(output_offsets[plate_idx])
+            np.ndarray((h, w, 3), dtype=np.uint8, buffer=input_buffer.buf, offset=3 * offset)[...] = plate_image
+            tasks.append((input_buffer.name, 3 * offset, output_buffer.name, offset, h, w))
+            task_indices.append(plate_idx)
+
+        segmented = [None] * len(plate_images)
+        for plate_idx, result in zip(task_indices, self.pool.map(_segment_task, tasks)):
+            if result is None:
+                continue
+            char_boxes, max_gap_index = result
+            h, w = shapes[plate_idx]
+            # kopia obrazu znakow, bo bufor zostanie nadpisany przez kolejna paczke
+            chars_image = np.ndarray((h, w), dtype=np.uint8, buffer=output_buffer.buf,
+                                     offset=int(output_offsets[plate_idx])).copy()
+            characters = [chars_image[y:y + ch, x:x + cw] for x, y, cw, ch in char_boxes]
+            metrics.increment("characters_segmented", len(characters))
+            segmented[plate_idx] = (characters, max_gap_index)
+        failed = len(plate_images) - sum(plate is not None for plate in segmented)
+        if failed:
+            metrics.increment("segmentation_errors", failed)
+        return segmented
+
+    def close(self):
+        if self.pool is None:
+            return
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+        for role, segment in self.buffers.items():
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            self.buffers[role] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# porownanie segmentacji w procesie glownym i na puli procesow dla syntetycznych
+# tablic, wraz ze sprawdzeniem zgodnosci wynikow
+if __name__ == '__main__':
+    import argparse
+    import time
+    from recognition import segment_plates
+
+    parser = argparse.ArgumentParser(description="Segmentacja wielu tablic w procesach roboczych")
+    parser.add_argument("--plates", type=int, default=32, help="liczba tablic w paczce")
+    parser.add_argument("--plate-size", type=int, nargs=2, default=[520, 114], help="szerokość i wysokość tablicy")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="liczby procesów roboczych (domyślnie 1..liczba rdzeni)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    width, height = args.plate_size
+    letters = "ABCDEFGHKLNOPRSTUWXYZ"
+    plates = []
+    for i in range(args.plates):
+        plate = np.full((height, width, 3), 235, dtype=np.uint8)
+        text = "".join(rng.choice(list(letters), 2)) + " " + "".join(rng.choice(list("0123456789"), 5))
+        cv2.putText(plate, text, (int(0.08 * width), int(0.78 * height)), cv2.FONT_HERSHEY_SIMPLEX,
+                    height / 40, (20, 20, 20), max(2, height // 12))
+        plate[:, :int(0.06 * width)] = (200, 60, 20)
+        plates.append(plate + rng.integers(0, 12, plate.shape, dtype=np.uint8))
+
+    def measure(function):
+        function(plates)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            result = function(plates)
+        return result, (time.perf_counter() - start) / args.repeat
+
+    cv2.setNumThreads(1)
+    reference, serial_time = measure(segment_plates)
+    print(f"rdzeni: {os.cpu_count()}, tablic w paczce: {args.plates}, rozmiar {width}x{height}")
+    print(f"{'procesy':>8} {'czas paczki [ms]':>17} {'tablic/s':>9} {'przyspieszenie':>15} {'zgodność':>9}")
+    print(f"{'serial':>8} {1000 * serial_time:>17.1f} {args.plates / serial_time:>9.1f} {1.:>15.2f} {'-':>9}")
+    for workers in args.workers or range(1, (os.cpu_count() or 1) + 1):
+        with SegmentationExecutor(workers, min_parallel=1) as executor:
+            result, parallel_time = measure(executor.segment)
+        same = all((a is None and b is None) or (a is not None and b is not None and a[1] == b[1]
+                   and len(a[0]) == len(b[0]) and all(np.array_equal(x, y) for x, y in zip(a[0], b[0])))
+                   for a, b in zip(reference, result))
+        print(f"{workers:>8} {1000 * parallel_time:>17.1f} {args.plates / parallel_time:>9.1f} "
+              f"{serial_time / parallel_time:>15.2f} {'tak' if same else 'NIE':>9}")
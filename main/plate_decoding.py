@@ -0,0 +1,198 @@
+from collections import namedtuple
+import torch
+from segmentation import valid_characters, CHARS
+
+# litery, ktore nie moga wystepowac w drugiej czesci tablicy rejestracyjnej (wyrozniku pojazdu)
+FORBIDDEN_CHARS = {'B', 'D', 'I', 'O', 'Z'}
+
+# pierwsze litery wyroznikow miejsca (wojewodztwa, sluzby)
+REGION_FIRST_LETTERS = "BCDEFGHKLNOPRSTUWZ"
+
+# wzorce polskich tablic rejestracyjnych, spacja oddziela wyroznik miejsca od
+# wyroznika pojazdu: R - pierwsza litera wyroznika miejsca, L - litera, D - cyfra,
+# V - litera dozwolona w wyrozniku pojazdu, A - cyfra lub litera dozwolona w wyrozniku pojazdu
+PLATE_PATTERNS = (
+    "RL DDDDD", "RL DDDDV", "RL DDDVV", "RL DVDDD", "RL DVVDD",
+    "RLL AAAA",
+    "RLL DDDDD", "RLL DDDDV", "RLL DDDVV", "RLL DVDDD", "RLL DVVDD",
+)
+
+# wynik dekodowania tablicy: tekst ze spacja, znaki (None dla nieprzetworzonych),
+# prawdopodobienstwa wybranych znakow i dopasowany wzorzec (None - zadnego wzorca nie
+# dalo sie dopasowac i zastosowano jedynie zakaz liter w wyrozniku pojazdu)
+DecodedPlate = namedtuple("DecodedPlate", ["text", "chars", "confidences", "pattern"])
+
+def _class_mask(allowed):
+    mask = torch.zeros(len(valid_characters), dtype=torch.bool)
+    mask[[CHARS[char] for char in allowed]] = True
+    return mask
+
+_DIGITS = "0123456789"
+_LETTERS = "".join(char for char in valid_characters if not char.isdigit())
+_POSITION_MASKS = {
+    "R": _class_mask(REGION_FIRST_LETTERS),
+    "L": _class_mask(_LETTERS),
+    "D": _class_mask(_DIGITS),
+    "V": _class_mask(char for char in _LETTERS if char not in FORBIDDEN_CHARS),
+    "A": _class_mask(char for char in valid_characters if char not in FORBIDDEN_CHARS),
+    "*": torch.ones(len(valid_characters), dtype=torch.bool),
+}
+
+# maska [liczba znakow, liczba klas] dla wzorca bez spacji
+def pattern_mask(pattern):
+    return torch.stack([_POSITION_MASKS[symbol] for symbol in pattern])
+
+# zlozenie tekstu tablicy, spacja przed znakiem o indeksie space_index
+def join_plate(chars, space_index):
+    text = ''
+    for idx, char in enumerate(chars):
+        if idx == space_index:
+            text += ' '
+        text += "[ERROR]" if char is None else char
+    return text
+
+# wyniki modelu dla znakow jednej tablicy (lista tensorow [1, liczba klas] lub None dla
+# znakow, ktorych nie udalo sie przetworzyc) jako macierz [liczba znakow, liczba klas]
+# oraz maska przetworzonych znakow
+def stack_outputs(outputs):
+    valid = torch.tensor([output is not None for output in outputs], dtype=torch.bool)
+    logits = torch.zeros(len(outputs), len(valid_characters))
+    if valid.any():
+        logits[valid] = torch.cat([output for output in outputs if output is not None]).float()
+    return logits, valid
+
+# dekodowanie tablic z ograniczeniem do dopuszczalnych formatow: dla kazdej tablicy
+# wybierany jest wzorzec o najwiekszym lacznym log-prawdopodobienstwie znakow, a znaki
+# to najbardziej prawdopodobne klasy dozwolone na danej pozycji wzorca. Tablice o tej
+# samej liczbie znakow i polozeniu spacji dekodowane sa razem na tensorze
+# [tablice, wzorce, znaki, klasy]. Opcjonalny zbior region_codes ogranicza wyroznik
+# miejsca do znanych kodow
+class PlateDecoder:
+    def __init__(self, patterns=PLATE_PATTERNS, region_codes=None):
+        # (dlugosc, indeks spacji) -> (wzorce, maski [wzorce, znaki, klasy])
+        self.formats = {}
+        for pattern in patterns:
+            region, vehicle = pattern.split(" ")
+            key = (len(region) + len(vehicle), len(region))
+            names, masks = self.formats.setdefault(key, ([], []))
+            names.append(pattern)
+            masks.append(pattern_mask(region + vehicle))
+        self.formats = {key: (names, torch.stack(masks)) for key, (names, masks) in self.formats.items()}
+        # dlugosc wyroznika miejsca -> indeksy klas znanych kodow [liczba kodow, dlugosc]
+        self.region_codes = None
+        if region_codes is not None:
+            by_length = {}
+            for code in region_codes:
+                by_length.setdefault(len(code), []).append([CHARS[char] for char in code.upper()])
+            self.region_codes = {length: torch.tensor(codes) for length, codes in by_length.items()}
+
+    # formaty dla tablic bez pasujacego wzorca: dowolne znaki przed spacja, a za nia
+    # bez liter zakazanych w wyrozniku pojazdu
+    @staticmethod
+    def _fallback(length, space_index):
+        if space_index < 0:
+            pattern = "*" * length
+        else:
+            space_index = min(space_index, length)
+            pattern = "*" * space_index + "A" * (length - space_index)
+        return [None], pattern_mask(pattern)[None]
+
+    # plates: lista krotek (logity [liczba znakow, liczba klas], indeks spacji[, maska
+    # przetworzonych znakow]), zwraca liste DecodedPlate w tej samej kolejnosci
+    def decode(self, plates):
+        decoded = [None] * len(plates)
+        groups = {}
+        for plate_idx, plate in enumerate(plates):
+            logits, space_index = plate[:2]
+            groups.setdefault((len(logits), space_index), []).append(plate_idx)
+        for (length, space_index), plate_indices in groups.items():
+            if length == 0:
+                for plate_idx in plate_indices:
+                    decoded[plate_idx] = DecodedPlate("", [], [], None)
+                continue
+            logits = torch.stack([plates[plate_idx][0] for plate_idx in plate_indices]).float()
+            valid = torch.stack([plates[plate_idx][2] if len(plates[plate_idx]) > 2
+                                 else torch.ones(length, dtype=torch.bool) for plate_idx in plate_indices])
+            names, masks = self.formats.get((length, space_index)) or self._fallback(length, space_index)
+            chars, confidences, best = self._decode_group(logits, names, masks, space_index)
+            chars[~valid] = -1
+            for row, plate_idx in enumerate(plate_indices):
+                plate_chars = [valid_characters[index] if index >= 0 else None for index in chars[row].tolist()]
+                plate_confidences = [round(value, 4) if ok else 0. for value, ok
+                                     in zip(confidences[row].tolist(), valid[row].tolist())]
+                decoded[plate_idx] = DecodedPlate(join_plate(plate_chars, space_index), plate_chars,
+                                                  plate_confidences, names[best[row]])
+        return decoded
+
+    def _decode_group(self, logits, names, masks, space_index):
+        log_probs = torch.log_softmax(logits, dim=-1)
+        # [tablice, wzorce, znaki, klasy]
+        masked = log_probs[:, None].masked_fill(~masks[None], float("-inf"))
+        values, chars = masked.max(dim=-1)
+        scores = values.sum(dim=-1)
+        if self.region_codes is not None and names[0] is not None:
+            codes = self.region_codes.get(space_index)
+            if codes is not None:
+                # log-prawdopodobienstwo kazdego znanego kodu [tablice, kody]
+                positions = torch.arange(space_index)
+                code_scores = log_probs[:, positions[None, :], codes].sum(dim=-1)
+                best_codes = code_scores.argmax(dim=1)
+                region_scores = code_scores.gather(1, best_codes[:, None])
+                scores = scores - values[:, :, :space_index].sum(dim=-1) + region_scores
+                chars[:, :, :space_index] = codes[best_codes][:, None, :]
+        best = scores.argmax(dim=1)
+        rows = torch.arange(len(logits))
+        chars = chars[rows, best]
+        confidences = torch.softmax(logits, dim=-1).gather(2, chars[:, :, None]).squeeze(2)
+        return chars, confidences, best.tolist()
+
+_default_decoder = None
+
+def get_decoder():
+    global _default_decoder
+    if _default_decoder is None:
+        _default_decoder = PlateDecoder()
+    return _default_decoder
+
+# porownanie z poprzednia korekta zakazanych liter znak po znaku na losowych logitach
+if __name__ == '__main__':
+    import time
+
+    # poprzednia korekta: zamiana zakazanych liter w drugiej czesci tablicy na
+    # najbardziej prawdopodobny dozwolony znak
+    def correct_forbidden_characters(chars, outputs, space_index):
+        if space_index < 0:
+            return chars
+        corrected = list(chars)
+        for idx in range(space_index, len(chars)):
+            if corrected[idx] in FORBIDDEN_CHARS:
+                scores = outputs[idx][0].clone()
+                for char in FORBIDDEN_CHARS:
+                    scores[CHARS[char]] = float('-inf')
+                corrected[idx] = valid_characters[int(torch.argmax(scores))]
+        return corrected
+
+    generator = torch.Generator().manual_seed(0)
+    for n_plates in (1, 10, 100, 1000):
+        plates = []
+        for _ in range(n_plates):
+            length = int(torch.randint(7, 9, (1,), generator=generator))
+            space_index = 2 if length == 7 else int(torch.randint(2, 4, (1,), generator=generator))
+            plates.append((torch.randn(length, len(valid_characters), generator=generator) * 3, space_index))
+
+        start = time.perf_counter()
+        for logits, space_index in plates:
+            chars = [valid_characters[index] for index in logits.argmax(1).tolist()]
+            join_plate(correct_forbidden_characters(chars, list(logits[:, None]), space_index), space_index)
+        loop_time = time.perf_counter() - start
+
+        decoder = PlateDecoder()
+        start = time.perf_counter()
+        decoded = decoder.decode(plates)
+        decode_time = time.perf_counter() - start
+        matched = sum(plate.pattern is not None for plate in decoded)
+        # wyroznik pojazdu nie moze zawierac zakazanych liter niezaleznie od wzorca
+        forbidden = sum(any(char in FORBIDDEN_CHARS for char in plate.text.split(" ")[-1]) for plate in decoded)
+        assert forbidden == 0, f"zakazane litery w wyrozniku pojazdu: {forbidden} tablic"
+        print(f"{n_plates:>5} tablic: korekta znak po znaku {1000 * loop_time:8.2f} ms, "
+              f"dekodowanie wzorcami {1000 * decode_time:8.2f} ms, dopasowane wzorce {matched}/{n_plates}")
@@ -0,0 +1,206 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+import metrics
+
+# tanie miary jakosci wycinka tablicy: pole, ostrosc (wariancja laplasjanu po
+# przeskalowaniu do stalej wysokosci, wiec nie zalezy od rozmiaru wycinka) i pewnosc
+# detektora. Priorytet to iloczyn miar znormalizowanych do [0, 1]: tablica o szerokosci
+# ok. 200 pikseli i ostrosci nierozmytej tablicy ma miary rowne 1
+REFERENCE_AREA = 200 * 44
+REFERENCE_SHARPNESS = 5000.
+SHARPNESS_HEIGHT = 32
+
+def plate_sharpness(plate_image):
+    if plate_image.size == 0:
+        return 0.
+    gray = cv2.cvtColor(plate_image, cv2.COLOR_BGR2GRAY) if plate_image.ndim == 3 else plate_image
+    height, width = gray.shape[:2]
+    width = max(1, round(width * SHARPNESS_HEIGHT / height))
+    gray = cv2.resize(gray, (width, SHARPNESS_HEIGHT), interpolation=cv2.INTER_AREA)
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+    return float(std[0, 0]) ** 2
+
+def plate_priority(plate_image, score=1.):
+    area = plate_image.shape[0] * plate_image.shape[1] if plate_image.ndim >= 2 else 0
+    area_term = min(1., area / REFERENCE_AREA)
+    sharpness_term = min(1., plate_sharpness(plate_image) / REFERENCE_SHARPNESS)
+    return area_term * sharpness_term * float(score)
+
+# plan rozpoznawania tablic jednej klatki: indeksy tablic do rozpoznania (od
+# najwazniejszej), odlozone (nie zmiescily sie w budzecie, tablice sledzone beda
+# rozpoznane w kolejnych klatkach) i odrzucone (niska wartosc przy obciazeniu lub brak
+# sledzenia, ktore pozwoliloby je odlozyc) wraz z priorytetami wszystkich tablic
+class Plan:
+    __slots__ = ("selected", "deferred", "dropped", "priorities")
+
+    def __init__(self, selected, deferred, dropped, priorities):
+        self.selected = selected
+        self.deferred = deferred
+        self.dropped = dropped
+        self.priorities = priorities
+
+    # pominiete tablice w postaci slownikow do wynikow (indeks, powod, priorytet)
+    def skipped(self):
+        return ([{"index": i, "reason": "deferred", "priority": round(self.priorities[i], 4)} for i in self.deferred]
+                + [{"index": i, "reason": "dropped", "priority": round(self.priorities[i], 4)} for i in self.dropped])
+
+# szeregowanie rozpoznawania tablic w ramach budzetu opoznienia klatki. Koszt
+# rozpoznania tablicy szacowany jest srednia wykladnicza zmierzonych czasow
+# (segmentacja i klasyfikacja), a tablice wybierane sa od najwyzszego priorytetu,
+# dopoki szacowany czas miesci sie w pozostalej czesci budzetu klatki (budzet liczony
+# od zdekodowania klatki, wiec zaleglosci w kolejkach zmniejszaja go automatycznie).
+# Gdy obciazenie (zapelnienie kolejek, 0..1) przekracza shed_load, tablice o
+# priorytecie ponizej min_priority sa odrzucane. Co najmniej min_plates tablic jest
+# zawsze rozpoznawanych. Tablice sledzone odkladane wielokrotnie dostaja wyzszy
+# priorytet (aging_boost), aby nie byly pomijane bez konca
+class QualityScheduler:
+    def __init__(self, budget_ms=None, min_priority=0.05, shed_load=0.5, min_plates=1,
+                 aging_boost=0.5, smoothing=0.2, initial_cost_ms=200., max_tracked=10000):
+        self.budget = budget_ms / 1000 if budget_ms else None
+        self.min_priority = min_priority
+        self.shed_load = shed_load
+        self.min_plates = min_plates
+        self.aging_boost = aging_boost
+        self.smoothing = smoothing
+        self.max_tracked = max_tracked
+        # szacowany koszt tablicy w sekundach dla kolejnych etapow, przed pierwszym
+        # pomiarem ostrozne initial_cost_ms (klasyfikacja kilku znakow na CPU)
+        self.costs = {}
+        self.initial_cost = initial_cost_ms / 1000
+        # liczba odlozen sledzonych tablic (klucz - identyfikator sledzenia)
+        self.deferrals = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"plates": 0, "selected": 0, "deferred": 0, "dropped": 0, "low_value": 0,
+                      "over_budget_frames": 0}
+
+    # pomiar czasu etapu dla count tablic
+    def observe(self, stage, elapsed, count):
+        if count <= 0:
+            return
+        with self.lock:
+            cost = elapsed / count
+            previous = self.costs.get(stage)
+            self.costs[stage] = cost if previous is None else previous + self.smoothing * (cost - previous)
+
+    def plate_cost(self):
+        with self.lock:
+            return sum(self.costs.values()) if self.costs else self.initial_cost
+
+    # plates - wycinki tablic, scores - pewnosci detektora, elapsed - czas od
+    # zdekodowania klatki w sekundach, load - obciazenie potoku (0..1), keys -
+    # identyfikatory sledzenia (None, gdy tablic nie mozna odlozyc)
+    def plan(self, plates, scores=None, elapsed=0., load=0., keys=None):
+        scores = scores if scores is not None else [1.] * len(plates)
+        priorities = [plate_priority(plate, score) for plate, score in zip(plates, scores)]
+        with self.lock:
+            if keys is not None:
+                ranking = [priority * (1 + self.aging_boost * self.deferrals.get(key, 0))
+                           for priority, key in zip(priorities, keys)]
+            else:
+                ranking = priorities
+        order = sorted(range(len(plates)), key=lambda i: ranking[i], reverse=True)
+
+        low_value = []
+        if load >= self.shed_load:
+            # najlepsze min_plates tablic zostaja niezaleznie od priorytetu
+            low_value = [i for i in order[self.min_plates:] if priorities[i] < self.min_priority]
+            order = [i for i in order if i not in low_value]
+        over_budget = []
+        if self.budget is not None:
+            affordable = int(max(0., self.budget - elapsed) / max(self.plate_cost(), 1e-6))
+            affordable = max(affordable, self.min_plates)
+            order, over_budget = order[:affordable], order[affordable:]
+        deferred = over_budget if keys is not None else []
+        dropped = low_value + (over_budget if keys is None else [])
+
+        with self.lock:
+            if keys is not None:
+                for i in order:
+                    self.deferrals.pop(keys[i], None)
+                for i in deferred:
+                    self.deferrals[keys[i]] = self.deferrals.get(keys[i], 0) + 1
+                    self.deferrals.move_to_end(keys[i])
+                while len(self.deferrals) > self.max_tracked:
+                    self.deferrals.popitem(last=False)
+            self.stats["plates"] += len(plates)
+            self.stats["selected"] += len(order)
+            self.stats["deferred"] += len(deferred)
+            self.stats["dropped"] += len(dropped)
+            self.stats["low_value"] += len(low_value)
+            self.stats["over_budget_frames"] += bool(over_budget)
+        metrics.increment("plates_deferred", len(deferred))
+        metrics.increment("plates_dropped", len(dropped))
+        return Plan(order, deferred, dropped, priorities)
+
+    def report(self):
+        with self.lock:
+            report = dict(self.stats)
+            report["plate_cost_ms"] = round(1000 * (sum(self.costs.values()) if self.costs else self.initial_cost), 3)
+        return report
+
+# symulacja strumienia klatek z syntetycznymi tablicami o roznym rozmiarze, rozmyciu
+# i pewnosci detektora: dla kolejnych budzetow klatki mierzony jest czas rozpoznawania
+# na klatke oraz odsetek rozpoznanych tablic dobrej jakosci (duze, ostre) i pozostalych
+if __name__ == '__main__':
+    import argparse
+    import time
+    from recognition import load_model, segment_plates, classify_segmented_plates, decode_plates
+
+    parser = argparse.ArgumentParser(description="Szeregowanie rozpoznawania tablic w budżecie klatki")
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--plates", type=int, default=6, help="liczba tablic na klatce")
+    parser.add_argument("--budgets", type=float, nargs="+", default=[0, 3000, 1500],
+                        help="budżety klatki w ms (0 - bez budżetu)")
+    parser.add_argument("--load", type=float, default=0., help="symulowane obciążenie potoku (0..1)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    letters = "ABCDEFGHKLNOPRSTUWXYZ"
+
+    def synthetic_plate():
+        scale = rng.uniform(0.2, 1.)
+        blur = int(rng.choice([0, 0, 3, 7, 11]))
+        width, height = max(20, int(520 * scale)), max(6, int(114 * scale))
+        plate = np.full((114, 520, 3), 235, dtype=np.uint8)
+        text = "".join(rng.choice(list(letters), 2)) + " " + "".join(rng.choice(list("0123456789"), 5))
+        cv2.putText(plate, text, (40, 89), cv2.FONT_HERSHEY_SIMPLEX, 2.85, (20, 20, 20), 9)
+        plate[:, :31] = (200, 60, 20)
+        if blur:
+            plate = cv2.GaussianBlur(plate, (blur, blur), 0)
+        plate = cv2.resize(plate, (width, height), interpolation=cv2.INTER_AREA)
+        good = scale >= 0.5 and blur <= 3
+        return plate, float(rng.uniform(0.3, 0.95)), good
+
+    frames = [[synthetic_plate() for _ in range(args.plates)] for _ in range(args.frames)]
+    model, preprocess = load_model()
+    print(f"klatek: {args.frames}, tablic na klatce: {args.plates}, obciążenie: {args.load}")
+    print(f"{'budżet [ms]':>11} {'ms/klatka':>10} {'p95 [ms]':>9} {'rozpoznane':>11} {'dobre':>7} "
+          f"{'pozostałe':>10} {'odrzucone':>10}")
+    for budget in args.budgets:
+        scheduler = QualityScheduler(budget or None)
+        frame_times = []
+        read_good = read_other = total_good = total_other = 0
+        for frame in frames:
+            plates = [plate for plate, _, _ in frame]
+            start = time.perf_counter()
+            plan = scheduler.plan(plates, [score for _, score, _ in frame], load=args.load)
+            selected = [plates[i] for i in plan.selected]
+            segment_start = time.perf_counter()
+            segmented = segment_plates(selected)
+            scheduler.observe("segmentation", time.perf_counter() - segment_start, len(selected))
+            recognize_start = time.perf_counter()
+            decode_plates(classify_segmented_plates(segmented, model, preprocess))
+            scheduler.observe("recognition", time.perf_counter() - recognize_start, len(selected))
+            frame_times.append(time.perf_counter() - start)
+            selected = set(plan.selected)
+            for i, (_, _, good) in enumerate(frame):
+                total_good += good
+                total_other += not good
+                read_good += good and i in selected
+                read_other += not good and i in selected
+        report = scheduler.report()
+        print(f"{budget or '-':>11} {1000 * np.mean(frame_times):>10.1f} {1000 * np.percentile(frame_times, 95):>9.1f} "
+              f"{report['selected']:>11} {read_good / max(total_good, 1):>7.0%} "
+              f"{read_other / max(total_other, 1):>10.0%} {report['dropped']:>10}")
@@ -1,108 +1,303 @@
 import torch
+import torchvision
 import os
-from segmentation import process_image, get_characters_images, reshape_character, CHARS
+import cv2
+from segmentation import process_image, get_characters_images, reshape_character, CHARS, valid_characters
 from torchvision.models import efficientnet_b1, EfficientNet_B1_Weights
+from backends import create_backend
+from char_preprocessing import character_preprocessor
+from plate_decoding import get_decoder, join_plate, stack_outputs
+import metrics
 
-# Funkcja do ładowania modelu
-def load_model():
-    # Inicjalizacja ścieżek
+def get_model_path():
     dir_path = os.path.dirname(os.path.realpath(__file__))
-    model_path = os.path.join(dir_path, "..", "models", "char_recognition", "weights", "best_weights_only.pt")
+    return os.path.join(dir_path, "..", "models", "char_recognition", "weights", "best_weights_only.pt")
+
+# Ścieżka gotowego do uruchomienia modelu zapisywanego obok wag
+def get_serialized_model_path(model_path):
+    return os.path.splitext(model_path)[0] + ".model.pt"
+
+# Sygnatura pliku wag i wersji bibliotek, pozwala wykryć nieaktualny zapisany model
+def weights_signature(model_path):
+    stat = os.stat(model_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{torch.__version__}:{torchvision.__version__}"
+
+def build_model(model_path):
+    model = efficientnet_b1()
+    features_in = model.classifier[1].in_features
+    model.classifier = torch.nn.Linear(features_in, len(CHARS))
+    model.load_state_dict(torch.load(model_path, weights_only=True)['model_state_dict'])
+    model.eval()
+    return model
+
+# Wczytanie zapisanego w całości modelu (bez budowania architektury i inicjalizacji
+# wag), None jeśli go nie ma lub jest nieaktualny. Plik tworzony jest lokalnie przez
+# save_serialized_model, dlatego może być wczytany z weights_only=False
+def load_serialized_model(model_path):
+    serialized_path = get_serialized_model_path(model_path)
+    if not os.path.exists(serialized_path):
+        return None
+    try:
+        checkpoint = torch.load(serialized_path, weights_only=False)
+    except Exception as e:
+        print(f"Error loading the serialized model: {e}")
+        return None
+    if checkpoint.get("signature") != weights_signature(model_path):
+        return None
+    model = checkpoint["model"]
+    model.eval()
+    return model
+
+# Zapisanie całego modelu, kolejne uruchomienia nie muszą budować modelu
+def save_serialized_model(model, model_path):
+    serialized_path = get_serialized_model_path(model_path)
+    tmp_path = serialized_path + ".tmp"
+    torch.save({"signature": weights_signature(model_path), "model": model}, tmp_path)
+    os.replace(tmp_path, serialized_path)
+
+# Funkcja do ładowania modelu, przy serialized=True używany jest zapisany obok
+# wag gotowy model (tworzony przy pierwszym uruchomieniu). backend określa sposób
+# uruchamiania modelu (backends.BACKENDS), statyczna kwantyzacja INT8 wymaga
+# obrazów znaków do kalibracji (calibration_chars)
+def load_model(serialized=False, backend="eager", calibration_chars=None):
+    # Inicjalizacja ścieżek
+    model_path = get_model_path()
     try:
-        model = efficientnet_b1()
-        features_in = model.classifier[1].in_features
-        model.classifier = torch.nn.Linear(features_in, len(CHARS))
-        model.load_state_dict(torch.load(model_path, weights_only=True)['model_state_dict'])
-        model.eval()
+        model = load_serialized_model(model_path) if serialized else None
+        if model is None:
+            model = build_model(model_path)
+            if serialized:
+                try:
+                    save_serialized_model(model, model_path)
+                except Exception as e:
+                    print(f"Error saving the serialized model: {e}")
         preprocess = EfficientNet_B1_Weights.DEFAULT.transforms()
+        if backend != "eager":
+            calibration = None
+            if calibration_chars:
+                calibration = torch.stack([prepare_character(preprocess, char) for char in calibration_chars])
+            model = create_backend(backend, model, model_path, weights_signature(model_path), calibration)
         return model, preprocess
     except Exception as e:
         raise RuntimeError(f"Error loading the model: {e}")
 
+# Maksymalna liczba znaków przetwarzanych przez model w jednym przebiegu
+MAX_BATCH_SIZE = 64
+
+# Przygotowanie obrazu pojedynczego znaku do predykcji, zwraca tensor [3, H, W]
+def prepare_character(preprocess, char_img):
+    char_img_resized = reshape_character(char_img)
+    char_img_tensor = torch.tensor(char_img_resized).float()
+    char_img_tensor = char_img_tensor.repeat(3, 1, 1).unsqueeze(0)
+    return preprocess(char_img_tensor)[0]
+
+# Klasyfikacja listy tensorów znaków w paczkach o ograniczonym rozmiarze,
+# zwraca tensor wyników modelu o wymiarach [liczba znaków, liczba klas]
+def classify_characters(model, char_tensors, max_batch_size=MAX_BATCH_SIZE):
+    if not char_tensors:
+        return torch.empty((0, len(CHARS)))
+    logits = []
+    with torch.no_grad(), metrics.timer("classification"):
+        for start in range(0, len(char_tensors), max_batch_size):
+            batch = torch.stack(char_tensors[start:start + max_batch_size])
+            logits.append(model(batch))
+    return torch.cat(logits)
+
+# Klasyfikacja znaków wielu tablic z obrazami wpisywanymi bezpośrednio do
+# przydzielonego wcześniej tensora paczki (char_preprocessing), zwraca pozycje
+# (indeks tablicy, indeks znaku) przygotowanych znaków i tensor wyników modelu
+def classify_characters_fused(model, fused, plates_char_images, max_batch_size=MAX_BATCH_SIZE):
+    all_positions = [(plate_idx, char_idx) for plate_idx, char_images in enumerate(plates_char_images)
+                     for char_idx in range(len(char_images))]
+    char_images = (char_img for plate_char_images in plates_char_images for char_img in plate_char_images)
+    positions = []
+    logits = []
+    with torch.no_grad():
+        for batch, indices in fused.batches(char_images, max_batch_size):
+            positions.extend(all_positions[index] for index in indices)
+            # bufor paczki zostanie nadpisany, więc model musi go przetworzyć przed kolejną paczką
+            with metrics.timer("classification"):
+                logits.append(model(batch))
+    if not logits:
+        return positions, torch.empty((0, len(CHARS)))
+    return positions, torch.cat(logits)
+
+# Rozpoznanie znaków wielu tablic jednocześnie. Dla każdej tablicy zwraca listę
+# rozpoznanych znaków (None dla znaków, których nie udało się przetworzyć) oraz
+# listę wyników modelu o wymiarach [1, liczba klas] (None dla tych samych znaków)
+def classify_plates_characters(model, preprocess, plates_char_images, max_batch_size=MAX_BATCH_SIZE):
+    results = [([None] * len(char_images), [None] * len(char_images))
+               for char_images in plates_char_images]
+    # preprocesor wypożyczony z puli tylko na czas klasyfikacji (bufor paczki jest współdzielony)
+    with character_preprocessor(preprocess, max_batch_size) as fused:
+        if fused is not None:
+            positions, logits = classify_characters_fused(model, fused, plates_char_images, max_batch_size)
+    if fused is None:
+        char_tensors = []
+        # (indeks tablicy, indeks znaku) dla każdego przygotowanego tensora
+        positions = []
+        for plate_idx, char_images in enumerate(plates_char_images):
+            for char_idx, char_img in enumerate(char_images):
+                try:
+                    char_tensors.append(prepare_character(preprocess, char_img))
+                    positions.append((plate_idx, char_idx))
+                except Exception as e:
+                    print(f"Error processing character: {e}")
+                    metrics.increment("character_errors")
+        logits = classify_characters(model, char_tensors, max_batch_size)
+
+    predicted = torch.argmax(logits, 1).tolist()
+    for (plate_idx, char_idx), row, prediction in zip(positions, logits, predicted):
+        chars, outputs = results[plate_idx]
+        chars[char_idx] = valid_characters[prediction]
+        outputs[char_idx] = row.unsqueeze(0)
+    return results
+
+# Złożenie tekstu tablicy z rozpoznanych znaków
+def join_characters(chars, space_index):
+    return join_plate(chars, space_index)
+
 # Funkcja do rozpoznawania znaków
 def recognize_characters(model, preprocess, char_images, space_index):
-    recognized_text = ''
-    outputs = []  # Przechowuj wyniki modelu dla każdego znaku
-    for idx, char_img in enumerate(char_images):
-        # Dodanie spacji na odpowiednim indeksie
-        if idx == space_index:
-            recognized_text += ' '
+    chars, outputs = classify_plates_characters(model, preprocess, [char_images])[0]
+    return join_characters(chars, space_index), [output for output in outputs if output is not None]
+
+# Segmentacja znaków wielu tablic rejestracyjnych, dla każdej tablicy zwraca
+# krotkę (lista obrazów znaków, indeks spacji) lub None, gdy segmentacja się nie powiodła.
+# Opcjonalny executor (SegmentationExecutor) rozdziela tablice między procesy robocze,
+# debug to lista celów zapisu obrazów diagnostycznych kolejnych tablic (folder, rekord
+# DebugSink lub None); w tym procesie przetwarzane są tylko tablice z obrazami
+# diagnostycznymi, pozostałe trafiają do executora
+def segment_plates(plate_images, executor=None, debug=None):
+    if debug is None:
+        debug = [None] * len(plate_images)
+    if executor is not None:
+        parallel = [plate_idx for plate_idx, target in enumerate(debug) if target is None]
+        if len(parallel) == len(plate_images):
+            return executor.segment(plate_images)
+        segmented = [None] * len(plate_images)
+        if parallel:
+            results = executor.segment([plate_images[plate_idx] for plate_idx in parallel])
+            for plate_idx, result in zip(parallel, results):
+                segmented[plate_idx] = result
+        sampled = [plate_idx for plate_idx, target in enumerate(debug) if target is not None]
+        results = segment_plates([plate_images[plate_idx] for plate_idx in sampled], None,
+                                 [debug[plate_idx] for plate_idx in sampled])
+        for plate_idx, result in zip(sampled, results):
+            segmented[plate_idx] = result
+        return segmented
+    segmented = []
+    for plate_image, debug_folder in zip(plate_images, debug):
         try:
-            # Przygotowanie obrazu do predykcji
-            char_img_resized = reshape_character(char_img)
-            char_img_tensor = torch.tensor(char_img_resized).float()
-            char_img_tensor = char_img_tensor.repeat(3, 1, 1).unsqueeze(0)
-            char_img_tensor = preprocess(char_img_tensor)
-
-            # Przewidywanie
-            with torch.no_grad():
-                output = model(char_img_tensor)
-                _, predicted = torch.max(output, 1)
-                predicted_char = list(CHARS.keys())[predicted.item()]
-                recognized_text += predicted_char
-                outputs.append(output)  # Zachowaj surowy wynik modelu dla tego znaku
+            processed_image = process_image(img=plate_image, debug_folder=debug_folder)
+            segmented.append(get_characters_images(processed_image, debug_folder))
         except Exception as e:
-            recognized_text += "[ERROR]"
-            print(f"Error processing character: {e}")
-    return recognized_text, outputs
+            print(f"Error processing license plate: {e}")
+            metrics.increment("segmentation_errors")
+            segmented.append(None)
+    return segmented
 
-# Funkcja przetwarzania tablicy rejestracyjnej
-def process_license_plate(image_path=None, image=None, model=None, preprocess=None):
+# Klasyfikacja znaków posegmentowanych tablic w paczkach o rozmiarze co najwyżej
+# max_batch_size i rozdzielenie wyników z powrotem na poszczególne tablice. Dla
+# każdej tablicy zwraca krotkę (rozpoznane znaki, wyniki modelu, indeks spacji)
+# lub None, gdy tablicy nie udało się przetworzyć
+def classify_segmented_plates(segmented, model, preprocess, max_batch_size=MAX_BATCH_SIZE):
+    classified = [None] * len(segmented)
+    # indeksy tablic, które udało się posegmentować
+    plate_indices = [plate_idx for plate_idx, plate in enumerate(segmented) if plate is not None]
+    plates_char_images = [segmented[plate_idx][0] for plate_idx in plate_indices]
     try:
-        # Jeśli wycięty obraz nie został przekazany, przetwarzamy obraz z pliku
-        if image is None:
-            if image_path is None:
-                raise ValueError("Either 'image_path' or 'processed_image' must be provided.")
-            else:
-                processed_image = process_image(image_path=image_path)
-        else:
-            processed_image = process_image(img=image)
-
-        # Segmentacja znaków
-        char_images, space_index = get_characters_images(processed_image)
-
-        # Rozpoznawanie znaków
-        recognized_text, outputs = recognize_characters(model, preprocess, char_images, space_index)
-
-        # Definicja zakazanych liter (nie moga one wystepowac w drugiej czesci tablicy rejestracyjnej
-        forbidden_chars = {'B', 'D', 'I', 'O', 'Z'}
-
-        # Obsługa zakazanych znaków w drugiej części
-        parts = recognized_text.split(' ')
-        if len(parts) > 1:
-            first_part, second_part = parts[0], parts[1]
-            corrected_second_part = ''
-            for idx, char in enumerate(second_part):
-                if char in forbidden_chars:
-                    # Znalezienie alternatywnych znaków dla zakazanych liter
-                    alternative_predictions = []
-                    output = outputs[space_index + 1 + idx]  # Wynik modelu dla tego znaku
-                    for char_idx, score in enumerate(output[0]):
-                        predicted_char = list(CHARS.keys())[char_idx]
-                        if predicted_char not in forbidden_chars:
-                            alternative_predictions.append((predicted_char, score.item()))
-
-                    # Posortowanie alternatyw i wybór najlepszego znaku
-                    alternative_predictions.sort(key=lambda x: x[1], reverse=True)
-                    if alternative_predictions:
-                        corrected_second_part += alternative_predictions[0][0]
-                else:
-                    corrected_second_part += char
-            recognized_text = f"{first_part} {corrected_second_part}"
-
-        return recognized_text
+        results = classify_plates_characters(model, preprocess, plates_char_images, max_batch_size)
     except Exception as e:
         print(f"Error processing license plate: {e}")
-        return "[PROCESSING ERROR]"
+        metrics.increment("classification_errors")
+        return classified
+
+    for plate_idx, (chars, outputs) in zip(plate_indices, results):
+        classified[plate_idx] = (chars, outputs, segmented[plate_idx][1])
+    return classified
+
+# Dekodowanie wielu sklasyfikowanych tablic jednocześnie z ograniczeniem do formatów
+# polskich tablic (PlateDecoder), dla każdej tablicy zwraca DecodedPlate (tekst,
+# znaki, prawdopodobieństwa znaków, wzorzec) lub None, gdy tablicy nie udało się przetworzyć
+def decode_plates(classified, decoder=None):
+    decoder = decoder or get_decoder()
+    plate_indices = [plate_idx for plate_idx, plate in enumerate(classified) if plate is not None]
+    plates = []
+    for plate_idx in plate_indices:
+        _, outputs, space_index = classified[plate_idx]
+        logits, valid = stack_outputs(outputs)
+        plates.append((logits, space_index, valid))
+    decoded = [None] * len(classified)
+    for plate_idx, decoded_plate in zip(plate_indices, decoder.decode(plates)):
+        decoded[plate_idx] = decoded_plate
+    return decoded
+
+# Teksty wielu sklasyfikowanych tablic
+def plate_texts(classified, decoder=None):
+    return ["[PROCESSING ERROR]" if decoded is None else decoded.text
+            for decoded in decode_plates(classified, decoder)]
+
+# Złożenie tekstu tablicy z wyników klasyfikacji jej znaków
+def plate_text(classified_plate):
+    return plate_texts([classified_plate])[0]
+
+# Rozpoznawanie posegmentowanych tablic
+def recognize_segmented_plates(segmented, model, preprocess, max_batch_size=MAX_BATCH_SIZE):
+    classified = classify_segmented_plates(segmented, model, preprocess, max_batch_size)
+    return plate_texts(classified)
+
+# Rozpoznawanie wielu tablic rejestracyjnych wraz z pewnościami znaków, dla każdej
+# tablicy zwraca DecodedPlate lub None, gdy tablicy nie udało się przetworzyć
+def recognize_plates_decoded(plate_images, model, preprocess, max_batch_size=MAX_BATCH_SIZE):
+    return decode_plates(classify_segmented_plates(segment_plates(plate_images), model, preprocess, max_batch_size))
+
+# Rozpoznawanie wielu tablic rejestracyjnych: segmentacja wszystkich tablic i
+# klasyfikacja wszystkich znaków jednocześnie. Opcjonalna pamięć podręczna
+# (RecognitionCache) pozwala pominąć tablice rozpoznane wcześniej
+def recognize_plates(plate_images, model, preprocess, max_batch_size=MAX_BATCH_SIZE, cache=None):
+    if cache is None:
+        return recognize_segmented_plates(segment_plates(plate_images), model, preprocess, max_batch_size)
+
+    texts = [None] * len(plate_images)
+    keys = [None] * len(plate_images)
+    for plate_idx, plate_image in enumerate(plate_images):
+        if plate_image is None or plate_image.size == 0:
+            continue
+        keys[plate_idx] = cache.key(plate_image)
+        texts[plate_idx] = cache.get(keys[plate_idx])
+    missing = [plate_idx for plate_idx, text in enumerate(texts) if text is None]
+    missing_texts = recognize_segmented_plates(
+        segment_plates([plate_images[plate_idx] for plate_idx in missing]), model, preprocess, max_batch_size)
+    for plate_idx, text in zip(missing, missing_texts):
+        texts[plate_idx] = text
+        if keys[plate_idx] is not None and text != "[PROCESSING ERROR]":
+            cache.put(keys[plate_idx], text)
+    return texts
+
+# Funkcja przetwarzania tablicy rejestracyjnej
+def process_license_plate(image_path=None, image=None, model=None, preprocess=None, cache=None):
+    # Jeśli wycięty obraz nie został przekazany, przetwarzamy obraz z pliku
+    if image is None:
+        if image_path is None:
+            print("Error processing license plate: Either 'image_path' or 'image' must be provided.")
+            return "[PROCESSING ERROR]"
+        image = cv2.imread(image_path)
+        if image is None:
+            print("Error processing license plate: Błąd: Nie można wczytać obrazu")
+            return "[PROCESSING ERROR]"
+    return recognize_plates([image], model, preprocess, cache=cache)[0]
 
 if __name__ == "__main__":
     # Ładowanie modelu
     model, preprocess = load_model()
 
-    # Przetwarzanie obrazów w folderze
+    # Przetwarzanie obrazów w folderze, wszystkie tablice rozpoznawane są razem
     test_folder = "."
-    for image_name in os.listdir(test_folder):
-        image_path = os.path.join(test_folder, image_name)
-        if image_path.endswith('.png') or image_path.endswith('.jpg'):
-            result_text = process_license_plate(image_path=image_path, model=model, preprocess=preprocess)
-            print(f"Wynik dla {image_name}: {result_text}")
+    image_names = [image_name for image_name in os.listdir(test_folder)
+                   if image_name.endswith('.png') or image_name.endswith('.jpg')]
+    images = [cv2.imread(os.path.join(test_folder, image_name)) for image_name in image_names]
+    image_names = [image_name for image_name, image in zip(image_names, images) if image is not None]
+    images = [image for image in images if image is not None]
+    for image_name, result_text in zip(image_names, recognize_plates(images, model, preprocess)):
+        print(f"Wynik dla {image_name}: {result_text}")
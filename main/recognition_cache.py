@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+import metrics
+
+# skrot percepcyjny (difference hash) wycinka tablicy rejestracyjnej: obrazek w
+# skali szarosci zmniejszany jest do (hash_width + 1) x hash_height pikseli, a
+# kolejne bity okreslaja czy piksel jest jasniejszy od sasiada po prawej. Niemal
+# identyczne wycinki (np. z nieruchomej kamery) daja ten sam skrot
+def plate_hash(image, hash_width=16, hash_height=8):
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (hash_width + 1, hash_height), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    # proporcje wycinka rozrozniaja tablice o podobnej jasnosci
+    aspect = int(round(4 * image.shape[1] / max(image.shape[0], 1)))
+    return f"{aspect}-{np.packbits(bits).tobytes().hex()}"
+
+# pamiec podreczna wynikow rozpoznawania tablic z ograniczonym rozmiarem, usuwaniem
+# najdawniej uzywanych wpisow (LRU), czasem zycia wpisow oraz licznikami trafien,
+# moze byc zapisywana na dysku i wczytywana przy kolejnym uruchomieniu
+class RecognitionCache:
+    def __init__(self, max_size=10000, ttl=24 * 60 * 60, path=None, hash_width=16, hash_height=8):
+        self.max_size = max_size
+        # czas zycia wpisu w sekundach, None - wpisy nie wygasaja
+        self.ttl = ttl
+        self.path = path
+        self.hash_width = hash_width
+        self.hash_height = hash_height
+        # klucz -> (tekst tablicy, czas dodania)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def key(self, image):
+        return plate_hash(image, self.hash_width, self.hash_height)
+
+    def _expired(self, added, now):
+        return self.ttl is not None and now - added > self.ttl
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[1], time.time()):
+                del self.entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                metrics.increment("cache_misses")
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            metrics.increment("cache_hits")
+            return entry[0]
+
+    def put(self, key, text):
+        with self.lock:
+            self.entries[key] = (text, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hit_rate(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return self.stats["hits"] / lookups if lookups else 0.
+
+    def load(self, path=None):
+        path = path or self.path
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)["entries"]
+        now = time.time()
+        with self.lock:
+            # wpisy zapisane sa od najdawniej do ostatnio uzywanych
+            for key, text, added in entries[-self.max_size:]:
+                if not self._expired(added, now):
+                    self.entries[key] = (text, added)
+
+    # zapis do pliku tymczasowego i podmiana, aby przerwany zapis nie uszkodzil pliku
+    def save(self, path=None):
+        path = path or self.path
+        with self.lock:
+            entries = [[key, text, added] for key, (text, added) in self.entries.items()]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -0,0 +1,283 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import cv2
+import metrics
+from recognition_cache import plate_hash
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reads (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    source TEXT,
+    frame_index INTEGER,
+    track_id INTEGER,
+    x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+    score REAL,
+    confidence REAL,
+    char_confidences TEXT,
+    car_box TEXT,
+    thumbnail_id INTEGER REFERENCES thumbnails(id)
+);
+CREATE INDEX IF NOT EXISTS reads_text_time ON reads (text, timestamp);
+CREATE INDEX IF NOT EXISTS reads_time ON reads (timestamp);
+"""
+
+COLUMNS = ("text", "timestamp", "source", "frame_index", "track_id", "x1", "y1", "x2", "y2", "score",
+           "confidence", "char_confidences", "car_box", "thumbnail_id")
+
+# miniatura wycinka tablicy jako JPEG, dluzszy bok co najwyzej max_size pikseli
+def make_thumbnail(image, max_size=160, quality=80):
+    scale = max_size / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Nie można zakodować miniatury")
+    return data.tobytes()
+
+# (skrot, miniatura) wycinka tablicy, niemal identyczne wycinki maja ten sam skrot
+# i w bazie zapisywana jest tylko jedna miniatura
+def thumbnail_entry(image, max_size=160, quality=80):
+    if image is None or image.size == 0:
+        return None
+    return plate_hash(image), make_thumbnail(image, max_size, quality)
+
+# trwaly zapis odczytow tablic w bazie SQLite (tryb WAL) z indeksami na tekst i
+# czas. Odczyty buforowane sa w pamieci i zapisywane paczkami w jednej transakcji
+# po zebraniu buffer_size odczytow lub przy flush(). Opcjonalne miniatury wycinkow
+# sa deduplikowane skrotem percepcyjnym. Obiekt moze byc uzywany z wielu watkow
+class ResultStore:
+    def __init__(self, path, buffer_size=1000, thumbnails=False, thumbnail_size=160, thumbnail_quality=80):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.thumbnails = thumbnails
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_quality = thumbnail_quality
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # w trybie WAL synchronous=NORMAL nie grozi uszkodzeniem bazy, a po awarii
+        # zasilania mozna stracic jedynie ostatnie transakcje
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        # [(wiersz odczytu, (skrot, miniatura) lub None)]
+        self.buffer = []
+        self.stats = {"reads": 0, "flushes": 0, "thumbnails": 0}
+
+    # dodanie jednego odczytu; box - (x1, y1, x2, y2) tablicy, score - pewnosc detekcji,
+    # char_confidences - pewnosci kolejnych znakow, thumbnail - wycinek tablicy
+    # (obraz) lub gotowa krotka z thumbnail_entry
+    def add(self, text, timestamp=None, source=None, box=None, score=None, char_confidences=None,
+            car_box=None, frame_index=None, track_id=None, thumbnail=None):
+        x1, y1, x2, y2 = box if box is not None else (None,) * 4
+        confidence = min(char_confidences, default=0.) if char_confidences is not None else None
+        row = (text, time.time() if timestamp is None else timestamp, source, frame_index, track_id,
+               x1, y1, x2, y2, score, confidence,
+               json.dumps(char_confidences) if char_confidences is not None else None,
+               json.dumps(car_box) if car_box is not None else None)
+        if self.thumbnails and thumbnail is not None and not isinstance(thumbnail, tuple):
+            thumbnail = thumbnail_entry(thumbnail, self.thumbnail_size, self.thumbnail_quality)
+        with self.lock:
+            self.buffer.append((row, thumbnail if self.thumbnails else None))
+            full = len(self.buffer) >= self.buffer_size
+        if full:
+            self.flush()
+
+    # dodanie wszystkich tablic z wyniku w formacie Detections.to_dict / describe_pairs;
+    # plate_images (lub thumbnails) to wycinki (lub gotowe miniatury) tablic w kolejnosci:
+    # tablice kolejnych aut, tablice nieprzypisane
+    def add_result(self, result, source=None, timestamp=None, frame_index=None, plate_images=None,
+                   thumbnails=None):
+        plates = [(plate, car["box"]) for car in result.get("cars", []) for plate in car["plates"]]
+        plates += [(plate, None) for plate in result.get("unattached_plates", [])]
+        for position, (plate, car_box) in enumerate(plates):
+            # tablice bez odczytu (pominiete przez QualityScheduler lub sledzone jeszcze
+            # nierozpoznane) nie sa zapisywane
+            if plate["text"] is None:
+                continue
+            if thumbnails is not None:
+                thumbnail = thumbnails[position]
+            elif plate_images is not None:
+                thumbnail = plate_images[position]
+            else:
+                thumbnail = None
+            self.add(plate["text"], timestamp, source, plate.get("box"), plate.get("score"),
+                     plate.get("confidences"), car_box, frame_index, plate.get("track_id"), thumbnail)
+
+    def flush(self):
+        with self.lock:
+            buffer, self.buffer = self.buffer, []
+            # po close() (np. zadanie GUI konczace sie po zamknieciu okna) odczyty sa pomijane
+            if not buffer or self.connection is None:
+                return
+            with metrics.timer("result_store_flush"), self.connection:
+                thumbnail_ids = {}
+                entries = {entry[0]: entry[1] for _, entry in buffer if entry is not None}
+                if entries:
+                    self.connection.executemany("INSERT OR IGNORE INTO thumbnails (hash, data) VALUES (?, ?)",
+                                                entries.items())
+                    hashes = list(entries)
+                    for start in range(0, len(hashes), 500):
+                        chunk = hashes[start:start + 500]
+                        thumbnail_ids.update(self.connection.execute(
+                            f"SELECT hash, id FROM thumbnails WHERE hash IN ({','.join('?' * len(chunk))})", chunk))
+                rows = [row + (thumbnail_ids.get(entry[0]) if entry is not None else None,)
+                        for row, entry in buffer]
+                self.connection.executemany(
+                    f"INSERT INTO reads ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+            self.stats["reads"] += len(rows)
+            self.stats["flushes"] += 1
+            self.stats["thumbnails"] += len(entries)
+
+    def _query(self, sql, parameters):
+        self.flush()
+        with self.lock:
+            cursor = self.connection.execute(sql, parameters)
+            names = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        reads = []
+        for row in rows:
+            read = dict(zip(names, row))
+            read["box"] = [read.pop(name) for name in ("x1", "y1", "x2", "y2")]
+            for name in ("char_confidences", "car_box"):
+                if read[name] is not None:
+                    read[name] = json.loads(read[name])
+            reads.append(read)
+        return reads
+
+    # odczyty tablicy o danym tekscie (lub poczatku tekstu, prefix=True) w przedziale
+    # czasu [start, end), od najwczesniejszego
+    def find(self, text, start=None, end=None, prefix=False, limit=None):
+        if prefix:
+            # przedzial zamiast LIKE, aby zapytanie korzystalo z indeksu
+            conditions, parameters = ["text >= ? AND text < ?"], [text, text + "\U0010ffff"]
+        else:
+            conditions, parameters = ["text = ?"], [text]
+        return self._reads(conditions, parameters, start, end, limit)
+
+    # wszystkie odczyty w przedziale czasu [start, end)
+    def between(self, start=None, end=None, limit=None):
+        return self._reads([], [], start, end, limit)
+
+    def _reads(self, conditions, parameters, start, end, limit):
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("timestamp < ?")
+            parameters.append(end)
+        sql = f"SELECT {', '.join(('id',) + COLUMNS)} FROM reads"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY timestamp, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return self._query(sql, parameters)
+
+    # liczba odczytow kazdego tekstu wraz z pierwszym i ostatnim wystapieniem
+    def sightings(self, text, start=None, end=None):
+        reads = self.find(text, start, end)
+        if not reads:
+            return {"text": text, "count": 0}
+        return {"text": text, "count": len(reads), "first_seen": reads[0]["timestamp"],
+                "last_seen": reads[-1]["timestamp"], "sources": sorted({read["source"] for read in reads
+                                                                        if read["source"] is not None})}
+
+    def thumbnail(self, thumbnail_id):
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM thumbnails WHERE id = ?", (thumbnail_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def count(self):
+        self.flush()
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM reads").fetchone()[0]
+
+    def close(self):
+        if self.connection is None:
+            return
+        self.flush()
+        with self.lock:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# przepustowosc zapisu i zapytan dla syntetycznych odczytow
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description="Przepustowość zapisu i wyszukiwania odczytów tablic")
+    parser.add_argument("--reads", type=int, default=1000000)
+    parser.add_argument("--plates", type=int, default=50000, help="liczba różnych tablic")
+    parser.add_argument("--buffer-size", type=int, default=1000)
+    parser.add_argument("--thumbnails", action="store_true", help="zapisuj miniatury (jeden wycinek na tablicę)")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--path", help="plik bazy (domyślnie plik tymczasowy)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    letters = np.array(list("BCDEFGHKLNOPRSTUWZ"))
+    digits = np.array(list("0123456789"))
+    texts = ["".join(rng.choice(letters, 2)) + " " + "".join(rng.choice(digits, 5)) for _ in range(args.plates)]
+    crops = {}
+    directory = tempfile.mkdtemp()
+    path = args.path or os.path.join(directory, "results.db")
+    start_time = time.time() - 30 * 24 * 60 * 60
+
+    with ResultStore(path, args.buffer_size, thumbnails=args.thumbnails) as store:
+        plate_indices = rng.integers(0, args.plates, args.reads)
+        timestamps = start_time + np.sort(rng.random(args.reads)) * 30 * 24 * 60 * 60
+        start = time.perf_counter()
+        for i, plate_index in enumerate(plate_indices.tolist()):
+            thumbnail = None
+            if args.thumbnails:
+                thumbnail = crops.get(plate_index)
+                if thumbnail is None:
+                    crop = rng.integers(0, 255, (30, 120, 3), dtype=np.uint8)
+                    thumbnail = crops[plate_index] = thumbnail_entry(crop)
+            store.add(texts[plate_index], float(timestamps[i]), "camera_1", (10, 20, 130, 50), 0.9,
+                      [0.99, 0.98, 0.97, 0.99, 0.95, 0.96, 0.99], thumbnail=thumbnail)
+        store.flush()
+        insert_time = time.perf_counter() - start
+
+        queried = rng.choice(texts, args.queries)
+        start = time.perf_counter()
+        found = sum(len(store.find(text)) for text in queried)
+        query_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for text in queried:
+            store.find(text[:4], prefix=True, limit=100)
+        prefix_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        day = 24 * 60 * 60
+        window = store.between(start_time + day, start_time + day + 60 * 60)
+        window_time = time.perf_counter() - start
+
+    size = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+    print(f"odczytów: {args.reads}, tablic: {args.plates}, baza: {size / 2 ** 20:.1f} MB")
+    print(f"zapis: {args.reads / insert_time:,.0f} odczytów/s ({insert_time:.2f} s)")
+    print(f"wyszukiwanie tablicy: {args.queries / query_time:,.0f} zapytań/s, "
+          f"{1000 * query_time / args.queries:.3f} ms/zapytanie, średnio {found / args.queries:.1f} odczytów")
+    print(f"wyszukiwanie po początku tekstu: {1000 * prefix_time / args.queries:.3f} ms/zapytanie")
+    print(f"odczyty z jednej godziny: {len(window)} w {1000 * window_time:.2f} ms")
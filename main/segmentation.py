@@ -1,14 +1,170 @@
-import os, cv2
+import os, cv2, threading, time
 import numpy as np
 from skimage.filters import threshold_local
 import xml.etree.ElementTree as ET
+import metrics
 
-# przetworzenie tablicy rejestracyjnej
-def process_image(image_path = None, img = None, debug_folder=None, blur_ksize=(5, 5)):
-    # folder na podgląd poszczególnych etapów przetwarzania
-    if debug_folder is not None:
-        os.makedirs(debug_folder, exist_ok=True)
+# metody progowania adaptacyjnego kanału value
+THRESHOLD_BACKENDS = ("skimage", "opencv")
+
+# silnik przetwarzania tablic rejestracyjnych, w pełni zwektoryzowany, przechowuje
+# bufory pomocnicze dla kolejnych obrazków o tych samych wymiarach oraz czasy
+# wykonania poszczególnych etapów
+class PlatePreprocessor:
+    def __init__(self, blur_ksize=(5, 5), threshold_backend="skimage", block_size=61,
+                 offset=15, diff_threshold=40):
+        if threshold_backend not in THRESHOLD_BACKENDS:
+            raise ValueError(f"Nieznana metoda progowania: {threshold_backend}")
+        self.blur_ksize = blur_ksize
+        self.threshold_backend = threshold_backend
+        self.block_size = block_size
+        self.offset = offset
+        self.diff_threshold = diff_threshold
+        # parametry filtru gaussa odpowiadające threshold_local z biblioteki skimage
+        # (sigma = (block_size - 1) / 6, promień obcięty do 4 sigma), obliczenia we
+        # float32 dają wynik zgodny ze skimage z dokładnością do pojedynczych pikseli
+        self.sigma = (block_size - 1) / 6.0
+        radius = int(4 * self.sigma + 0.5)
+        self.gauss_ksize = (2 * radius + 1, 2 * radius + 1)
+        self.buffers = {}
+        self.timings = {}
+        self.calls = 0
+
+    # bufory pomocnicze, powiększane tylko gdy kolejny obrazek jest większy od
+    # dotychczasowych, dzięki czemu wycinki tablic o różnych wymiarach nie
+    # powodują ciągłej alokacji pamięci
+    def _get_buffer(self, name, shape, dtype):
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size:
+            buffer = self.buffers[name] = np.empty(size, dtype=dtype)
+        return buffer[:size].reshape(shape)
+
+    def _add_timing(self, stage, start):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.) + now - start
+        return now
+
+    def reset_timings(self):
+        self.timings = {}
+        self.calls = 0
+
+    # raport ze średnim czasem wykonania poszczególnych etapów
+    def timing_report(self):
+        lines = [f"process_image ({self.threshold_backend}), wywołań: {self.calls}"]
+        total = sum(self.timings.values())
+        for stage, elapsed in self.timings.items():
+            mean_ms = 1000 * elapsed / max(self.calls, 1)
+            share = 100 * elapsed / total if total > 0 else 0.
+            lines.append(f"  {stage:<14} {mean_ms:9.3f} ms  {share:5.1f}%")
+        return "\n".join(lines)
+
+    def process(self, image, debug_folder=None):
+        # folder na podgląd poszczególnych etapów przetwarzania
+        if isinstance(debug_folder, (str, os.PathLike)):
+            os.makedirs(debug_folder, exist_ok=True)
+        self.calls += 1
+        h, w = image.shape[:2]
+
+        save_count = 0
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_org.png", image)
+            save_count += 1
+
+        start = time.perf_counter()
+        # rozmyty obrazek, polepsza efekty binaryzacji
+        blurred = self._get_buffer("blurred", (h, w, 3), np.uint8)
+        cv2.GaussianBlur(image, self.blur_ksize, 0, dst=blurred)
+        start = self._add_timing("blur", start)
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_blurred.png", blurred)
+            save_count += 1
+        # kanał niebieski i czerwony, używane do usunięcia eurobandu
+        # alternatywnie możnaby skorzystać w tym celu ze składowej H modelu HSV
+        # (ale nie zostało to przetestowane)
+        B = blurred[:, :, 0]
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_blue.png", B)
+            save_count += 1
+        R = blurred[:, :, 2]
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_red.png", R)
+            save_count += 1
+        # wartość bezwględna różnicy między kanałem niebieskim a czerwonym, przy
+        # jednorodnie oświetlonych obrazach pozwala na skuteczną lokalizację eurobandu
+        abs_diff = self._get_buffer("abs_diff", (h, w), np.uint8)
+        cv2.absdiff(B, R, dst=abs_diff)
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_BR_diff.png", abs_diff)
+            save_count += 1
+        # maska pozwalająca usunąć euroband
+        diff_thresh = self._get_buffer("diff_thresh", (h, w), np.uint8)
+        cv2.threshold(abs_diff, self.diff_threshold, 255, cv2.THRESH_BINARY_INV, dst=diff_thresh)
+        start = self._add_timing("euroband_mask", start)
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_BR_diff_thresh.png", diff_thresh)
+            save_count += 1
+
+        # kanał value z modelu HSV pozwala na precyzyjne oddzielenie znaków z tablicy
+        # rejestracyjnej
+        hsv = self._get_buffer("hsv", (h, w, 3), np.uint8)
+        cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV, dst=hsv)
+        V = hsv[:, :, 2]
+        start = self._add_timing("value_channel", start)
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_value.png", V)
+            save_count += 1
+        # progowanie adaptacyjne kanału value, piksele nie przekraczające progu
+        # stają się białe, aby obiekty (znaki) były białe
+        if self.threshold_backend == "skimage":
+            T = threshold_local(V, self.block_size, offset=self.offset, method="gaussian")
+            image = ((V <= T).astype(np.uint8)) * 255
+        else:
+            value_float = self._get_buffer("value_float", (h, w), np.float32)
+            value_float[...] = V
+            local_mean = self._get_buffer("local_mean", (h, w), np.float32)
+            cv2.GaussianBlur(value_float, self.gauss_ksize, self.sigma, dst=local_mean,
+                             borderType=cv2.BORDER_REFLECT)
+            cv2.subtract(local_mean, self.offset, dst=local_mean)
+            image = cv2.compare(value_float, local_mean, cv2.CMP_LE)
+        start = self._add_timing("threshold", start)
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_thresh.png", image)
+            save_count += 1
+        # iloczyn z maską usuwającą euroband
+        image = cv2.bitwise_and(image, diff_thresh, dst=image)
+        self._add_timing("bitwise_and", start)
+        if debug_folder is not None:
+            save_debug_image(debug_folder, f"{save_count}_thresh_bitand.png", image)
+            save_count += 1
+        return image
 
+# domyślne silniki przetwarzania, osobne dla każdego wątku, aby bufory pomocnicze
+# nie były współdzielone między wątkami
+_thread_local = threading.local()
+
+def get_preprocessor(blur_ksize=(5, 5), threshold_backend="skimage"):
+    preprocessors = getattr(_thread_local, "preprocessors", None)
+    if preprocessors is None:
+        preprocessors = _thread_local.preprocessors = {}
+    key = (tuple(blur_ksize), threshold_backend)
+    preprocessor = preprocessors.get(key)
+    if preprocessor is None:
+        preprocessor = preprocessors[key] = PlatePreprocessor(blur_ksize, threshold_backend)
+    return preprocessor
+
+# zapis obrazu etapu przetwarzania: debug_folder to folder (zapis od razu przez
+# cv2.imwrite) lub rekord tablicy z DebugSink (kopia w pamięci, zapis w wątku w tle)
+def save_debug_image(debug_folder, name, image):
+    if isinstance(debug_folder, (str, os.PathLike)):
+        cv2.imwrite(os.path.join(debug_folder, name), image)
+    else:
+        debug_folder.add(name, image)
+
+# przetworzenie tablicy rejestracyjnej
+@metrics.timed("process_image")
+def process_image(image_path = None, img = None, debug_folder=None, blur_ksize=(5, 5),
+                  threshold_backend="skimage", preprocessor=None):
     # wczytywanie obrazka tablicy rejestracyjnej ze ścieżki
     if image_path is not None:
         image = cv2.imread(image_path)
@@ -20,64 +176,9 @@ def process_image(image_path = None, img = None, debug_folder=None, blur_ksize=(
     else:
         raise ValueError("Nie przekazano obrazu lub sciezki")
 
-    save_count = 0
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_org.png"), image)
-        save_count += 1
-
-    # rozmyty obrazek, polepsza efekty binaryzacji
-    image = cv2.GaussianBlur(image, blur_ksize, 0)
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_blurred.png"), image)
-        save_count += 1
-    # kanał niebieski i czerwony, używane do usunięcia eurobandu
-    # alternatywnie możnaby skorzystać w tym celu ze składowej H modelu HSV
-    # (ale nie zostało to przetestowane)
-    B = image[:,:,0]
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_blue.png"), B)
-        save_count += 1
-    R = image[:,:,2]
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_red.png"), R)
-        save_count += 1
-    Bh, Bw = B.shape[:]
-    # wartość bezwględna różnicy między kanałem niebieskim a czerwonym, przy
-    # jednorodnie oświetlonych obrazach pozwala na skuteczną lokalizację eurobandu
-    abs_diff = np.zeros(B.shape[:], dtype=np.uint8)
-    for h in range(Bh):
-        for w in range(Bw):
-            abs_diff[h][w] = abs(int(B[h][w])-int(R[h][w]))
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_BR_diff.png"), abs_diff)
-        save_count += 1
-    # maska pozwalająca usunąć euroband
-    _, diff_thresh = cv2.threshold(abs_diff, 40, 255, cv2.THRESH_BINARY)
-    diff_thresh = cv2.bitwise_not(diff_thresh)
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_BR_diff_thresh.png"), diff_thresh)
-        save_count += 1
-
-    # kanał value z modelu HSV pozwala na precyzyjne oddzielenie znaków z tablicy
-    # rejestracyjnej
-    V = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2HSV))[2]
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_value.png"), V)
-        save_count += 1
-    # progowanie adaptacyjne kanału value
-    T = threshold_local(V, 61, offset=15, method="gaussian")
-    image = (V > T).astype("uint8") * 255
-    # negacja obrazu, aby obiekty były białem
-    image = cv2.bitwise_not(image)
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_thresh.png"), image)
-        save_count += 1
-    # iloczyn z maską usuwającą euroband
-    image = cv2.bitwise_and(image, diff_thresh)
-    if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_thresh_bitand.png"), image)
-        save_count += 1
-    return image
+    if preprocessor is None:
+        preprocessor = get_preprocessor(blur_ksize, threshold_backend)
+    return preprocessor.process(image, debug_folder=debug_folder)
 
 # sprawdza czy dany kontur dotyka krawędzi obrazka
 def touches_border(contour, lh, lw):
@@ -88,11 +189,22 @@ def touches_border(contour, lh, lw):
         return False
 
 # funkcja wydzielająca segmenty, w których znajdują się litery
-def get_characters_images(license_plate_image, debug_folder = None, min_char_height_factor=0.4,
+@metrics.timed("get_characters_images")
+def get_characters_images(license_plate_image, debug_folder = None, **kwargs):
+    chars_image, char_boxes, max_gap_index = find_characters(license_plate_image, debug_folder, **kwargs)
+    characters = [chars_image[y:y + h, x:x + w] for x, y, w, h in char_boxes]
+    metrics.increment("characters_segmented", len(characters))
+    return characters, max_gap_index
+
+# wyznaczenie obrazu znaków (tablica oczyszczona z konturów, które nie są znakami),
+# bounding boxów (x, y, w, h) kolejnych znaków i indeksu największej przerwy między
+# znakami. Znaki są wycinkami obrazu znaków, więc do ich odtworzenia wystarczą obraz
+# znaków i bounding boxy (z tego korzysta segmentacja w procesach potomnych)
+def find_characters(license_plate_image, debug_folder = None, min_char_height_factor=0.4,
                     max_char_height_factor=0.9, min_char_aspect_ratio=1., max_char_aspect_ratio=10.,
                     min_char_width_factor = 0.015, max_char_width_factor = 0.18):
     # folder na podgląd poszczególnych etapów przetwarzania
-    if debug_folder is not None:
+    if isinstance(debug_folder, (str, os.PathLike)):
         os.makedirs(debug_folder, exist_ok = True)
 
     image = license_plate_image
@@ -117,16 +229,16 @@ def get_characters_images(license_plate_image, debug_folder = None, min_char_hei
                 and min_char_width <= w <= max_char_width and (touches_border(contour, lh, lw) == False)):
             cv2.drawContours(chars_mask, [contour], 0, (255,), -1)
     if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_chars_mask.png"), chars_mask)
+        save_debug_image(debug_folder, f"{save_count}_chars_mask.png", chars_mask)
         save_count += 1
     # iloczyn przetworzonej tablicy rejestracyjnej z maską znaków
     chars_image = cv2.bitwise_and(image, chars_mask)
     if debug_folder is not None:
-        cv2.imwrite(os.path.join(debug_folder, f"{save_count}_chars_image.png"), chars_image)
+        save_debug_image(debug_folder, f"{save_count}_chars_image.png", chars_image)
         save_count += 1
 
-    # [wycięty znak]
-    characters = []
+    # [bounding box znaku (x, y, w, h)]
+    char_boxes = []
     # [składowa x lewej krawędzi bounding boxa konturu,
     # składowa x prawej krawędzi bounding boxa konturu]
     # służy do znalezienia największej przerwy między znakami, czyli do przerwy
@@ -138,12 +250,10 @@ def get_characters_images(license_plate_image, debug_folder = None, min_char_hei
     contours = sorted(contours, key=lambda c: cv2.boundingRect(c)[0])
     for i, contour in enumerate(contours):
         x, y, w, h = cv2.boundingRect(contour)
-        char = chars_image[y:y + h, x:x + w]
-        characters.append(char)
+        char_boxes.append((x, y, w, h))
         char_locations.append((x, x+w))
         if debug_folder is not None:
-            char_path = os.path.join(debug_folder, f"char_{x}.png")
-            cv2.imwrite(char_path, char)
+            save_debug_image(debug_folder, f"char_{x}.png", chars_image[y:y + h, x:x + w])
 
     # znalezienie indeksu największej przerwy między znakami
     max_gap = 0
@@ -153,7 +263,7 @@ def get_characters_images(license_plate_image, debug_folder = None, min_char_hei
         if gap > max_gap:
             max_gap = gap
             max_gap_index = i
-    return characters, max_gap_index
+    return chars_image, char_boxes, max_gap_index
 
 # utworzenie słownika znaków występujących na polskich rejestracjach
 valid_characters = '0123456789ABCDEFGHIJKLMNOPRSTUVWXYZ'
@@ -161,6 +271,7 @@ CHARS = {char: index for index, char in enumerate(valid_characters)}
 
 # funkcja zmieniająca wymiary obrazka bez deformacji, domyślne rozmiary odpowiadają
 # wymiarą oczekiwanym przez model klasyfikujący znak
+@metrics.timed("reshape_character")
 def reshape_character(char, target_resized = 216, target_padded = 256):
     height, width = char.shape[:2]
     bigger_dimension = max(height, width)
@@ -175,4 +286,50 @@ def reshape_character(char, target_resized = 216, target_padded = 256):
     bottom = target_padded-height-top
     left = (target_padded-width) // 2
     right = target_padded-width-left
-    return cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value = 0)
\ No newline at end of file
+    return cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value = 0)
+
+# sprawdzenie zgodności z pierwotną (pętlową) implementacją oraz raport czasów
+# wykonania poszczególnych etapów na obrazkach z test_data
+if __name__ == '__main__':
+    import glob
+
+    # pierwotna implementacja przetwarzania tablicy rejestracyjnej
+    def process_image_reference(image, blur_ksize=(5, 5)):
+        image = cv2.GaussianBlur(image, blur_ksize, 0)
+        B = image[:, :, 0]
+        R = image[:, :, 2]
+        Bh, Bw = B.shape[:]
+        abs_diff = np.zeros(B.shape[:], dtype=np.uint8)
+        for h in range(Bh):
+            for w in range(Bw):
+                abs_diff[h][w] = abs(int(B[h][w]) - int(R[h][w]))
+        _, diff_thresh = cv2.threshold(abs_diff, 40, 255, cv2.THRESH_BINARY)
+        diff_thresh = cv2.bitwise_not(diff_thresh)
+        V = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2HSV))[2]
+        T = threshold_local(V, 61, offset=15, method="gaussian")
+        image = (V > T).astype("uint8") * 255
+        image = cv2.bitwise_not(image)
+        return cv2.bitwise_and(image, diff_thresh)
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    image_paths = sorted(glob.glob(os.path.join(dir_path, "..", "test_data", "*", "*.*g")))
+    preprocessors = [PlatePreprocessor(threshold_backend=backend) for backend in THRESHOLD_BACKENDS]
+    reference_time = 0.
+    for image_path in image_paths:
+        image = cv2.imread(image_path)
+        if image is None:
+            continue
+        start = time.perf_counter()
+        reference = process_image_reference(image)
+        reference_time += time.perf_counter() - start
+        for preprocessor in preprocessors:
+            result = preprocessor.process(image)
+            mismatched = np.count_nonzero(result != reference)
+            # backend opencv liczy próg w float32, więc może różnić się na
+            # pojedynczych pikselach leżących dokładnie na progu
+            status = "OK" if mismatched == 0 else \
+                f"{mismatched} różnych pikseli ({100 * mismatched / reference.size:.4f}%)"
+            print(f"{os.path.basename(image_path)} [{preprocessor.threshold_backend}]: {status}")
+    print(f"pierwotna implementacja: {1000 * reference_time / max(len(image_paths), 1):.3f} ms / obraz")
+    for preprocessor in preprocessors:
+        print(preprocessor.timing_report())
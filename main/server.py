@@ -0,0 +1,389 @@
+import argparse
+import collections
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import cv2
+import numpy as np
+import torch
+from association import associate
+from YOLO_utils import pairs_from_association, describe_pairs
+from backends import add_backend_arguments, backend_kwargs
+from recognition import segment_plates, classify_plates_characters, plate_texts
+from parallel_segmentation import SegmentationExecutor
+from detector import add_detector_arguments, detector_kwargs, load_detector
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_WEIGHTS = os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt")
+
+# przekroczenie terminu zadania, zwracane klientowi jako 504
+class DeadlineExceeded(Exception):
+    pass
+
+class _Request:
+    __slots__ = ("payload", "size", "deadline", "future", "enqueued")
+
+    def __init__(self, payload, size, deadline):
+        self.payload = payload
+        self.size = size
+        self.deadline = deadline
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+# laczenie zadan z wielu watkow w paczki: watek paczki czeka na pierwsze zadanie,
+# a nastepnie zbiera kolejne, az laczny rozmiar osiagnie max_batch_size lub uplynie
+# max_wait_ms od nadejscia pierwszego. function otrzymuje liste danych zadan
+# i zwraca liste wynikow w tej samej kolejnosci. Rozmiar zadania (size_of) pozwala
+# laczyc zadania zawierajace wiele elementow, np. wszystkie znaki jednego obrazu
+class DynamicBatcher:
+    def __init__(self, function, max_batch_size=8, max_wait_ms=5., size_of=None, name="batcher",
+                 latency_window=1000):
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.size_of = size_of
+        self.name = name
+        self.queue = queue.Queue()
+        # zadanie, ktore nie zmiescilo sie w poprzedniej paczce
+        self.carry = None
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "items": 0, "batches": 0, "expired": 0, "cancelled": 0, "errors": 0}
+        # czasy od przyjecia zadania do zwrocenia wyniku (ostatnie latency_window zadan)
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.batch_sizes = collections.deque(maxlen=latency_window)
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    # dodanie zadania, zwraca Future z wynikiem, deadline to czas time.monotonic()
+    def submit(self, payload, deadline=None):
+        if self.closed:
+            raise RuntimeError(f"{self.name} is closed")
+        size = self.size_of(payload) if self.size_of is not None else 1
+        request = _Request(payload, size, deadline)
+        with self.lock:
+            self.stats["requests"] += 1
+        self.queue.put(request)
+        return request.future
+
+    # wynik zadania z oczekiwaniem co najwyzej do terminu
+    def __call__(self, payload, deadline=None):
+        future = self.submit(payload, deadline)
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0.)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise DeadlineExceeded(f"{self.name}: deadline exceeded") from None
+
+    def queue_depth(self):
+        return self.queue.qsize() + (self.carry is not None)
+
+    def _collect(self):
+        first = self.carry if self.carry is not None else self.queue.get()
+        self.carry = None
+        if first is None:
+            return None
+        batch = [first]
+        total = first.size
+        batch_deadline = first.enqueued + self.max_wait
+        while total < self.max_batch_size:
+            timeout = batch_deadline - time.monotonic()
+            try:
+                request = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            if total + request.size > self.max_batch_size:
+                self.carry = request
+                break
+            batch.append(request)
+            total += request.size
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            now = time.monotonic()
+            active = []
+            for request in batch:
+                if request.deadline is not None and now > request.deadline:
+                    if request.future.set_running_or_notify_cancel():
+                        request.future.set_exception(DeadlineExceeded(f"{self.name}: deadline exceeded"))
+                    with self.lock:
+                        self.stats["expired"] += 1
+                elif request.future.set_running_or_notify_cancel():
+                    active.append(request)
+                else:
+                    with self.lock:
+                        self.stats["cancelled"] += 1
+            if not active:
+                continue
+            try:
+                results = self.function([request.payload for request in active])
+            except Exception as e:
+                with self.lock:
+                    self.stats["errors"] += 1
+                for request in active:
+                    request.future.set_exception(e)
+                continue
+            finished = time.monotonic()
+            for request, result in zip(active, results):
+                request.future.set_result(result)
+            with self.lock:
+                self.stats["batches"] += 1
+                self.stats["items"] += sum(request.size for request in active)
+                self.batch_sizes.append(sum(request.size for request in active))
+                self.latencies.extend(finished - request.enqueued for request in active)
+
+    def report(self):
+        with self.lock:
+            report = dict(self.stats)
+            latencies = 1000 * np.asarray(self.latencies)
+            batch_sizes = list(self.batch_sizes)
+        report["queue_depth"] = self.queue_depth()
+        report["max_batch_size"] = self.max_batch_size
+        report["max_wait_ms"] = 1000 * self.max_wait
+        report["mean_batch_size"] = round(float(np.mean(batch_sizes)), 2) if batch_sizes else 0.
+        if len(latencies):
+            report["latency_p50_ms"] = round(float(np.percentile(latencies, 50)), 3)
+            report["latency_p95_ms"] = round(float(np.percentile(latencies, 95)), 3)
+        return report
+
+    def close(self):
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+# klasyfikator znakow dla jednego zadania, wywolywany tak jak model pytorch przez
+# classify_characters, paczki znakow z wielu zadan laczone sa w watku batchera
+class _BatchedClassifier:
+    def __init__(self, batcher, deadline):
+        self.batcher = batcher
+        self.deadline = deadline
+
+    def __call__(self, batch):
+        return self.batcher(batch, self.deadline)
+
+    def eval(self):
+        return self
+
+# modele YOLO i klasyfikatora znakow trzymane w pamieci, obrazy z wielu
+# jednoczesnych zadan wykrywane sa w jednym wywolaniu yolo([...]), a znaki
+# klasyfikowane w jednym przebiegu klasyfikatora
+class RecognitionServer:
+    def __init__(self, yolo, model, preprocess, max_batch_size=8, max_wait_ms=10.,
+                 char_max_batch_size=64, char_max_wait_ms=5., default_deadline_ms=10000.,
+                 confidence=0.25, iou=0.7, license_plate_car_ioa=0.85, segmentation_workers=0):
+        self.yolo = yolo
+        self.model = model
+        self.preprocess = preprocess
+        self.confidence = confidence
+        self.iou = iou
+        self.license_plate_car_ioa = license_plate_car_ioa
+        self.default_deadline = default_deadline_ms / 1000
+        # segmentacja tablic w procesach roboczych; paczki tablic z jednoczesnych zadan
+        # przetwarzane sa przez executor po kolei
+        self.segmentation_executor = SegmentationExecutor(segmentation_workers) if segmentation_workers > 0 else None
+        self.detector = DynamicBatcher(self._detect_batch, max_batch_size, max_wait_ms, name="detection")
+        self.classifier = DynamicBatcher(self._classify_batch, char_max_batch_size, char_max_wait_ms,
+                                         size_of=len, name="classification")
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "completed": 0, "deadline_exceeded": 0, "errors": 0, "in_flight": 0}
+        self.latencies = collections.deque(maxlen=1000)
+
+    def _detect_batch(self, images):
+        results = self.yolo(images, conf=self.confidence, iou=self.iou, verbose=False)
+        return [(result.boxes.xyxy.cpu().numpy(), result.boxes.cls.cpu().numpy()) for result in results]
+
+    def _classify_batch(self, batches):
+        with torch.no_grad():
+            logits = self.model(torch.cat(batches))
+        return list(torch.split(logits, [len(batch) for batch in batches]))
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    # rozpoznanie aut i tablic na obrazie, deadline_ms liczony od przyjecia zadania
+    def recognize(self, image, deadline_ms=None):
+        start = time.monotonic()
+        deadline = start + (self.default_deadline if deadline_ms is None else deadline_ms / 1000)
+        self._count("requests")
+        self._count("in_flight")
+        try:
+            boxes, classes = self.detector(image, deadline)
+            association = associate(boxes, classes, self.license_plate_car_ioa)
+            pairs = pairs_from_association(image, association, return_boxes=True)
+            plates = [plate for _, plate_list, _, _ in pairs for plate in plate_list]
+            segmented = segment_plates(plates, self.segmentation_executor)
+            if time.monotonic() > deadline:
+                raise DeadlineExceeded("segmentation: deadline exceeded")
+            plate_indices = [plate_idx for plate_idx, plate in enumerate(segmented) if plate is not None]
+            results = classify_plates_characters(_BatchedClassifier(self.classifier, deadline), self.preprocess,
+                                                 [segmented[plate_idx][0] for plate_idx in plate_indices])
+            classified = [None] * len(plates)
+            for plate_idx, (chars, outputs) in zip(plate_indices, results):
+                classified[plate_idx] = (chars, outputs, segmented[plate_idx][1])
+            texts = plate_texts(classified)
+        except DeadlineExceeded:
+            self._count("deadline_exceeded")
+            raise
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            self._count("in_flight", -1)
+        elapsed = time.monotonic() - start
+        with self.lock:
+            self.stats["completed"] += 1
+            self.latencies.append(elapsed)
+        result = describe_pairs(pairs, texts)
+        result["latency_ms"] = round(1000 * elapsed, 3)
+        return result
+
+    def report(self):
+        with self.lock:
+            report = dict(self.stats)
+            latencies = 1000 * np.asarray(self.latencies)
+        if len(latencies):
+            report["latency_p50_ms"] = round(float(np.percentile(latencies, 50)), 3)
+            report["latency_p95_ms"] = round(float(np.percentile(latencies, 95)), 3)
+        report["detection"] = self.detector.report()
+        report["classification"] = self.classifier.report()
+        return report
+
+    def close(self):
+        self.detector.close()
+        self.classifier.close()
+        if self.segmentation_executor is not None:
+            self.segmentation_executor.close()
+
+# POST /recognize z obrazem (JPEG/PNG) w tresci zadania, termin w milisekundach
+# w parametrze deadline_ms lub naglowku X-Deadline-Ms, GET /stats i GET /health
+class RecognitionHandler(BaseHTTPRequestHandler):
+    recognition_server = None
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            self._send_json(200, self.recognition_server.report())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "Nie znaleziono"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/recognize":
+            self._send_json(404, {"error": "Nie znaleziono"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        encoded = np.frombuffer(self.rfile.read(length), dtype=np.uint8)
+        image = cv2.imdecode(encoded, cv2.IMREAD_COLOR) if length else None
+        if image is None:
+            self._send_json(400, {"error": "Nie można odczytać obrazu"})
+            return
+        deadline_ms = parse_qs(url.query).get("deadline_ms", [self.headers.get("X-Deadline-Ms")])[0]
+        try:
+            result = self.recognition_server.recognize(image, float(deadline_ms) if deadline_ms else None)
+        except DeadlineExceeded as e:
+            self._send_json(504, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # BaseHTTPRequestHandler oczekuje adresu klienta w postaci (host, port)
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+def make_http_server(recognition_server, host="127.0.0.1", port=8080, unix_socket=None):
+    handler = type("Handler", (RecognitionHandler,), {"recognition_server": recognition_server})
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def add_server_arguments(parser):
+    parser.add_argument("--max-batch-size", type=int, default=8, help="maksymalna liczba obrazów w paczce YOLO")
+    parser.add_argument("--max-wait-ms", type=float, default=10.,
+                        help="maksymalny czas oczekiwania na zapełnienie paczki YOLO")
+    parser.add_argument("--char-max-batch-size", type=int, default=64,
+                        help="maksymalna liczba znaków w paczce klasyfikatora")
+    parser.add_argument("--char-max-wait-ms", type=float, default=5.,
+                        help="maksymalny czas oczekiwania na zapełnienie paczki klasyfikatora")
+    parser.add_argument("--deadline-ms", type=float, default=10000., help="domyślny termin zadania")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help="wagi modelu YOLO")
+    add_detector_arguments(parser)
+    add_backend_arguments(parser)
+    parser.add_argument("--segmentation-workers", type=int, default=0,
+                        help="liczba procesów segmentujących tablice (0 - segmentacja w wątku zadania)")
+    parser.add_argument("--confidence", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.7)
+    parser.add_argument("--license-plate-car-ioa", type=float, default=0.85)
+
+def server_kwargs(args):
+    return {
+        "max_batch_size": args.max_batch_size,
+        "max_wait_ms": args.max_wait_ms,
+        "char_max_batch_size": args.char_max_batch_size,
+        "char_max_wait_ms": args.char_max_wait_ms,
+        "default_deadline_ms": args.deadline_ms,
+        "confidence": args.confidence,
+        "iou": args.iou,
+        "license_plate_car_ioa": args.license_plate_car_ioa,
+        "segmentation_workers": args.segmentation_workers,
+    }
+
+if __name__ == '__main__':
+    from recognition import load_model
+
+    parser = argparse.ArgumentParser(description="Serwer HTTP detekcji aut i odczytywania rejestracji")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix-socket", help="nasłuchuj na gnieździe uniksowym zamiast TCP")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    model, preprocess = load_model(**backend_kwargs(args))
+    yolo = load_detector(args.weights, **detector_kwargs(args))
+    recognition_server = RecognitionServer(yolo, model, preprocess, **server_kwargs(args))
+    http_server = make_http_server(recognition_server, args.host, args.port, args.unix_socket)
+    print(f"Serwer nasłuchuje na {args.unix_socket or f'http://{args.host}:{args.port}'}", flush=True)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        recognition_server.close()
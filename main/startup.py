@@ -0,0 +1,94 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_WEIGHTS = os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt")
+
+# ladowanie modeli YOLO i klasyfikatora znakow w watku w tle, ciezkie biblioteki
+# (ultralytics, torch, torchvision) importowane sa dopiero w tym watku, a gotowosc
+# modeli sygnalizowana jest zdarzeniem ready
+class ModelLoader:
+    def __init__(self, weights_path=DEFAULT_WEIGHTS, serialized=True, warm_up=True):
+        self.weights_path = weights_path
+        # uzycie gotowego do uruchomienia modelu zapisanego obok wag klasyfikatora
+        self.serialized = serialized
+        # testowe wywolanie obu modeli, aby pierwsze prawdziwe wywolanie nie placilo
+        # kosztu inicjalizacji
+        self.warm_up = warm_up
+        self.yolo = None
+        self.model = None
+        self.preprocess = None
+        self.error = None
+        self.ready = threading.Event()
+        self.timings = {}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._load, daemon=True)
+        self.thread.start()
+        return self
+
+    def _load(self):
+        try:
+            start = loading_start = time.perf_counter()
+            import torch
+            from ultralytics import YOLO
+            import recognition
+            start = self._add_timing("imports", start)
+
+            yolo = YOLO(self.weights_path)
+            start = self._add_timing("yolo", start)
+            model, preprocess = recognition.load_model(serialized=self.serialized)
+            start = self._add_timing("classifier", start)
+
+            if self.warm_up:
+                yolo(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+                with torch.no_grad():
+                    model(preprocess(torch.zeros(1, 3, 256, 256)))
+                self._add_timing("warm_up", start)
+            self.timings["total"] = time.perf_counter() - loading_start
+            self.yolo, self.model, self.preprocess = yolo, model, preprocess
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+    def _add_timing(self, stage, start):
+        now = time.perf_counter()
+        self.timings[stage] = now - start
+        return now
+
+    # oczekiwanie na zaladowanie modeli, bledy ladowania zglaszane sa w watku wywolujacym
+    def wait(self, timeout=None):
+        if not self.ready.wait(timeout):
+            return False
+        if self.error is not None:
+            raise RuntimeError(f"Error loading the models: {self.error}")
+        return True
+
+# pomiar czasu uruchomienia: "cold" bez zapisanego modelu klasyfikatora (jest on
+# wtedy budowany i zapisywany), "warm" z zapisanym modelem, kazdy pomiar w
+# osobnym procesie, aby obejmowal rowniez import bibliotek
+if __name__ == '__main__':
+    if "--load" in sys.argv:
+        loader = ModelLoader(serialized="--eager" not in sys.argv).start()
+        loader.wait()
+        print(json.dumps({stage: round(elapsed, 3) for stage, elapsed in loader.timings.items()}))
+        sys.exit(0)
+
+    from recognition import get_model_path, get_serialized_model_path
+    serialized_path = get_serialized_model_path(get_model_path())
+    runs = [("eager", ["--eager"]), ("cold", []), ("warm", [])]
+    for name, args in runs:
+        if name == "cold" and os.path.exists(serialized_path):
+            os.remove(serialized_path)
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.realpath(__file__), "--load", *args],
+                                capture_output=True, text=True, check=True).stdout
+        elapsed = time.perf_counter() - start
+        print(f"{name:>5}: proces {elapsed:.3f} s, {output.strip().splitlines()[-1]}")
@@ -0,0 +1,454 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import cv2
+from YOLO_utils import crop_boxes_from_image
+from detector import add_detector_arguments, detector_kwargs, load_detector
+from backends import add_backend_arguments, backend_kwargs
+from tiling import add_detection_arguments, detection_kwargs
+from recognition import load_model, segment_plates, classify_segmented_plates, decode_plates
+from parallel_segmentation import SegmentationExecutor
+from image_sink import DebugSink
+from result_store import ResultStore
+from tracker import PlateTracker
+from recognition_cache import RecognitionCache
+from quality_scheduler import QualityScheduler
+import metrics
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_WEIGHTS = os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt")
+
+# znacznik konca strumienia przekazywany miedzy etapami
+_END = object()
+
+# zrodla dzialajace w czasie rzeczywistym (kamery, strumienie sieciowe), dla ktorych
+# domyslnie odrzucane sa najstarsze klatki, gdy detekcja nie nadaza
+def is_live_source(source):
+    if isinstance(source, int):
+        return True
+    return source.isdigit() or "://" in source
+
+# potokowe przetwarzanie strumienia wideo: dekodowanie -> detekcja YOLO ->
+# segmentacja -> rozpoznawanie, kazdy etap dziala w osobnym watku, a etapy
+# polaczone sa kolejkami o ograniczonym rozmiarze (backpressure)
+class StreamPipeline:
+    def __init__(self, source, yolo, model, preprocess, stride=1, queue_size=4,
+                 drop_oldest=None, loop=False, realtime=False, detection_kwargs=None,
+                 tracker=None, cache=None, segmentation_executor=None, debug_sink=None, scheduler=None):
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        self.source = source
+        self.yolo = yolo
+        self.model = model
+        self.preprocess = preprocess
+        # co ktora klatka jest przetwarzana
+        self.stride = max(1, stride)
+        self.drop_oldest = is_live_source(source) if drop_oldest is None else drop_oldest
+        # zapetlenie pliku wideo, przydatne do testow
+        self.loop = loop
+        # odtwarzanie pliku wideo z jego natywna liczba klatek na sekunde, pozwala
+        # symulowac kamere przy uzyciu pliku
+        self.realtime = realtime
+        self.detection_kwargs = detection_kwargs or {}
+        # opcjonalne sledzenie tablic, rozpoznawane sa wtedy tylko tablice wybrane
+        # przez PlateTracker, a pozostale otrzymuja polaczony wynik sledzonej tablicy
+        self.tracker = tracker
+        # opcjonalna pamiec podreczna wynikow rozpoznawania (RecognitionCache)
+        self.cache = cache
+        # opcjonalna segmentacja tablic w procesach roboczych (SegmentationExecutor)
+        self.segmentation_executor = segmentation_executor
+        # opcjonalny zapis obrazow diagnostycznych segmentacji wybranych tablic (DebugSink)
+        self.debug_sink = debug_sink
+        # opcjonalne szeregowanie rozpoznawania tablic w budzecie klatki (QualityScheduler),
+        # pod obciazeniem tablice o niskiej jakosci sa odkladane lub pomijane
+        self.scheduler = scheduler
+
+        self.frames = queue.Queue(queue_size)
+        self.detections = queue.Queue(queue_size)
+        self.segmented = queue.Queue(queue_size)
+        self.results = queue.Queue(queue_size)
+
+        self.stop_event = threading.Event()
+        self.stats_lock = threading.Lock()
+        self.stats = {"decoded": 0, "skipped": 0, "dropped": 0, "processed": 0}
+        self.timings = {}
+        self.error = None
+        self.threads = []
+
+    def _add_timing(self, stage, elapsed):
+        with self.stats_lock:
+            count, total = self.timings.get(stage, (0, 0.))
+            self.timings[stage] = (count + 1, total + elapsed)
+
+    def _count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    # wstawienie elementu do kolejki z blokowaniem, przerywane po zatrzymaniu potoku
+    def _put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # wstawienie klatki do kolejki, gdy kolejka jest pelna usuwana jest najstarsza klatka
+    def _put_drop_oldest(self, q, item):
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    self._count("dropped")
+                except queue.Empty:
+                    pass
+
+    def _decode(self):
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise RuntimeError(f"Nie można otworzyć źródła: {self.source}")
+        fps = capture.get(cv2.CAP_PROP_FPS) if self.realtime else 0
+        index = 0
+        self.stream_start = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                if fps > 0:
+                    delay = self.stream_start + index / fps - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                start = time.perf_counter()
+                # klatki pomijane przez stride nie sa dekodowane, a jedynie pobierane
+                if index % self.stride != 0:
+                    ok = capture.grab()
+                    if ok:
+                        index += 1
+                        self._count("skipped")
+                        continue
+                else:
+                    ok, frame = capture.read()
+                if not ok:
+                    if self.loop and not is_live_source(self.source):
+                        capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        self.stream_start += index / fps if fps > 0 else 0
+                        index = 0
+                        continue
+                    break
+                self._add_timing("decode", time.perf_counter() - start)
+                self._count("decoded")
+                item = {"frame_index": index, "timestamp_ms": capture.get(cv2.CAP_PROP_POS_MSEC),
+                        "frame": frame, "decoded_at": time.perf_counter()}
+                index += 1
+                if self.drop_oldest:
+                    self._put_drop_oldest(self.frames, item)
+                elif not self._put(self.frames, item):
+                    break
+        finally:
+            capture.release()
+
+    # po detekcji zachowywane sa tylko kopie wycinkow tablic, dzieki czemu klatka
+    # zwalniana jest zaraz po detekcji, a nie po rozpoznaniu wszystkich tablic
+    def _detect(self, item):
+        item["detections"] = crop_boxes_from_image(self.yolo, item.pop("frame"), return_detections=True,
+                                                   **self.detection_kwargs).detach("plates")
+        return item
+
+    def _segment(self, item):
+        plates = item["detections"].plate_crops()
+        item["plate_count"] = len(plates)
+        # indeksy tablic, ktore wymagaja rozpoznania
+        if self.tracker is not None:
+            plate_boxes = item["detections"].boxes(item["detections"].plate_indices())
+            item["tracks"] = self.tracker.update(item["frame_index"], plate_boxes, plates)
+            ocr_indices = [i for i, (_, needs_ocr) in enumerate(item["tracks"]) if needs_ocr]
+        else:
+            ocr_indices = list(range(len(plates)))
+        item["cached"] = {}
+        if self.cache is not None:
+            item["keys"] = {i: self.cache.key(plates[i]) for i in ocr_indices if plates[i].size}
+            for i, key in item["keys"].items():
+                text = self.cache.get(key)
+                if text is not None:
+                    item["cached"][i] = text
+            ocr_indices = [i for i in ocr_indices if i not in item["cached"]]
+        item["skipped"] = []
+        if self.scheduler is not None:
+            ocr_indices = self._schedule(item, plates, ocr_indices)
+        item["ocr_indices"] = ocr_indices
+        item["debug"] = None
+        if self.debug_sink is not None:
+            item["debug"] = [self.debug_sink.start_plate(f"frame{item['frame_index']:06d}_plate{i}")
+                             for i in ocr_indices]
+        start = time.perf_counter()
+        item["segmented"] = segment_plates([plates[i] for i in ocr_indices], self.segmentation_executor,
+                                           item["debug"])
+        if self.scheduler is not None:
+            self.scheduler.observe("segmentation", time.perf_counter() - start, len(ocr_indices))
+        return item
+
+    # wybor tablic rozpoznawanych w tej klatce. Obciazenie to zapelnienie kolejek przed
+    # segmentacja, a budzet klatki liczony jest od jej zdekodowania. Tablice sledzone,
+    # ktore sie nie zmiescily, sa odkladane do kolejnych klatek, bez sledzenia pomijane
+    def _schedule(self, item, plates, ocr_indices):
+        load = max(self.frames.qsize() / self.frames.maxsize, self.detections.qsize() / self.detections.maxsize)
+        detections = item["detections"]
+        scores = detections.records["score"][detections.plate_indices()]
+        keys = [item["tracks"][i][0] for i in ocr_indices] if self.tracker is not None else None
+        plan = self.scheduler.plan([plates[i] for i in ocr_indices], [scores[i] for i in ocr_indices],
+                                   time.perf_counter() - item["decoded_at"], load, keys)
+        if self.tracker is not None:
+            # nierozpoznane tablice sledzone sa ponownie rozwazane w kolejnej klatce
+            for j in plan.deferred + plan.dropped:
+                self.tracker.defer(keys[j])
+        for skipped in plan.skipped():
+            skipped["index"] = ocr_indices[skipped["index"]]
+            item["skipped"].append(skipped)
+        return [ocr_indices[j] for j in plan.selected]
+
+    def _recognize(self, item):
+        start = time.perf_counter()
+        classified = classify_segmented_plates(item.pop("segmented"), self.model, self.preprocess)
+        classified = dict(zip(item.pop("ocr_indices"), classified))
+        decoded = decode_plates(list(classified.values()))
+        if self.scheduler is not None:
+            self.scheduler.observe("recognition", time.perf_counter() - start, len(classified))
+        texts = {i: "[PROCESSING ERROR]" if plate is None else plate.text for i, plate in zip(classified, decoded)}
+        confidences = {i: plate.confidences for i, plate in zip(classified, decoded) if plate is not None}
+        debug = item.pop("debug")
+        if debug is not None:
+            for record, plate in zip(debug, decoded):
+                # najmniejsza pewnosc znaku, tablice nieprzetworzone maja pewnosc 0
+                confidence = min(plate.confidences, default=0.) if plate is not None else 0.
+                self.debug_sink.finish(record, None if plate is None else plate.text, confidence)
+        texts.update(item.pop("cached"))
+        if self.cache is not None:
+            keys = item.pop("keys")
+            for i in classified:
+                if i in keys and texts[i] != "[PROCESSING ERROR]":
+                    self.cache.put(keys[i], texts[i])
+
+        result = {"frame_index": item["frame_index"], "timestamp_ms": item["timestamp_ms"]}
+        skipped = item.pop("skipped")
+        if skipped:
+            # tablice pominiete przez QualityScheduler (bez tekstu lub z tekstem sledzonej tablicy)
+            plate_boxes = item["detections"].boxes(item["detections"].plate_indices())
+            result["skipped_plates"] = [dict(plate, box=plate_boxes[plate["index"]]) for plate in skipped]
+        if self.tracker is None:
+            texts = [texts.get(i) for i in range(item["plate_count"])]
+            plate_confidences = [confidences.get(i) for i in range(item["plate_count"])]
+            result.update(item.pop("detections").to_dict(texts, confidences=plate_confidences))
+            return result
+        track_ids = []
+        track_texts = []
+        track_confidences = []
+        for i, (track_id, _) in enumerate(item.pop("tracks")):
+            if i in classified:
+                self.tracker.add_reading(track_id, classified[i])
+            text = self.tracker.text(track_id)
+            track_ids.append(track_id)
+            if text is None:
+                track_texts.append(texts.get(i))
+                track_confidences.append(confidences.get(i))
+            else:
+                # tekst i pewnosci polaczonych odczytow sledzonej tablicy
+                track_texts.append(text)
+                track_confidences.append(self.tracker.confidences(track_id))
+        result.update(item.pop("detections").to_dict(track_texts, track_ids, track_confidences))
+        return result
+
+    # petla etapu przetwarzania: pobiera elementy z kolejki wejsciowej, przetwarza
+    # je i przekazuje do kolejki wyjsciowej
+    def _stage(self, name, function, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is _END:
+                break
+            start = time.perf_counter()
+            item = function(item)
+            self._add_timing(name, time.perf_counter() - start)
+            if not self._put(out_queue, item):
+                return
+
+    # uruchomienie funkcji watku, blad konczy caly potok, a znacznik konca zawsze
+    # jest przekazywany dalej
+    def _run(self, target, out_queue, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+        finally:
+            # znacznik konca nie moze zostac odrzucony, wiec zwalniamy miejsce w
+            # kolejce po zatrzymaniu potoku
+            while True:
+                try:
+                    out_queue.put(_END, timeout=0.1)
+                    break
+                except queue.Full:
+                    if self.stop_event.is_set():
+                        try:
+                            out_queue.get_nowait()
+                        except queue.Empty:
+                            pass
+
+    def start(self):
+        stages = [
+            (self._decode, self.frames),
+            (self._stage, self.detections, "detection", self._detect, self.frames, self.detections),
+            (self._stage, self.segmented, "segmentation", self._segment, self.detections, self.segmented),
+            (self._stage, self.results, "recognition", self._recognize, self.segmented, self.results),
+        ]
+        for target, out_queue, *args in stages:
+            thread = threading.Thread(target=self._run, args=(target, out_queue, *args), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    # wyniki kolejnych przetworzonych klatek
+    def __iter__(self):
+        while True:
+            result = self.results.get()
+            if result is _END:
+                break
+            self._count("processed")
+            yield result
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    # srednie czasy etapow w milisekundach oraz liczniki klatek i rozpoznan
+    def report(self):
+        with self.stats_lock:
+            report = dict(self.stats)
+            report["mean_ms"] = {stage: round(1000 * total / count, 3)
+                                 for stage, (count, total) in self.timings.items()}
+        if self.tracker is not None:
+            with self.tracker.lock:
+                report["tracker"] = dict(self.tracker.stats)
+        if self.cache is not None:
+            with self.cache.lock:
+                report["cache"] = dict(self.cache.stats)
+        if self.debug_sink is not None:
+            report["debug"] = self.debug_sink.report()
+        if self.scheduler is not None:
+            report["scheduler"] = self.scheduler.report()
+        return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Detekcja aut i odczytywanie rejestracji w strumieniu wideo")
+    parser.add_argument("source", help="plik wideo, adres strumienia lub numer kamery")
+    parser.add_argument("-o", "--output", help="plik wynikowy JSONL (domyślnie wyjście standardowe)")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help="wagi modelu YOLO")
+    add_detector_arguments(parser)
+    parser.add_argument("--stride", type=int, default=1, help="przetwarzaj co n-tą klatkę")
+    parser.add_argument("--queue-size", type=int, default=4, help="rozmiar kolejek między etapami")
+    parser.add_argument("--drop-oldest", action=argparse.BooleanOptionalAction, default=None,
+                        help="odrzucaj najstarsze klatki, gdy detekcja nie nadąża "
+                             "(domyślnie tylko dla kamer i strumieni)")
+    parser.add_argument("--loop", action="store_true", help="zapętl plik wideo")
+    parser.add_argument("--realtime", action="store_true",
+                        help="odtwarzaj plik wideo z natywną liczbą klatek na sekundę")
+    parser.add_argument("--max-frames", type=int, default=0,
+                        help="zakończ po przetworzeniu podanej liczby klatek")
+    parser.add_argument("--track", action="store_true",
+                        help="śledź tablice między klatkami i rozpoznawaj je tylko w razie potrzeby")
+    parser.add_argument("--ocr-interval", type=int, default=30,
+                        help="co ile klatek ponownie rozpoznawać śledzoną tablicę")
+    parser.add_argument("--cache", action="store_true",
+                        help="zapamiętuj wyniki rozpoznawania niemal identycznych wycinków tablic")
+    parser.add_argument("--cache-file", help="plik pamięci podręcznej wczytywany przy starcie "
+                                             "i zapisywany po zakończeniu (włącza --cache)")
+    add_backend_arguments(parser)
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="udostępniaj metryki pod http://127.0.0.1:PORT/metrics (0 - wyłączone)")
+    parser.add_argument("--metrics-json", help="plik, do którego zapisywane są metryki po zakończeniu")
+    parser.add_argument("--segmentation-workers", type=int, default=0,
+                        help="liczba procesów segmentujących tablice (0 - segmentacja w wątku potoku)")
+    parser.add_argument("--frame-budget-ms", type=float, default=0,
+                        help="budżet opóźnienia klatki liczony od jej zdekodowania, tablice rozpoznawane są "
+                             "od najlepszej jakości, dopóki szacowany czas mieści się w budżecie (0 - bez budżetu)")
+    parser.add_argument("--min-plate-priority", type=float,
+                        help="pod obciążeniem pomijaj tablice o niższym priorytecie (pole, ostrość, pewność "
+                             "detekcji; włącza szeregowanie tablic)")
+    parser.add_argument("--store", help="baza SQLite, do której dopisywane są odczyty tablic")
+    parser.add_argument("--debug-dir", help="folder na obrazy diagnostyczne segmentacji wybranych tablic")
+    parser.add_argument("--debug-every", type=int, default=1,
+                        help="zapisuj obrazy diagnostyczne co n-tej tablicy (wybrane tablice segmentowane są w "
+                             "procesie potoku, a nie przez --segmentation-workers)")
+    parser.add_argument("--debug-max-confidence", type=float,
+                        help="zapisuj tylko tablice, których najmniej pewny znak ma pewność poniżej progu")
+    parser.add_argument("--debug-max-queue-mb", type=float, default=64.,
+                        help="limit pamięci obrazów oczekujących na zapis, nadmiarowe tablice są pomijane")
+    parser.add_argument("--debug-archive", action="store_true",
+                        help="zapisuj etapy tablicy do jednego pliku ZIP zamiast osobnego folderu")
+    add_detection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+    elif args.metrics_json:
+        metrics.enable()
+
+    yolo = load_detector(args.weights, **detector_kwargs(args))
+    model, preprocess = load_model(**backend_kwargs(args))
+    tracker = PlateTracker(ocr_interval=args.ocr_interval) if args.track else None
+    cache = RecognitionCache(path=args.cache_file) if args.cache or args.cache_file else None
+    executor = SegmentationExecutor(args.segmentation_workers) if args.segmentation_workers > 0 else None
+    debug_sink = None
+    if args.debug_dir:
+        if executor is not None and args.debug_every <= 1:
+            print("Uwaga: przy --debug-every 1 wszystkie tablice segmentowane są w procesie potoku, "
+                  "--segmentation-workers nie zostanie wykorzystane", file=sys.stderr)
+        debug_sink = DebugSink(args.debug_dir, args.debug_every, args.debug_max_confidence,
+                               int(args.debug_max_queue_mb * 2 ** 20), args.debug_archive)
+    scheduler = None
+    if args.frame_budget_ms > 0 or args.min_plate_priority is not None:
+        scheduler_kwargs = {} if args.min_plate_priority is None else {"min_priority": args.min_plate_priority}
+        scheduler = QualityScheduler(args.frame_budget_ms or None, **scheduler_kwargs)
+    pipeline = StreamPipeline(args.source, yolo, model, preprocess, args.stride, args.queue_size,
+                              args.drop_oldest, args.loop, args.realtime,
+                              detection_kwargs(args), tracker, cache, executor, debug_sink, scheduler).start()
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    store = ResultStore(args.store) if args.store else None
+    try:
+        for i, result in enumerate(pipeline, 1):
+            if store is not None:
+                store.add_result(result, source=str(args.source), frame_index=result["frame_index"])
+            line = json.dumps(result, ensure_ascii=False)
+            if output is not None:
+                output.write(line + "\n")
+            else:
+                print(line, flush=True)
+            if args.max_frames and i >= args.max_frames:
+                pipeline.stop()
+    except KeyboardInterrupt:
+        pipeline.stop()
+    finally:
+        if output is not None:
+            output.close()
+        if store is not None:
+            store.close()
+        if cache is not None and cache.path is not None:
+            cache.save()
+        if executor is not None:
+            executor.close()
+        if debug_sink is not None:
+            debug_sink.close()
+        if args.metrics_json:
+            metrics.save_snapshot(args.metrics_json)
+        print(json.dumps(pipeline.report(), ensure_ascii=False), flush=True)
+
+if __name__ == "__main__":
+    main()
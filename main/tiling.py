@@ -0,0 +1,282 @@
+import cv2 as cv
+import numpy as np
+from association import box_areas, intersection_areas
+
+# tryby detekcji: "full" - caly obraz przeskalowany do rozmiaru wejscia YOLO,
+# "tiled" - nachodzace na siebie kafelki w natywnej rozdzielczosci wykrywane w
+# jednej paczce, "coarse-to-fine" - auta wykrywane na zmniejszonym obrazie, a tablice
+# tylko w obszarach aut w natywnej rozdzielczosci
+DETECTION_MODES = ("full", "tiled", "coarse-to-fine")
+
+# wyniki YOLO dla listy obrazow jako krotki (boxy [n, 4] float, klasy [n], pewnosci [n])
+def detect_boxes(yolo, images, confidence=0.25, iou=0.7):
+    if not images:
+        return []
+    results = yolo(images, conf=confidence, iou=iou, verbose=False)
+    return [(result.boxes.xyxy.cpu().numpy().astype(np.float64), result.boxes.cls.cpu().numpy(),
+             result.boxes.conf.cpu().numpy()) for result in results]
+
+def _empty_detections():
+    return np.zeros((0, 4)), np.zeros(0), np.zeros(0)
+
+# poczatki kafelkow wzdluz jednego wymiaru, ostatni kafelek dosuniety jest do krawedzi
+def tile_origins(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)
+    return origins
+
+# kafelki obrazu jako widoki (bez kopiowania) oraz ich polozenie (x, y)
+def make_tiles(image, tile_size=640, overlap=0.2):
+    height, width = image.shape[:2]
+    tiles = []
+    offsets = []
+    for y in tile_origins(height, tile_size, overlap):
+        for x in tile_origins(width, tile_size, overlap):
+            tiles.append(image[y:y + tile_size, x:x + tile_size])
+            offsets.append((x, y))
+    return tiles, offsets
+
+# boxy dotykajace wewnetrznej krawedzi kafelka (nie bedacej krawedzia obrazu), takie
+# obiekty mogly zostac przeciete na granicy kafelkow
+def touches_tile_edge(boxes, tile_box, image_shape, margin=2.):
+    x1, y1, x2, y2 = tile_box
+    height, width = image_shape[:2]
+    cut = np.zeros(len(boxes), dtype=bool)
+    if x1 > 0:
+        cut |= boxes[:, 0] <= x1 + margin
+    if y1 > 0:
+        cut |= boxes[:, 1] <= y1 + margin
+    if x2 < width:
+        cut |= boxes[:, 2] >= x2 - margin
+    if y2 < height:
+        cut |= boxes[:, 3] >= y2 - margin
+    return cut
+
+# laczenie detekcji z wielu kafelkow, osobno dla aut (klasa 0) i tablic (pozostale
+# klasy). Boxy przegladane sa od najpewniejszego: boxy tej samej grupy o IoU powyzej
+# iou lub zawarte w nim w co najmniej contained_ioa sa usuwane jako duplikaty, a boxy
+# przeciete na granicy kafelka, ktore nachodza na niego w co najmniej seam_ioa
+# mniejszego z nich, sa z nim scalane (suma prostokatow)
+def merge_detections(boxes, classes, scores, cut, iou=0.5, contained_ioa=0.8, seam_ioa=0.3):
+    if len(boxes) == 0:
+        return _empty_detections()
+    boxes = boxes.copy()
+    groups = classes != 0
+    areas = box_areas(boxes)
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    # boxy nieprzeciete maja pierwszenstwo przed przecietymi przy tej samej pewnosci
+    for i in np.lexsort((cut, -scores)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed[i] = True
+        # po scaleniu powiekszony box moze nachodzic na kolejne fragmenty
+        while True:
+            candidates = ~suppressed & (groups == groups[i])
+            if not candidates.any():
+                break
+            intersections = intersection_areas(boxes[i:i + 1], boxes)[0]
+            ious = intersections / np.maximum(areas[i] + areas - intersections, 1e-9)
+            ioas = intersections / np.maximum(np.minimum(areas[i], areas), 1e-9)
+            duplicates = candidates & ((ious > iou) | (ioas > contained_ioa))
+            seams = candidates & (cut | cut[i]) & (ioas > seam_ioa)
+            if not (duplicates | seams).any():
+                break
+            if seams.any():
+                merged = boxes[seams | (np.arange(len(boxes)) == i)]
+                boxes[i] = [merged[:, 0].min(), merged[:, 1].min(), merged[:, 2].max(), merged[:, 3].max()]
+                areas[i] = box_areas(boxes[i:i + 1])[0]
+            suppressed |= duplicates | seams
+    keep = np.asarray(keep)
+    return boxes[keep], classes[keep], scores[keep]
+
+# detekcja na nachodzacych na siebie kafelkach tile_size x tile_size w natywnej
+# rozdzielczosci, uruchamianych jako jedna paczka. include_full dodaje do paczki caly
+# obraz, dzieki czemu duze auta, wieksze od kafelka, sa wykrywane w calosci
+def detect_tiled(yolo, image, tile_size=640, overlap=0.2, confidence=0.25, iou=0.7, include_full=True):
+    tiles, offsets = make_tiles(image, tile_size, overlap)
+    if len(tiles) == 1:
+        include_full = False
+    images = tiles + [image] if include_full else tiles
+    boxes, classes, scores, cut = [], [], [], []
+    for index, (tile_boxes, tile_classes, tile_scores) in enumerate(detect_boxes(yolo, images, confidence, iou)):
+        if index < len(tiles):
+            x, y = offsets[index]
+            tile_boxes = tile_boxes + [x, y, x, y]
+            tile = tiles[index]
+            cut.append(touches_tile_edge(tile_boxes, (x, y, x + tile.shape[1], y + tile.shape[0]), image.shape))
+        else:
+            cut.append(np.zeros(len(tile_boxes), dtype=bool))
+        boxes.append(tile_boxes)
+        classes.append(tile_classes)
+        scores.append(tile_scores)
+    return merge_detections(np.concatenate(boxes), np.concatenate(classes), np.concatenate(scores),
+                            np.concatenate(cut), iou)
+
+# detekcja zgrubna, a nastepnie dokladna: auta (i wieksze tablice) wykrywane sa na
+# obrazie zmniejszonym tak, aby dluzszy bok mial coarse_size pikseli, a tablice
+# dodatkowo w obszarach aut (powiekszonych o roi_padding) w natywnej rozdzielczosci,
+# obszary aut uruchamiane sa jako jedna paczka
+def detect_coarse_to_fine(yolo, image, coarse_size=640, confidence=0.25, iou=0.7, roi_padding=0.1,
+                          max_rois=32):
+    height, width = image.shape[:2]
+    scale = min(coarse_size / max(height, width), 1.)
+    if scale < 1.:
+        coarse = cv.resize(image, (round(width * scale), round(height * scale)), interpolation=cv.INTER_AREA)
+    else:
+        coarse = image
+    coarse_boxes, coarse_classes, coarse_scores = detect_boxes(yolo, [coarse], confidence, iou)[0]
+    coarse_boxes = coarse_boxes / scale
+    if scale == 1.:
+        return coarse_boxes, coarse_classes, coarse_scores
+
+    car_indices = np.flatnonzero(coarse_classes == 0)
+    car_indices = car_indices[np.argsort(-coarse_scores[car_indices], kind="stable")][:max_rois]
+    rois = []
+    offsets = []
+    for x1, y1, x2, y2 in coarse_boxes[car_indices]:
+        pad_x, pad_y = roi_padding * (x2 - x1), roi_padding * (y2 - y1)
+        x1, y1 = int(max(x1 - pad_x, 0)), int(max(y1 - pad_y, 0))
+        x2, y2 = int(min(x2 + pad_x, width)), int(min(y2 + pad_y, height))
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            continue
+        rois.append(image[y1:y2, x1:x2])
+        offsets.append((x1, y1))
+
+    boxes, classes, scores = [coarse_boxes], [coarse_classes], [coarse_scores]
+    for (x, y), (roi_boxes, roi_classes, roi_scores) in zip(offsets, detect_boxes(yolo, rois, confidence, iou)):
+        plates = roi_classes != 0
+        boxes.append(roi_boxes[plates] + [x, y, x, y])
+        classes.append(roi_classes[plates])
+        scores.append(roi_scores[plates])
+    boxes, classes, scores = np.concatenate(boxes), np.concatenate(classes), np.concatenate(scores)
+    return merge_detections(boxes, classes, scores, np.zeros(len(boxes), dtype=bool), iou)
+
+# detekcja w wybranym trybie, zwraca (boxy, klasy, pewnosci), tile_size to rozmiar
+# kafelka w trybie "tiled" i dluzszy bok zmniejszonego obrazu w trybie "coarse-to-fine"
+def detect(yolo, image, mode="full", confidence=0.25, iou=0.7, tile_size=640, tile_overlap=0.2):
+    if mode == "full":
+        return detect_boxes(yolo, [image], confidence, iou)[0]
+    if mode == "tiled":
+        return detect_tiled(yolo, image, tile_size, tile_overlap, confidence, iou)
+    if mode == "coarse-to-fine":
+        return detect_coarse_to_fine(yolo, image, tile_size, confidence, iou)
+    raise ValueError(f"Nieznany tryb detekcji: {mode}")
+
+# detekcja na wielu obrazach: w trybie "full" wszystkie obrazy przetwarzane sa jedna
+# paczka, w pozostalych trybach paczke tworza kafelki lub obszary aut jednego obrazu
+def detect_many(yolo, images, mode="full", confidence=0.25, iou=0.7, tile_size=640, tile_overlap=0.2):
+    if mode == "full":
+        return detect_boxes(yolo, list(images), confidence, iou)
+    return [detect(yolo, image, mode, confidence, iou, tile_size, tile_overlap) for image in images]
+
+def add_detection_arguments(parser):
+    parser.add_argument("--confidence", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.7)
+    parser.add_argument("--license-plate-car-ioa", type=float, default=0.85)
+    parser.add_argument("--detection-mode", default="full", choices=DETECTION_MODES,
+                        help="detekcja na całym obrazie, na kafelkach lub zgrubna, a następnie w obszarach aut")
+    parser.add_argument("--tile-size", type=int, default=640,
+                        help="rozmiar kafelka lub dłuższy bok zmniejszonego obrazu")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="względne nakładanie się kafelków")
+
+# argumenty YOLO_utils.crop_boxes_from_image(s)
+def detection_kwargs(args):
+    return {"confidence": args.confidence, "iou": args.iou, "license_plate_car_ioa": args.license_plate_car_ioa,
+            "detection_mode": args.detection_mode, "tile_size": args.tile_size, "tile_overlap": args.tile_overlap}
+
+# porownanie opoznienia i czulosci trybow detekcji na obrazach z test_data wklejonych
+# w natywnej rozdzielczosci w duza klatke (odlegle auta na nagraniu wysokiej
+# rozdzielczosci). test_data nie ma adnotacji, wiec jako wzorzec sluza detekcje
+# trybu "full" na samym obrazie, przeniesione do wspolrzednych klatki
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import json
+    import os
+    import time
+    from ultralytics import YOLO
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description="Porównanie trybów detekcji dla dużych obrazów")
+    parser.add_argument("--weights", default=os.path.join(dir_path, "..", "models", "YOLO", "weights", "best.pt"))
+    parser.add_argument("--frame-size", type=int, nargs=2, default=[3840, 2160], help="szerokość i wysokość klatki")
+    parser.add_argument("--tile-size", type=int, default=640)
+    parser.add_argument("--tile-overlap", type=float, default=0.2)
+    parser.add_argument("--confidence", type=float, default=0.25)
+    parser.add_argument("--match-iou", type=float, default=0.5, help="IoU wymagane do uznania trafienia")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("-o", "--output", help="plik wynikowy JSON")
+    args = parser.parse_args()
+
+    yolo = YOLO(args.weights)
+    paths = sorted(path for path in glob.glob(os.path.join(dir_path, "..", "test_data", "*", "*"))
+                   if path.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")))
+    if args.limit > 0:
+        paths = paths[:args.limit]
+    frame_width, frame_height = args.frame_size
+    rng = np.random.default_rng(0)
+    scenes = []
+    for path in paths:
+        image = cv.imread(path)
+        if image is None:
+            continue
+        # obraz zajmuje co najwyzej polowe klatki w kazdym wymiarze
+        scale = min(frame_width / 2 / image.shape[1], frame_height / 2 / image.shape[0], 1.)
+        if scale < 1.:
+            image = cv.resize(image, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+        reference_boxes, reference_classes, _ = detect(yolo, image, "full", args.confidence)
+        x = int(rng.integers(0, frame_width - image.shape[1] + 1))
+        y = int(rng.integers(0, frame_height - image.shape[0] + 1))
+        frame = np.full((frame_height, frame_width, 3), 114, dtype=np.uint8)
+        frame[y:y + image.shape[0], x:x + image.shape[1]] = image
+        scenes.append((os.path.basename(path), frame, reference_boxes + [x, y, x, y], reference_classes))
+
+    def recall(boxes, classes, reference_boxes, reference_classes, plates):
+        reference = reference_boxes[(reference_classes != 0) == plates]
+        if len(reference) == 0:
+            return 0, 0
+        detected = boxes[(classes != 0) == plates]
+        if len(detected) == 0:
+            return 0, len(reference)
+        intersections = intersection_areas(reference, detected)
+        ious = intersections / (box_areas(reference)[:, None] + box_areas(detected)[None, :] - intersections)
+        return int((ious.max(axis=1) >= args.match_iou).sum()), len(reference)
+
+    report = {}
+    for mode in DETECTION_MODES:
+        detect(yolo, scenes[0][1], mode, args.confidence, tile_size=args.tile_size, tile_overlap=args.tile_overlap)
+        latencies = []
+        found = {"cars": [0, 0], "plates": [0, 0]}
+        for _, frame, reference_boxes, reference_classes in scenes:
+            start = time.perf_counter()
+            boxes, classes, _ = detect(yolo, frame, mode, args.confidence, tile_size=args.tile_size,
+                                       tile_overlap=args.tile_overlap)
+            latencies.append(time.perf_counter() - start)
+            for name, plates in (("cars", False), ("plates", True)):
+                matched, total = recall(boxes, classes, reference_boxes, reference_classes, plates)
+                found[name][0] += matched
+                found[name][1] += total
+        report[mode] = {
+            "latency_p50_ms": round(1000 * float(np.percentile(latencies, 50)), 1),
+            "latency_p95_ms": round(1000 * float(np.percentile(latencies, 95)), 1),
+            "car_recall": round(found["cars"][0] / found["cars"][1], 3) if found["cars"][1] else None,
+            "plate_recall": round(found["plates"][0] / found["plates"][1], 3) if found["plates"][1] else None,
+            "reference_cars": found["cars"][1],
+            "reference_plates": found["plates"][1],
+        }
+
+    print(f"klatki: {len(scenes)} ({frame_width}x{frame_height})")
+    print(f"{'tryb':>15} {'p50 [ms]':>9} {'p95 [ms]':>9} {'czułość aut':>12} {'czułość tablic':>15}")
+    for mode, result in report.items():
+        car_recall = "-" if result["car_recall"] is None else f"{result['car_recall']:.3f}"
+        plate_recall = "-" if result["plate_recall"] is None else f"{result['plate_recall']:.3f}"
+        print(f"{mode:>15} {result['latency_p50_ms']:>9.1f} {result['latency_p95_ms']:>9.1f} "
+              f"{car_recall:>12} {plate_recall:>15}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,190 @@
+import threading
+import cv2
+import numpy as np
+import torch
+from plate_decoding import get_decoder
+
+# ostrosc wycinka tablicy mierzona wariancja laplasjanu
+def sharpness(image):
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(image, cv2.CV_64F).var()
+
+# macierz IoU pomiedzy dwoma zbiorami bounding boxow [x1, y1, x2, y2]
+def iou_matrix(boxes_a, boxes_b):
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    x = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2]) - np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3]) - np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    intersection = np.clip(x, 0, None) * np.clip(y, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+# sledzona tablica rejestracyjna
+class PlateTrack:
+    def __init__(self, track_id, box, frame_index):
+        self.track_id = track_id
+        self.box = box
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.hits = 1
+        # klatka ostatniego rozpoznania oraz parametry wycinka, dla ktorego wykonano
+        # najlepsze dotychczasowe rozpoznanie
+        self.last_ocr_frame = None
+        self.ocr_area = 0
+        self.ocr_sharpness = 0.
+        # [prawdopodobienstwa znakow [liczba znakow, liczba klas], indeks spacji]
+        self.readings = []
+        self.text = None
+        # pewnosci kolejnych znakow polaczonego odczytu
+        self.confidences = None
+
+# sledzenie tablic rejestracyjnych pomiedzy kolejnymi klatkami na podstawie IoU
+# bounding boxow (z odlegloscia srodkow jako drugim kryterium), rozpoznanie znakow
+# wykonywane jest tylko dla nowych tablic, gdy wycinek tablicy stal sie wyraznie
+# wiekszy lub ostrzejszy lub co ocr_interval klatek, a wyniki kolejnych rozpoznan
+# sa laczone glosowaniem
+class PlateTracker:
+    def __init__(self, iou_threshold=0.3, max_center_distance=0.5, max_missed_frames=15,
+                 ocr_interval=30, area_growth=1.3, sharpness_growth=1.3, max_readings=10):
+        self.iou_threshold = iou_threshold
+        # maksymalna odleglosc srodkow bounding boxow wzgledem przekatnej tablicy
+        self.max_center_distance = max_center_distance
+        self.max_missed_frames = max_missed_frames
+        self.ocr_interval = ocr_interval
+        self.area_growth = area_growth
+        self.sharpness_growth = sharpness_growth
+        self.max_readings = max_readings
+        self.tracks = {}
+        self.next_track_id = 0
+        self.lock = threading.Lock()
+        self.stats = {"plates": 0, "ocr_requests": 0, "tracks": 0}
+
+    def _match(self, tracks, boxes):
+        matches = {}
+        if not tracks or not boxes:
+            return matches
+        track_boxes = np.array([track.box for track in tracks], dtype=np.float64)
+        boxes = np.asarray(boxes, dtype=np.float64)
+        ious = iou_matrix(track_boxes, boxes)
+        # zachlanne przypisanie wedlug malejacego IoU
+        for track_idx, box_idx in zip(*np.unravel_index(np.argsort(-ious, axis=None), ious.shape)):
+            if ious[track_idx, box_idx] < self.iou_threshold:
+                break
+            if track_idx in matches or box_idx in matches.values():
+                continue
+            matches[track_idx] = box_idx
+        # pozostale tablice przypisywane wedlug odleglosci srodkow (szybko poruszajace sie auta)
+        track_centers = (track_boxes[:, :2] + track_boxes[:, 2:]) / 2
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        diagonals = np.hypot(track_boxes[:, 2] - track_boxes[:, 0], track_boxes[:, 3] - track_boxes[:, 1])
+        distances = (np.linalg.norm(track_centers[:, None] - centers[None, :], axis=2)
+                     / np.maximum(diagonals[:, None], 1))
+        for track_idx, box_idx in zip(*np.unravel_index(np.argsort(distances, axis=None), distances.shape)):
+            if distances[track_idx, box_idx] > self.max_center_distance:
+                break
+            if track_idx in matches or box_idx in matches.values():
+                continue
+            matches[track_idx] = box_idx
+        return matches
+
+    # aktualizacja sledzonych tablic dla kolejnej klatki, zwraca liste krotek
+    # (id sledzonej tablicy, czy wymagane jest rozpoznanie znakow) w kolejnosci boxes
+    def update(self, frame_index, boxes, crops):
+        with self.lock:
+            self.stats["plates"] += len(boxes)
+            # usuniecie tablic niewidocznych od zbyt wielu klatek
+            for track_id in [track_id for track_id, track in self.tracks.items()
+                             if frame_index - track.last_frame > self.max_missed_frames]:
+                del self.tracks[track_id]
+
+            tracks = list(self.tracks.values())
+            matches = self._match(tracks, boxes)
+            box_tracks = {box_idx: tracks[track_idx] for track_idx, box_idx in matches.items()}
+            updates = []
+            for box_idx, (box, crop) in enumerate(zip(boxes, crops)):
+                track = box_tracks.get(box_idx)
+                if track is None:
+                    track = PlateTrack(self.next_track_id, box, frame_index)
+                    self.tracks[track.track_id] = track
+                    self.next_track_id += 1
+                    self.stats["tracks"] += 1
+                else:
+                    track.box = box
+                    track.last_frame = frame_index
+                    track.hits += 1
+                needs_ocr = self._needs_ocr(track, frame_index, box, crop)
+                if needs_ocr:
+                    self.stats["ocr_requests"] += 1
+                updates.append((track.track_id, needs_ocr))
+            return updates
+
+    def _needs_ocr(self, track, frame_index, box, crop):
+        area = (box[2] - box[0]) * (box[3] - box[1])
+        crop_sharpness = None
+        if (track.last_ocr_frame is None or frame_index - track.last_ocr_frame >= self.ocr_interval
+                or area >= self.area_growth * track.ocr_area):
+            needs_ocr = True
+        else:
+            # ostrosc liczona tylko wtedy, gdy pozostale warunki nie sa spelnione
+            crop_sharpness = sharpness(crop) if crop.size else 0.
+            needs_ocr = crop_sharpness >= self.sharpness_growth * track.ocr_sharpness
+        if needs_ocr:
+            if crop_sharpness is None:
+                crop_sharpness = sharpness(crop) if crop.size else 0.
+            track.last_ocr_frame = frame_index
+            track.ocr_area = max(track.ocr_area, area)
+            track.ocr_sharpness = max(track.ocr_sharpness, crop_sharpness)
+        return needs_ocr
+
+    # rozpoznanie tablicy zlecone w update nie zostalo wykonane (np. odlozone przez
+    # QualityScheduler), tablica zostanie ponownie zgloszona do rozpoznania w kolejnej klatce
+    def defer(self, track_id):
+        with self.lock:
+            track = self.tracks.get(track_id)
+            if track is not None:
+                track.last_ocr_frame = None
+
+    # dodanie wyniku rozpoznania (krotka zwracana przez classify_segmented_plates)
+    # do sledzonej tablicy, zwraca polaczony tekst tablicy
+    def add_reading(self, track_id, classified_plate):
+        with self.lock:
+            track = self.tracks.get(track_id)
+            if track is None:
+                return None
+            if classified_plate is not None:
+                chars, outputs, space_index = classified_plate
+                # odczyty z nieprzetworzonymi znakami nie biora udzialu w glosowaniu
+                if chars and None not in chars:
+                    logits = torch.cat(outputs).float()
+                    probabilities = torch.softmax(logits, 1).numpy()
+                    track.readings.append((probabilities, space_index))
+                    del track.readings[:-self.max_readings]
+                    fused = self._fuse(track.readings)
+                    track.text, track.confidences = fused.text, fused.confidences
+            return track.text
+
+    # polaczenie odczytow: wybierany jest najczestszy uklad tablicy (liczba znakow i
+    # polozenie spacji), dla kazdej pozycji usredniane sa prawdopodobienstwa znakow,
+    # a wynik dekodowany jest z ograniczeniem do formatow tablic (DecodedPlate)
+    @staticmethod
+    def _fuse(readings):
+        layouts = {}
+        for probabilities, space_index in readings:
+            layout = (len(probabilities), space_index)
+            layouts.setdefault(layout, []).append(probabilities)
+        (_, space_index), votes = max(layouts.items(), key=lambda item: len(item[1]))
+        probabilities = torch.from_numpy(np.mean(votes, axis=0)).float()
+        return get_decoder().decode([(torch.log(probabilities.clamp_min(1e-12)), space_index)])[0]
+
+    def text(self, track_id):
+        with self.lock:
+            track = self.tracks.get(track_id)
+            return None if track is None else track.text
+
+    def confidences(self, track_id):
+        with self.lock:
+            track = self.tracks.get(track_id)
+            return None if track is None else track.confidences